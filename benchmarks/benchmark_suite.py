@@ -0,0 +1,467 @@
+"""
+Benchmark suite of the hot paths: every public function of indicator.py and
+every Strategy.perform_strategy implementation of strategy.py, the previous
+implementations kept in the tests as reference, the candle containers, the
+batch scan, the backtesters and the parameter sweep, on seeded synthetic
+candles. Best time, throughput (candles per second) and peak memory of each
+case are written to a JSON file, and two result files can be compared to spot
+regressions.
+
+Usage:
+    python benchmarks/benchmark_suite.py run [--sizes 200 10000] [--filter rsi]
+                                             [--output results.json]
+    python benchmarks/benchmark_suite.py compare baseline.json candidate.json
+                                                 [--threshold 0.1]
+"""
+import argparse
+from dataclasses import dataclass, asdict
+import datetime
+import functools
+import inspect
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+_root_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(_root_dir, 'src'), os.path.join(_root_dir, 'tests')]
+
+import backtester as bt
+import batchindicator as bi
+import candleclock as cc
+from candleframe import CandleFrame
+import indicator as ind
+import parametersweep as psw
+import replaybacktester as rb
+import strategy as st
+from test_candleframe import dataframe_candles
+from test_indicator import loop_bullish_divergence, loop_super_trend
+
+SIZES = [200, 10_000, 100_000, 1_000_000]  # Candles of each case
+SEED = 0
+MIN_SECONDS_PER_CASE = .2  # Cases are repeated until this time is reached...
+MAX_REPEATS = 50  # ...or this number of repetitions
+RESULTS_VERSION = 1  # Format of the results file
+MAX_ROWS_LOOP_REFERENCE = 10_000  # Rows of the quadratic reference implementations
+MAX_ROWS_SERIES_REFERENCE = 100_000  # Rows of the Series based reference implementations
+MAX_ROWS_SIMULATION = 100_000  # Rows of the replay and the parameter sweep
+CANDLES_PER_CONTAINER = 1000  # Candles of each market kept in a candle container
+CANDLES_PER_SCAN = 200  # Candles of each market in a scan, as in services
+BACKTEST_MARKETS = 4  # Markets among which the rows of the backtests are split
+
+# Arguments of each public function of indicator.py, given the candles
+INDICATOR_CASES = {
+    'get_local_minimums': lambda df: ((df['low'], 2), {}),
+    'get_local_maximums': lambda df: ((df['high'], 2), {}),
+    'get_bullish_divergence': lambda df: ((), {
+        'type': 'h', 'candle_body_low_series': df['candle_body_low'],
+        'candle_body_high_series': df['candle_body_high'],
+        'indicator_low_series': ind.get_rsi(df)}),
+    'get_rsi': lambda df: ((df,), {}),
+    'get_ema': lambda df: ((df,), {'period': 200}),
+    'get_atr': lambda df: ((df,), {}),
+    'get_bb': lambda df: ((df,), {}),
+    'get_stochastic_rsi': lambda df: ((df,), {}),
+    'get_stochastic': lambda df: ((df,), {}),
+    'get_atr_stop_loss': lambda df: ((df,), {}),
+    'get_bullish_engulf': lambda df: ((df,), {}),
+    'get_inventory_retracement': lambda df: ((df,), {}),
+    'super_trend': lambda df: ((df, 10, 3), {}),
+    'super_trend_arrays': lambda df: ((df['close'].to_numpy(),
+                                       df['high'].to_numpy() + 1.,
+                                       df['low'].to_numpy() - 1.), {}),
+    'support_and_resistance': lambda df: ((df,), {}),
+    'trade_pro_rejection_zone': lambda df: ((df,), {}),
+}
+
+# Grid of the parameter sweep case
+PARAMETER_SWEEP_GRID = {
+    'volume_quantile': [.7, .8],
+    'ema_period': [30, 100],
+    'atr_factor': [1.5],
+    'rrr': [1.5, 2.],
+}
+
+# Candles given to perform_strategy of each strategy
+STRATEGY_DFS = {
+    'TestStrategy': lambda df: {'df': df},
+    'FakeStrategy': lambda df: {'df': df},
+    'SupportAndResistanceHigherTimeframe': lambda df: {'ht_df': df, 'lt_df': df},
+    'SupportAndResistanceHigherTimeframeBullishDivergence':
+        lambda df: {'ht_df': df, 'lt_df': df},
+    'VolumeTradingStrategy': lambda df: {'df': df},
+    'VolumeEmaTradingStrategy': lambda df: {'df': df},
+}
+
+
+@dataclass(slots=True, kw_only=True)
+class BenchmarkResult:
+    name: str
+    rows: int
+    repeats: int
+    best_seconds: float
+    mean_seconds: float
+    rows_per_second: float
+    peak_memory_bytes: int
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_ohlcv(num_candles, seed=SEED, timeframe='1h'):
+    """
+    :return: array (candles, 6) with timestamp, open, high, low, close and volume.
+    The same seed always gives the same candles
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 * np.exp(np.cumsum(rng.normal(scale=.01, size=num_candles)))
+    open_ = np.concatenate([[100.], close[:-1]]) * (1 + rng.normal(scale=.001, size=num_candles))
+    timestamps = pd.date_range(end='2024-01-01', periods=num_candles,
+                               freq=pd.Timedelta(cc.timeframe_to_milliseconds(timeframe),
+                                                 'ms')).as_unit('ms').asi8
+
+    return np.column_stack([
+        timestamps, open_,
+        np.maximum(open_, close) * (1 + rng.random(num_candles) * .005),
+        np.minimum(open_, close) * (1 - rng.random(num_candles) * .005),
+        close, rng.random(num_candles) * 1000,
+    ])
+
+
+@functools.lru_cache(maxsize=None)
+def synthetic_candles(num_candles, seed=SEED, timeframe='1h'):
+    """
+    :return: DataFrame of candles with the format of an ExchangeHandler
+    """
+    return CandleFrame.from_ohlcv(synthetic_ohlcv(num_candles, seed, timeframe)).to_df()
+
+
+def synthetic_markets(num_markets, num_candles, timeframe='1h'):
+    """
+    :return: dict (symbol, vs_currency) -> synthetic_candles, each market with its seed
+    """
+    return {(f"M{seed}", 'USDT'): synthetic_candles(num_candles, seed, timeframe)
+            for seed in range(num_markets)}
+
+
+def benchmark_cases():
+    """
+    :return: dict name -> function receiving the number of rows and returning
+    the function to time, or None if the case is not run with those rows.
+    Every public indicator and strategy must have a case
+    """
+    public_indicators = {name for name, function in inspect.getmembers(ind, inspect.isfunction)
+                         if function.__module__ == ind.__name__ and not name.startswith('_')}
+    strategies = {name for name, cls in inspect.getmembers(st, inspect.isclass)
+                  if issubclass(cls, st.Strategy) and not inspect.isabstract(cls)}
+
+    missing = (public_indicators - set(INDICATOR_CASES)) | (strategies - set(STRATEGY_DFS))
+    if missing:
+        raise ValueError(f"No benchmark case for {sorted(missing)}")
+
+    cases = {}
+    for name in sorted(public_indicators):
+        cases[f"indicator.{name}"] = _indicator_case(getattr(ind, name), INDICATOR_CASES[name])
+    for name in sorted(strategies):
+        cases[f"strategy.{name}"] = _strategy_case(getattr(st, name), STRATEGY_DFS[name])
+
+    cases['reference.loop_bullish_divergence'] = _reference_bullish_divergence_case
+    cases['reference.loop_super_trend'] = _reference_super_trend_case
+    for name, build in CONTAINERS.items():
+        cases[f"container.{name}"] = _container_case(build)
+    for name, scan in SCANS.items():
+        cases[f"scan.{name}"] = _scan_case(scan)
+    for strategy_class in [st.VolumeEmaTradingStrategy, st.VolumeTradingStrategy,
+                           st.SupportAndResistanceHigherTimeframe]:
+        cases[f"backtester.{strategy_class.__name__}"] = _backtester_case(strategy_class)
+    for strategy_class in [st.VolumeEmaTradingStrategy, st.VolumeTradingStrategy]:
+        cases[f"replay.{strategy_class.__name__}"] = _replay_case(strategy_class)
+    for workers in sorted({1, os.cpu_count()}):
+        cases[f"parameter_sweep.workers_{workers}"] = _parameter_sweep_case(workers)
+
+    return cases
+
+
+def _indicator_case(function, arguments):
+    def prepare(rows):
+        args, kwargs = arguments(synthetic_candles(rows))
+        return lambda: function(*args, **kwargs)
+
+    return prepare
+
+
+def _strategy_case(strategy_class, dfs):
+    def prepare(rows):
+        df = synthetic_candles(rows)
+        strategy = strategy_class()
+        strategy_dfs = dfs(df)
+        entry_price = float(df['close'].iloc[-1])
+        return lambda: strategy.perform_strategy(entry_price, **strategy_dfs)
+
+    return prepare
+
+
+def _reference_bullish_divergence_case(rows):
+    if rows > MAX_ROWS_LOOP_REFERENCE:
+        return None
+
+    df = synthetic_candles(rows)
+    series = (df['candle_body_low'], df['candle_body_high'], ind.get_rsi(df))
+    return lambda: loop_bullish_divergence('h', *series)
+
+
+def _reference_super_trend_case(rows):
+    if rows > MAX_ROWS_SERIES_REFERENCE:
+        return None
+
+    df = synthetic_candles(rows)
+    return lambda: loop_super_trend(df, 10, 3)
+
+
+# Containers of the candles of many markets, built from the lists returned by ccxt.
+# DataFrame is the one built before CandleFrame
+CONTAINERS = {
+    'DataFrame': lambda candles_list: dataframe_candles(candles_list).iloc[:-1].copy(),
+    'CandleFrame': lambda candles_list: CandleFrame.from_ohlcv(candles_list).closed(),
+    'CandleFrame_float32': lambda candles_list: CandleFrame.from_ohlcv(
+        candles_list, dtype=np.float32).closed(),
+}
+
+
+def _container_case(build):
+    def prepare(rows):
+        candles_list = synthetic_ohlcv(min(rows, CANDLES_PER_CONTAINER)).tolist()
+        num_markets = max(rows // CANDLES_PER_CONTAINER, 1)
+        return lambda: [build(candles_list) for _ in range(num_markets)]
+
+    return prepare
+
+
+def _per_market_scan(strategy, entry_prices, dfs):
+    for market, df in dfs.items():
+        strategy.perform_strategy(entry_price=entry_prices[market], df=df)
+
+
+def _entry_conditions(strategy, entry_prices, dfs):
+    batch = bi.stack_candles(dfs)
+    return lambda: bi.volume_ema_entry_conditions(
+        batch, np.array([entry_prices[market] for market in batch.markets]))
+
+
+# Scans of the universe with VolumeEmaTradingStrategy: one perform_strategy call
+# per market against a single perform_strategy_batch call, whose time is split
+# between stacking the candles into arrays and computing the entry conditions
+SCANS = {
+    'VolumeEmaTradingStrategy.per_market':
+        lambda strategy, entry_prices, dfs: lambda: _per_market_scan(strategy, entry_prices, dfs),
+    'VolumeEmaTradingStrategy.batch':
+        lambda strategy, entry_prices, dfs: lambda: strategy.perform_strategy_batch(entry_prices,
+                                                                                    dfs),
+    'VolumeEmaTradingStrategy.batch_stacking':
+        lambda strategy, entry_prices, dfs: lambda: bi.stack_candles(dfs),
+    'VolumeEmaTradingStrategy.batch_computing': _entry_conditions,
+}
+
+
+def _scan_case(scan):
+    def prepare(rows):
+        dfs = synthetic_markets(max(rows // CANDLES_PER_SCAN, 1), min(rows, CANDLES_PER_SCAN))
+        entry_prices = {market: df['close'].iloc[-1] for market, df in dfs.items()}
+        return scan(st.VolumeEmaTradingStrategy(), entry_prices, dfs)
+
+    return prepare
+
+
+def _backtest_markets(rows):
+    return synthetic_markets(BACKTEST_MARKETS, max(rows // BACKTEST_MARKETS, 1), timeframe='5m')
+
+
+def _backtester_case(strategy_class):
+    def prepare(rows):
+        dfs = _backtest_markets(rows)
+        return lambda: bt.VectorizedBacktester(strategy_class(), timeframe='5m',
+                                               fee_factor=.001).run(dfs)
+
+    return prepare
+
+
+def _replay_case(strategy_class):
+    def prepare(rows):
+        if rows > MAX_ROWS_SIMULATION:
+            return None
+
+        candles = _backtest_markets(rows)
+        return lambda: rb.ReplayBacktester(strategy_class(), candles, timeframe='5m',
+                                           strategy_timeframe='4h',
+                                           vs_currency_available=1000.).run()
+
+    return prepare
+
+
+def _parameter_sweep_case(workers):
+    def prepare(rows):
+        if rows > MAX_ROWS_SIMULATION:
+            return None
+
+        dfs = _backtest_markets(rows)
+        parameter_sets = psw.grid_parameters(PARAMETER_SWEEP_GRID)
+        return lambda: psw.ParameterSweep(st.VolumeEmaTradingStrategy, dfs, timeframe='5m',
+                                          fee_factor=.001, workers=workers).run(parameter_sets)
+
+    return prepare
+
+
+def run_case(name, function, rows):
+    """
+    Times function until MIN_SECONDS_PER_CASE or MAX_REPEATS, and measures its
+    peak memory in a separate call, since tracing slows it down
+    :return: BenchmarkResult
+    """
+    times = []
+    while len(times) < MAX_REPEATS and (not times or sum(times) < MIN_SECONDS_PER_CASE):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        function()
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    best_seconds = min(times)
+    return BenchmarkResult(name=name, rows=rows, repeats=len(times),
+                           best_seconds=best_seconds,
+                           mean_seconds=sum(times) / len(times),
+                           rows_per_second=rows / best_seconds if best_seconds else float('inf'),
+                           peak_memory_bytes=peak_memory)
+
+
+def run(sizes, name_filter=None):
+    """
+    :return: list of BenchmarkResult of the cases whose name contains name_filter
+    """
+    cases = {name: prepare for name, prepare in benchmark_cases().items()
+             if name_filter is None or name_filter in name}
+    results = []
+
+    print(f"{'case':<70} {'rows':>9} {'best (s)':>10} {'rows/s':>12} {'peak (MB)':>10}")
+    for rows in sizes:
+        for name, prepare in cases.items():
+            function = prepare(rows)
+            if function is None:
+                continue
+            result = run_case(name, function, rows)
+            results.append(result)
+            print(f"{name:<70} {rows:>9} {result.best_seconds:>10.5f} "
+                  f"{result.rows_per_second:>12.0f} {result.peak_memory_bytes / 2 ** 20:>10.2f}")
+
+    return results
+
+
+def _metadata():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=_root_dir,
+                                capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        'version': RESULTS_VERSION,
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.platform(),
+        'seed': SEED,
+    }
+
+
+def save_results(results, file_path):
+    with open(file_path, 'w') as file:
+        json.dump({'metadata': _metadata(),
+                   'results': [asdict(result) for result in results]}, file, indent=2)
+
+
+def load_results(file_path):
+    """
+    :return: metadata and dict (name, rows) -> BenchmarkResult
+    """
+    with open(file_path) as file:
+        content = json.load(file)
+
+    if content['metadata'].get('version') != RESULTS_VERSION:
+        raise ValueError(f"{file_path} has results of version "
+                         f"{content['metadata'].get('version')}, expected {RESULTS_VERSION}")
+
+    return content['metadata'], {(result['name'], result['rows']): BenchmarkResult(**result)
+                                 for result in content['results']}
+
+
+def compare(baseline_path, candidate_path, threshold):
+    """
+    Prints time and memory ratios (candidate / baseline) of the cases in both files
+    :param threshold: relative slowdown considered a regression (0.1 is 10%)
+    :return: list of (name, rows) of the regressions
+    """
+    baseline_metadata, baseline = load_results(baseline_path)
+    candidate_metadata, candidate = load_results(candidate_path)
+    print(f"baseline:  {baseline_metadata['commit']} ({baseline_metadata['date']})")
+    print(f"candidate: {candidate_metadata['commit']} ({candidate_metadata['date']})")
+
+    regressions = []
+    print(f"{'case':<70} {'rows':>9} {'base (s)':>10} {'cand (s)':>10} "
+          f"{'time x':>7} {'memory x':>9}")
+    for key in sorted(baseline.keys() & candidate.keys()):
+        base, cand = baseline[key], candidate[key]
+        time_ratio = cand.best_seconds / base.best_seconds if base.best_seconds else float('inf')
+        memory_ratio = cand.peak_memory_bytes / base.peak_memory_bytes \
+            if base.peak_memory_bytes else float('nan')
+        is_regression = time_ratio > 1 + threshold
+        if is_regression:
+            regressions.append(key)
+
+        print(f"{key[0]:<70} {key[1]:>9} {base.best_seconds:>10.5f} {cand.best_seconds:>10.5f} "
+              f"{time_ratio:>7.2f} {memory_ratio:>9.2f}{'  REGRESSION' if is_regression else ''}")
+
+    only_baseline = len(baseline.keys() - candidate.keys())
+    only_candidate = len(candidate.keys() - baseline.keys())
+    if only_baseline or only_candidate:
+        print(f"Not compared: {only_baseline} cases only in baseline, "
+              f"{only_candidate} only in candidate")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="run the benchmarks")
+    run_parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    run_parser.add_argument('--filter', default=None,
+                            help="only cases whose name contains this text")
+    run_parser.add_argument('--output', default='benchmark_results.json')
+
+    compare_parser = subparsers.add_parser('compare', help="compare two results files")
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('candidate')
+    compare_parser.add_argument('--threshold', type=float, default=.1)
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        save_results(run(args.sizes, args.filter), args.output)
+        print(f"Results written to {args.output}")
+    else:
+        regressions = compare(args.baseline, args.candidate, args.threshold)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
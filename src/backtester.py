@@ -0,0 +1,298 @@
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+
+import candleclock as cc
+import config
+import model
+import strategy as st
+
+
+BACKTEST_WINDOW = 200  # Candles given to the strategy in each scan, as in services
+EXIT_SCAN_CANDLES = 256  # Candles after the entries checked at once when looking for exits
+EXIT_SCAN_ELEMENTS = 4_000_000  # Maximum (entries x candles) compared at once
+
+# Columns of the trades returned by VectorizedBacktester: model.Trade fields
+# (except id), candles of entry and exit, and result after fees
+TRADE_COLUMNS = ['symbol', 'vs_currency_symbol', 'timeframe', 'stop_loss', 'entry_price',
+                 'take_profit', 'status', 'vs_currency_entry', 'crypto_quantity_entry',
+                 'entry_fee_vs_currency', 'position', 'entry_date',
+                 'entry_order_exchange_id', 'percentage_change_1h_on_entry',
+                 'percentage_change_1d_on_entry', 'percentage_change_7d_on_entry',
+                 'strategy_name', 'is_real', 'vs_currency_result_no_fees',
+                 'crypto_quantity_exit', 'exit_fee_vs_currency', 'exit_date',
+                 'entry_index', 'exit_index', 'result']
+
+
+def real_rrr_take_profit(entry_price, stop_loss, take_profit, fee_factor):
+    """
+    Vectorized version of the fee model of services.position_can_be_profitable
+    with update_st_out_to_get_real_rrr. The traded amount does not change the
+    result, since fees are proportional to it
+    :param entry_price: array of entry prices
+    :param stop_loss: array of strategy stop losses
+    :param take_profit: array of strategy take profits
+    :param fee_factor: taker fee factor
+    :return: take profit widened to keep the strategy rrr after fees, and whether
+    each position can be profitable
+    """
+    exit_fee_win = fee_factor * take_profit
+    exit_fee_loss = fee_factor * stop_loss
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        theoretical_rrr = np.abs(take_profit - entry_price) / np.abs(entry_price - stop_loss)
+        new_take_profit = entry_price + exit_fee_win + \
+            theoretical_rrr * np.abs(entry_price - stop_loss + exit_fee_loss)
+        real_rrr = np.abs(new_take_profit - entry_price - exit_fee_win) / \
+            np.abs(entry_price - stop_loss - exit_fee_loss)
+
+    return new_take_profit, (1 < real_rrr) & (real_rrr < 2.5)
+
+
+def vs_currency_on_entry(entry_price, stop_loss, vs_currency_available,
+                         max_vs_currency_to_use):
+    """
+    Vectorized version of services.manage_risk_on_entry
+    :return: array of vs_currency used on each entry
+    """
+    risked_percentage = 100 * np.abs(entry_price - stop_loss) / entry_price
+    vs_currency = np.where(risked_percentage <= config.MAX_PERCENTAGE_TO_RISK,
+                           vs_currency_available,
+                           vs_currency_available * config.MAX_PERCENTAGE_TO_RISK / risked_percentage)
+
+    return np.minimum(vs_currency, max_vs_currency_to_use)
+
+
+def first_exits(high, low, entry_indexes, take_profit, stop_loss):
+    """
+    First candle after each entry whose price range reaches its take profit or
+    stop loss. The take profit has priority when both are reached in the same
+    candle, as in exitevaluator.decide_exit. Candles are scanned forward in blocks
+    of EXIT_SCAN_CANDLES for every pending entry at once
+    :param high: array (candles,)
+    :param low: array (candles,)
+    :param entry_indexes: array with the candle of each entry
+    :return: array with the exit candle of each entry (-1 if it does not exit)
+    and boolean array telling if the exit is the take profit
+    """
+    num_candles = len(high)
+    exit_indexes = np.full(len(entry_indexes), -1)
+    is_take_profit = np.zeros(len(entry_indexes), dtype=bool)
+
+    # Padding never reaches any level, so that every block has the same length
+    high_blocks = sliding_window_view(np.concatenate([high, np.full(EXIT_SCAN_CANDLES, -np.inf)]),
+                                      EXIT_SCAN_CANDLES)
+    low_blocks = sliding_window_view(np.concatenate([low, np.full(EXIT_SCAN_CANDLES, np.inf)]),
+                                     EXIT_SCAN_CANDLES)
+    entries_per_step = max(EXIT_SCAN_ELEMENTS // EXIT_SCAN_CANDLES, 1)
+
+    pending = np.arange(len(entry_indexes))
+    offset = 1
+    while len(pending):
+        starts = entry_indexes[pending] + offset
+        pending = pending[starts < num_candles]
+        starts = starts[starts < num_candles]
+        still_pending = []
+
+        for step in range(0, len(pending), entries_per_step):
+            entries = pending[step:step + entries_per_step]
+            entry_starts = starts[step:step + entries_per_step]
+            reaches_take_profit = high_blocks[entry_starts] >= take_profit[entries, np.newaxis]
+            reaches_level = reaches_take_profit | \
+                (low_blocks[entry_starts] <= stop_loss[entries, np.newaxis])
+
+            exits = reaches_level.any(axis=1)
+            first = reaches_level[exits].argmax(axis=1)
+            exit_indexes[entries[exits]] = entry_starts[exits] + first
+            is_take_profit[entries[exits]] = reaches_take_profit[exits][np.arange(len(first)), first]
+            still_pending.append(entries[~exits])
+
+        pending = np.concatenate(still_pending) if still_pending else pending[:0]
+        offset += EXIT_SCAN_CANDLES
+
+    return exit_indexes, is_take_profit
+
+
+def _sequential_entries(entry_indexes, exit_indexes):
+    """
+    Only one position per market can be opened. A new one can be entered in the
+    scan where the previous one is closed
+    :return: positions of entry_indexes actually entered
+    """
+    entered = []
+    next_free_candle = 0
+
+    while True:
+        position = np.searchsorted(entry_indexes, next_free_candle)
+        if position >= len(entry_indexes):
+            break
+
+        entered.append(position)
+        if exit_indexes[position] < 0:
+            # Still opened at the end of the history
+            break
+        next_free_candle = exit_indexes[position]
+
+    return np.array(entered, dtype=int)
+
+
+class VectorizedBacktester:
+    """
+    Evaluates a strategy on long candle histories. Entry signals, stop losses and
+    take profits of every candle are computed at once with
+    Strategy.backtest_signals, the fee model of the bot widens take profits and
+    discards unprofitable entries, and exits are found by scanning the following
+    candles with array operations. Each entry happens at the close of its candle.
+    Amount precision and exchange limits are not taken into account.
+    """
+    def __init__(self, strategy: st.Strategy, timeframe, fee_factor,
+                 window=BACKTEST_WINDOW, vs_currency_available=config.MAX_VS_CURRENCY_TO_USE,
+                 max_vs_currency_to_use=config.MAX_VS_CURRENCY_TO_USE):
+        """
+        :param strategy: Strategy implementing backtest_signals
+        :param timeframe: timeframe of the candles, as in the bot
+        :param fee_factor: taker fee factor of every trade
+        :param window: candles given to the strategy in each scan
+        :param vs_currency_available: free vs_currency on every entry
+        :param max_vs_currency_to_use: maximum vs_currency used on an entry
+        """
+        self._strategy = strategy
+        self._timeframe = timeframe
+        self._fee_factor = fee_factor
+        self._window = window
+        self._vs_currency_available = vs_currency_available
+        self._max_vs_currency_to_use = max_vs_currency_to_use
+
+    def run(self, dfs):
+        """
+        :param dfs: dict (symbol, vs_currency) -> candles with the format of an
+        ExchangeHandler, oldest first
+        :return: pd.DataFrame with one row per trade and the columns of model.Trade
+        (except id), plus entry_index, exit_index and result
+        """
+        trades = [self.run_market(symbol, vs_currency, df)
+                  for (symbol, vs_currency), df in dfs.items()]
+
+        return pd.concat(trades, ignore_index=True) if trades else self._trades_frame({})
+
+    def run_market(self, symbol, vs_currency, df):
+        """
+        :return: trades of a single market, see run
+        """
+        signals = self._strategy.backtest_signals(df, self._window)
+        close = df['close'].to_numpy(dtype=float)
+        high = df['high'].to_numpy(dtype=float)
+        low = df['low'].to_numpy(dtype=float)
+
+        candidates = np.flatnonzero(signals['can_enter'])
+        entry_price = close[candidates]
+        stop_loss = signals['stop_loss'][candidates]
+        take_profit, can_be_profitable = real_rrr_take_profit(
+            entry_price, stop_loss, signals['take_profit'][candidates], self._fee_factor)
+
+        candidates = candidates[can_be_profitable]
+        entry_price = entry_price[can_be_profitable]
+        stop_loss = stop_loss[can_be_profitable]
+        take_profit = take_profit[can_be_profitable]
+
+        exit_indexes, is_take_profit = first_exits(high, low, candidates, take_profit,
+                                                   stop_loss)
+        entered = _sequential_entries(candidates, exit_indexes)
+
+        return self._trades(symbol, vs_currency, df, candidates[entered],
+                            entry_price[entered], stop_loss[entered], take_profit[entered],
+                            exit_indexes[entered], is_take_profit[entered])
+
+    def _trades(self, symbol, vs_currency, df, entry_indexes, entry_price, stop_loss,
+                take_profit, exit_indexes, is_take_profit):
+        # Same amounts as services.compute_strategy_and_try_to_enter and
+        # services.close_position_on_exit_decision for simulated trades
+        fee_factor = self._fee_factor
+        vs_currency_entry = vs_currency_on_entry(entry_price, stop_loss,
+                                                 self._vs_currency_available,
+                                                 self._max_vs_currency_to_use)
+        amount = vs_currency_entry / entry_price
+        crypto_quantity_entry = amount * (1 - fee_factor)
+        entry_fee_vs_currency = amount * fee_factor * entry_price
+
+        exited = exit_indexes >= 0
+        exit_price = np.where(exited, np.where(is_take_profit, take_profit, stop_loss), np.nan)
+        crypto_quantity_exit = np.where(exited, crypto_quantity_entry * (1 - fee_factor), np.nan)
+        vs_currency_exit = exit_price * crypto_quantity_exit
+        exit_fee_vs_currency = vs_currency_exit * fee_factor
+        vs_currency_result_no_fees = vs_currency_exit - vs_currency_entry
+        result = vs_currency_result_no_fees - entry_fee_vs_currency - exit_fee_vs_currency
+
+        # Entries and exits are dated at the close of their candles. Only the dates
+        # of the trades are formatted, since formatting is slow
+        candle_duration = pd.Timedelta(milliseconds=cc.timeframe_to_milliseconds(self._timeframe))
+        datetimes = df['datetime'].to_numpy()
+
+        def close_dates(indexes):
+            return (pd.DatetimeIndex(datetimes[indexes]) + candle_duration) \
+                .strftime("%d/%m/%Y %H:%M:%S").to_numpy(dtype=object)
+
+        return self._trades_frame({
+            'symbol': symbol,
+            'vs_currency_symbol': vs_currency,
+            'timeframe': self._timeframe,
+            'stop_loss': stop_loss,
+            'entry_price': entry_price,
+            'take_profit': take_profit,
+            'status': np.where(~exited, model.TradeStatus.OPENED,
+                               np.where(result > 0, model.TradeStatus.WON,
+                                        model.TradeStatus.LOST)),
+            'vs_currency_entry': vs_currency_entry,
+            'crypto_quantity_entry': crypto_quantity_entry,
+            'entry_fee_vs_currency': entry_fee_vs_currency,
+            'position': 'L',
+            'entry_date': close_dates(entry_indexes),
+            'entry_order_exchange_id': 'BACKTEST',
+            'percentage_change_1h_on_entry': "NO",
+            'percentage_change_1d_on_entry': "NO",
+            'percentage_change_7d_on_entry': "NO",
+            'strategy_name': self._strategy.strategy_name(),
+            'is_real': False,
+            'vs_currency_result_no_fees': vs_currency_result_no_fees,
+            'crypto_quantity_exit': crypto_quantity_exit,
+            'exit_fee_vs_currency': exit_fee_vs_currency,
+            'exit_date': np.where(exited, close_dates(exit_indexes), None),
+            'entry_index': entry_indexes,
+            'exit_index': exit_indexes,
+            'result': result,
+        }, index=range(len(entry_indexes)))
+
+    @staticmethod
+    def _trades_frame(columns, index=None):
+        return pd.DataFrame(columns, index=index, columns=TRADE_COLUMNS)
+
+
+def to_trades(trades_df):
+    """
+    :param trades_df: trades returned by VectorizedBacktester.run
+    :return: list of model.Trade
+    """
+    trades = []
+    for row in trades_df.itertuples(index=False):
+        trade = model.create_initial_trade(
+            symbol=row.symbol, vs_currency_symbol=row.vs_currency_symbol,
+            timeframe=row.timeframe, stop_loss=float(row.stop_loss),
+            entry_price=float(row.entry_price), take_profit=float(row.take_profit),
+            vs_currency_entry=float(row.vs_currency_entry),
+            crypto_quantity_entry=float(row.crypto_quantity_entry),
+            entry_fee_vs_currency=float(row.entry_fee_vs_currency), position=row.position,
+            entry_order_exchange_id=row.entry_order_exchange_id,
+            percentage_change_1h_on_entry=row.percentage_change_1h_on_entry,
+            percentage_change_1d_on_entry=row.percentage_change_1d_on_entry,
+            percentage_change_7d_on_entry=row.percentage_change_7d_on_entry,
+            strategy_name=row.strategy_name, is_real=bool(row.is_real),
+            entry_date=row.entry_date)
+        if row.status != model.TradeStatus.OPENED:
+            model.complete_trade_with_market_sell_info(
+                trade, vs_currency_result_no_fees=float(row.vs_currency_result_no_fees),
+                crypto_quantity_exit=float(row.crypto_quantity_exit),
+                exit_fee_vs_currency=float(row.exit_fee_vs_currency),
+                exit_date=row.exit_date, status=row.status)
+        trades.append(trade)
+
+    return trades
@@ -0,0 +1,196 @@
+from dataclasses import dataclass
+
+import numpy as np
+from scipy.signal import lfilter
+
+OHLCV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+@dataclass(slots=True, kw_only=True)
+class CandleBatch:
+    """
+    Aligned candle windows of several markets. Each array has shape
+    (markets, candles), oldest candle first
+    """
+    markets: list  # (symbol, vs_currency) of each row
+    datetime: np.ndarray  # Open time of each column
+    open: np.ndarray
+    high: np.ndarray
+    low: np.ndarray
+    close: np.ndarray
+    volume: np.ndarray
+    skipped: list  # Markets not included because their candles are not aligned
+
+
+def stack_candles(dfs: dict, num_candles: int = None):
+    """
+    Stacks the last num_candles candles of each market. Markets with fewer
+    candles, or whose last candle is not the most common last candle, are skipped
+    :param dfs: dict (symbol, vs_currency) -> pd.DataFrame as returned by an
+    ExchangeHandler
+    :param num_candles: candles per market. If None, the number of candles of the
+    market with most candles
+    :return: CandleBatch
+    """
+    if num_candles is None:
+        num_candles = max((len(df) for df in dfs.values()), default=0)
+
+    # One conversion per market, since pandas indexing dominates the stacking time
+    windows = {}
+    for market, df in dfs.items():
+        if len(df) >= num_candles > 0:
+            windows[market] = (
+                df['datetime'].to_numpy()[-num_candles:],
+                np.column_stack([df[column].to_numpy(dtype=float)[-num_candles:]
+                                 for column in OHLCV_COLUMNS])
+            )
+
+    last_datetimes, counts = np.unique([datetimes[-1] for datetimes, _ in windows.values()],
+                                       return_counts=True)
+    if len(last_datetimes):
+        # Most common last candle. Ties resolved by the oldest one, as Series.mode
+        last_datetime = last_datetimes[np.argmax(counts)]
+        windows = {market: window for market, window in windows.items()
+                   if window[0][-1] == last_datetime}
+    values = np.stack([ohlcv for _, ohlcv in windows.values()]) if windows \
+        else np.empty((0, num_candles, len(OHLCV_COLUMNS)))
+
+    return CandleBatch(
+        markets=list(windows),
+        datetime=next(iter(windows.values()))[0] if windows
+        else np.empty(0, dtype='datetime64[ns]'),
+        open=values[:, :, 0], high=values[:, :, 1], low=values[:, :, 2],
+        close=values[:, :, 3], volume=values[:, :, 4],
+        skipped=[market for market in dfs if market not in windows],
+    )
+
+
+def ema(close: np.ndarray, period: int):
+    """
+    Same values as indicator.get_ema for each row
+    :param close: array (markets, candles)
+    :return: array (markets, candles), NaN during the warm-up
+    """
+    alpha = 2 / (period + 1)
+    ema_values = np.empty_like(close, dtype=float)
+    ema_values[:, 0] = close[:, 0]
+
+    # ema[i] = (1 - alpha) * ema[i - 1] + alpha * close[i], as a linear filter
+    # starting at the first close
+    if close.shape[1] > 1:
+        ema_values[:, 1:], _ = lfilter([alpha], [1, alpha - 1], close[:, 1:], axis=1,
+                                       zi=(1 - alpha) * ema_values[:, :1])
+
+    ema_values[:, :period - 1] = np.nan
+
+    return ema_values
+
+
+def true_range(high: np.ndarray, low: np.ndarray, close: np.ndarray):
+    """
+    :return: array (markets, candles). The first candle only uses high - low
+    """
+    previous_close = np.empty_like(close, dtype=float)
+    previous_close[:, 0] = np.nan
+    previous_close[:, 1:] = close[:, :-1]
+
+    return np.fmax(high - low, np.fmax(np.abs(high - previous_close),
+                                       np.abs(low - previous_close)))
+
+
+def atr(high: np.ndarray, low: np.ndarray, close: np.ndarray, period: int = 14):
+    """
+    Same values as indicator.get_atr for each row, 0 during the warm-up
+    :return: array (markets, candles)
+    """
+    ranges = true_range(high, low, close)
+    atr_values = np.zeros_like(ranges)
+    if ranges.shape[1] < period:
+        raise ValueError(f"At least {period} candles are needed to compute the atr")
+
+    # Wilder smoothing seeded with the mean of the first ranges:
+    # atr[i] = (atr[i - 1] * (period - 1) + range[i]) / period
+    atr_values[:, period - 1] = ranges[:, :period].mean(axis=1)
+    if ranges.shape[1] > period:
+        atr_values[:, period:], _ = lfilter(
+            [1 / period], [1, 1 / period - 1], ranges[:, period:], axis=1,
+            zi=(period - 1) / period * atr_values[:, period - 1:period])
+
+    return atr_values
+
+
+def atr_bands(high: np.ndarray, low: np.ndarray, close: np.ndarray, atr_period=12,
+              atr_factor=1.5):
+    """
+    Same values as indicator.get_atr_stop_loss for each row
+    :return: dict with high_band and low_band arrays (markets, candles)
+    """
+    atr_values = atr(high, low, close, period=atr_period)
+
+    return {
+        'high_band': high + atr_values * atr_factor,
+        'low_band': low - atr_values * atr_factor,
+    }
+
+
+def green_volume_quantile(close: np.ndarray, volume: np.ndarray, quantile: float):
+    """
+    Quantile of the volume of the candles closing above the previous close
+    :return: array (markets,), NaN for markets without such candles
+    """
+    is_green = np.zeros_like(close, dtype=bool)
+    is_green[:, 1:] = close[:, 1:] > close[:, :-1]
+
+    # Green volumes first in ascending order, since NaN values are sorted last
+    green_volume = np.sort(np.where(is_green, volume, np.nan), axis=1)
+    num_green = is_green.sum(axis=1)
+
+    # Linear interpolation between the closest ranks, as pd.Series.quantile
+    position = (np.maximum(num_green, 1) - 1) * quantile
+    lower = np.floor(position).astype(int)
+    upper = np.minimum(lower + 1, np.maximum(num_green - 1, 0))
+    lower_volume = np.take_along_axis(green_volume, lower[:, np.newaxis], axis=1)[:, 0]
+    upper_volume = np.take_along_axis(green_volume, upper[:, np.newaxis], axis=1)[:, 0]
+    quantiles = lower_volume + (upper_volume - lower_volume) * (position - lower)
+
+    return np.where(num_green > 0, quantiles, np.nan)
+
+
+def volume_ema_entry_conditions(batch: CandleBatch, entry_prices: np.ndarray,
+                                ema_period=50, atr_period=12, atr_factor=1.5,
+                                volume_quantile=.80, rrr=1.5):
+    """
+    Entry conditions of strategy.VolumeEmaTradingStrategy for every market of the
+    batch at once. The last candle of each row is the unfinished one
+    :param entry_prices: array (markets,) with the entry price of each market
+    :return: dict of arrays (markets,): can_enter, stop_loss and take_profit
+    """
+    current_candle_index = -1
+    last_finished_candle_index = -2
+    num_markets = len(batch.markets)
+
+    if batch.close.shape[1] < max(atr_period, 2):
+        return {'can_enter': np.zeros(num_markets, dtype=bool),
+                'stop_loss': np.full(num_markets, np.nan),
+                'take_profit': np.full(num_markets, np.nan)}
+
+    quantile = green_volume_quantile(batch.close, batch.volume, volume_quantile)
+    ema_values = ema(batch.close, ema_period)
+    stop_loss = atr_bands(batch.high, batch.low, batch.close, atr_period=atr_period,
+                          atr_factor=atr_factor)['low_band'][:, last_finished_candle_index]
+    take_profit = entry_prices + rrr * np.abs(entry_prices - stop_loss)
+
+    # The unfinished candle is green (as in VolumeEmaTradingStrategy)
+    green_volume_candle = batch.close[:, current_candle_index] > \
+        batch.close[:, last_finished_candle_index]
+    volume_higher_than_quantile = batch.volume[:, last_finished_candle_index] >= quantile
+    price_above_ema = batch.close[:, last_finished_candle_index] > \
+        ema_values[:, last_finished_candle_index]
+    above_stop_loss = batch.low[:, current_candle_index] > stop_loss
+
+    return {
+        'can_enter': green_volume_candle & volume_higher_than_quantile &
+        price_above_ema & above_stop_loss,
+        'stop_loss': stop_loss,
+        'take_profit': take_profit,
+    }
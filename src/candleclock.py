@@ -0,0 +1,146 @@
+import time
+
+import config
+import exchangehandler as ex_han
+
+
+MILLISECONDS_PER_TIMEFRAME_UNIT = {
+    'm': 60 * 1000,
+    'h': 60 * 60 * 1000,
+    'd': 24 * 60 * 60 * 1000,
+    'w': 7 * 24 * 60 * 60 * 1000,
+}
+
+# Unix epoch was a Thursday, but weekly candles open on Monday
+WEEKLY_CANDLE_OFFSET_MS = 4 * MILLISECONDS_PER_TIMEFRAME_UNIT['d']
+
+
+def timeframe_to_milliseconds(timeframe):
+    """
+    :param timeframe: timeframe as used by the exchange: 1m, 5m, 4h, 1d, 1w, ...
+    :return: duration of a candle of the given timeframe in milliseconds
+    """
+    amount, unit = timeframe[:-1], timeframe[-1]
+
+    if unit not in MILLISECONDS_PER_TIMEFRAME_UNIT or not amount.isdigit():
+        raise ValueError(f"Unsupported timeframe {timeframe}")
+
+    return int(amount) * MILLISECONDS_PER_TIMEFRAME_UNIT[unit]
+
+
+def candle_open_time(timeframe, timestamp_ms):
+    """
+    :param timeframe: timeframe of the candle
+    :param timestamp_ms: instant in milliseconds
+    :return: open time in milliseconds of the candle that contains timestamp_ms
+    """
+    candle_ms = timeframe_to_milliseconds(timeframe)
+    offset = WEEKLY_CANDLE_OFFSET_MS if timeframe.endswith('w') else 0
+
+    return (timestamp_ms - offset) // candle_ms * candle_ms + offset
+
+
+def last_closed_candle_open_time(timeframe, timestamp_ms):
+    """
+    :param timeframe: timeframe of the candle
+    :param timestamp_ms: instant in milliseconds
+    :return: open time in milliseconds of the last candle closed at timestamp_ms
+    """
+    return candle_open_time(timeframe, timestamp_ms) - timeframe_to_milliseconds(timeframe)
+
+
+def next_candle_close_time(timeframe, timestamp_ms):
+    """
+    :param timeframe: timeframe of the candle
+    :param timestamp_ms: instant in milliseconds
+    :return: close time in milliseconds of the candle that contains timestamp_ms
+    """
+    return candle_open_time(timeframe, timestamp_ms) + timeframe_to_milliseconds(timeframe)
+
+
+class CandleCloseScheduler:
+    """
+    Decides which markets must be evaluated by a strategy. A market is evaluated
+    once per closed candle of the strategy timeframe. Time is measured with the
+    exchange server clock.
+    """
+    def __init__(self, exchange_handler: ex_han.ExchangeHandler, timeframe,
+                 close_grace_seconds=config.CANDLE_CLOSE_GRACE_SECONDS,
+                 server_time_sync_seconds=config.SERVER_TIME_SYNC_SECONDS):
+        """
+        :param exchange_handler: ExchangeHandler to fetch server time from
+        :param timeframe: strategy timeframe
+        :param close_grace_seconds: seconds to wait after a candle closes before
+        considering it closed. Gives the exchange time to publish it
+        :param server_time_sync_seconds: seconds between server time synchronizations
+        """
+        self._exchange_handler = exchange_handler
+        self._timeframe = timeframe
+        self._close_grace_ms = int(close_grace_seconds * 1000)
+        self._server_time_sync_seconds = server_time_sync_seconds
+        # Difference between server clock and local clock
+        self._server_time_offset_ms = 0
+        self._last_server_time_sync = None
+        # (symbol, vs_currency) -> open time of the last evaluated closed candle
+        self._last_evaluated_candle = {}
+
+        # Fail early with wrong timeframes
+        timeframe_to_milliseconds(timeframe)
+
+    def server_time_ms(self):
+        """
+        :return: current exchange server time in milliseconds
+        """
+        now = time.monotonic()
+        if self._last_server_time_sync is None or \
+                now - self._last_server_time_sync >= self._server_time_sync_seconds:
+            local_time_before = _local_time_ms()
+            server_time = self._exchange_handler.get_server_time()
+            local_time_after = _local_time_ms()
+            # Assume the server answered in the middle of the request
+            self._server_time_offset_ms = server_time - (local_time_before + local_time_after) // 2
+            self._last_server_time_sync = now
+
+        return _local_time_ms() + self._server_time_offset_ms
+
+    def last_closed_candle(self):
+        """
+        :return: open time in milliseconds of the last closed candle of the timeframe
+        """
+        return last_closed_candle_open_time(self._timeframe,
+                                            self.server_time_ms() - self._close_grace_ms)
+
+    def seconds_until_next_close(self):
+        """
+        :return: seconds until the next candle is considered closed
+        """
+        server_time = self.server_time_ms() - self._close_grace_ms
+        return (next_candle_close_time(self._timeframe, server_time) - server_time) / 1000
+
+    def markets_due(self, markets):
+        """
+        :param markets: iterable of (symbol, vs_currency) tuples
+        :return: list of markets whose last closed candle has not been evaluated yet
+        """
+        last_closed_candle = self.last_closed_candle()
+
+        return [market for market in markets
+                if market not in self._last_evaluated_candle
+                or self._last_evaluated_candle[market] < last_closed_candle]
+
+    def mark_evaluated(self, markets, candle_open_time_ms=None):
+        """
+        Records that the last closed candle has been evaluated for the given markets
+        :param markets: iterable of (symbol, vs_currency) tuples
+        :param candle_open_time_ms: open time of the evaluated candle. If None,
+        the last closed candle is used
+        """
+        if candle_open_time_ms is None:
+            candle_open_time_ms = self.last_closed_candle()
+
+        for market in markets:
+            self._last_evaluated_candle[tuple(market)] = candle_open_time_ms
+
+
+def _local_time_ms():
+    return int(time.time() * 1000)
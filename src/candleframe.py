@@ -0,0 +1,195 @@
+import numpy as np
+import pandas as pd
+
+
+OHLCV_COLUMNS = ['open', 'high', 'low', 'close', 'volume']
+
+
+class CandleFrame:
+    """
+    Compact and immutable container of candles. Open times are kept as int64
+    milliseconds and OHLCV values in a single (5, candles) array, optionally
+    float32. Slicing returns views without copying, derived columns (is_green,
+    is_red, candle_body_low, candle_body_high) are computed on first access and
+    to_df provides a DataFrame view with the format used by the strategies.
+    """
+    __slots__ = ('_timestamp', '_values', '_derived')
+
+    def __init__(self, timestamp: np.ndarray, values: np.ndarray, derived=None):
+        """
+        :param timestamp: int64 array (candles,) with the open time in milliseconds
+        :param values: array (5, candles) with open, high, low, close and volume rows
+        :param derived: dict of derived columns already computed for these candles
+        """
+        if values.shape != (len(OHLCV_COLUMNS), len(timestamp)):
+            raise ValueError(f"Expected values of shape {(len(OHLCV_COLUMNS), len(timestamp))}, "
+                             f"instead {values.shape} was given.")
+
+        # Candles are shared between views, so they must not be modified
+        timestamp.flags.writeable = False
+        values.flags.writeable = False
+        self._timestamp = timestamp
+        self._values = values
+        self._derived = derived if derived is not None else {}
+
+    @classmethod
+    def from_ohlcv(cls, candles_list, dtype=np.float64):
+        """
+        :param candles_list: list of [timestamp, open, high, low, close, volume] as
+        returned by ccxt, or equivalent array
+        :param dtype: np.float64 or np.float32 for OHLCV values
+        :return: CandleFrame
+        """
+        candles = np.asarray(candles_list, dtype=np.float64).reshape(-1, len(OHLCV_COLUMNS) + 1)
+
+        return cls(timestamp=candles[:, 0].astype(np.int64),
+                   values=np.ascontiguousarray(candles[:, 1:].T, dtype=dtype))
+
+    @classmethod
+    def from_df(cls, df: pd.DataFrame, dtype=np.float64):
+        """
+        :param df: candles in the format returned by an ExchangeHandler
+        :return: CandleFrame
+        """
+        timestamp = df['datetime'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+
+        return cls(timestamp=timestamp,
+                   values=np.vstack([df[column].to_numpy(dtype=dtype)
+                                     for column in OHLCV_COLUMNS]))
+
+    @classmethod
+    def concat(cls, frames):
+        """
+        :param frames: list of CandleFrame, oldest first
+        :return: new CandleFrame with the candles of every frame
+        """
+        frames = list(frames)
+        if not frames:
+            return cls.from_ohlcv([])
+
+        return cls(timestamp=np.concatenate([frame._timestamp for frame in frames]),
+                   values=np.concatenate([frame._values for frame in frames], axis=1))
+
+    def __len__(self):
+        return len(self._timestamp)
+
+    def __getitem__(self, item):
+        """
+        :param item: slice of candles
+        :return: CandleFrame view, without copying candles
+        """
+        if not isinstance(item, slice):
+            raise TypeError("CandleFrame only supports slices")
+
+        return CandleFrame(timestamp=self._timestamp[item], values=self._values[:, item],
+                           derived={name: column[item] for name, column in self._derived.items()})
+
+    def closed(self):
+        """
+        :return: view without the last (unfinished) candle
+        """
+        return self[:-1]
+
+    @property
+    def dtype(self):
+        return self._values.dtype
+
+    @property
+    def nbytes(self):
+        """
+        :return: memory used by the candles and the derived columns computed
+        """
+        return self._timestamp.nbytes + self._values.nbytes + \
+            sum(column.nbytes for column in self._derived.values())
+
+    @property
+    def timestamp(self):
+        return self._timestamp
+
+    @property
+    def datetime(self):
+        return self._timestamp.view('datetime64[ms]')
+
+    @property
+    def open(self):
+        return self._values[0]
+
+    @property
+    def high(self):
+        return self._values[1]
+
+    @property
+    def low(self):
+        return self._values[2]
+
+    @property
+    def close(self):
+        return self._values[3]
+
+    @property
+    def volume(self):
+        return self._values[4]
+
+    def _derived_column(self, name, compute):
+        if name not in self._derived:
+            column = compute()
+            column.flags.writeable = False
+            self._derived[name] = column
+
+        return self._derived[name]
+
+    @property
+    def is_green(self):
+        return self._derived_column('is_green', lambda: self.open < self.close)
+
+    @property
+    def is_red(self):
+        return self._derived_column('is_red', lambda: self.open > self.close)
+
+    @property
+    def candle_body_low(self):
+        # Low values of the candle bodies
+        return self._derived_column('candle_body_low',
+                                    lambda: np.where(self.is_green, self.open, self.close))
+
+    @property
+    def candle_body_high(self):
+        return self._derived_column('candle_body_high',
+                                    lambda: np.where(self.is_green, self.close, self.open))
+
+    def astype(self, dtype):
+        """
+        :return: CandleFrame with OHLCV values of the given dtype. The same frame if
+        they already have it
+        """
+        if self._values.dtype == dtype:
+            return self
+
+        return CandleFrame(timestamp=self._timestamp, values=self._values.astype(dtype))
+
+    def ohlcv(self):
+        """
+        :return: array (candles, 6) with timestamp, open, high, low, close and volume
+        """
+        return np.column_stack([self._timestamp, self._values.T.astype(np.float64)])
+
+    def to_df(self, copy=True):
+        """
+        :param copy: if False, columns are read-only views of the candles, so they
+        are not copied. Only for internal hot paths that do not modify the DataFrame
+        :return: DataFrame with the columns returned by an ExchangeHandler
+        """
+        df = pd.DataFrame({
+            'datetime': self.datetime,
+            'open': self.open,
+            'high': self.high,
+            'low': self.low,
+            'close': self.close,
+            'volume': self.volume,
+            'is_green': self.is_green,
+            'is_red': self.is_red,
+            'candle_body_low': self.candle_body_low,
+            'candle_body_high': self.candle_body_high,
+        }, copy=False)
+
+        return df.copy() if copy else df
@@ -0,0 +1,308 @@
+import threading
+import time
+
+import numpy as np
+from sqlalchemy import create_engine, Table, Column, Integer, Float, String, \
+    MetaData, and_, select
+from sqlalchemy.dialects.sqlite import insert
+
+import candleclock as cc
+from candleframe import CandleFrame
+import exchangehandler as ex_han
+import filesystemutils as fs
+
+
+MAX_CANDLES_PER_REQUEST = 1000  # Maximum number of candles returned by the exchange
+OHLCV_COLUMNS = ['timestamp', 'open', 'high', 'low', 'close', 'volume']
+
+# Database directories
+_home_dir = fs.home_directory(True)
+_candles_db_path = f"{_home_dir}/candles.db"
+
+engine = create_engine(f"sqlite+pysqlite:///{_candles_db_path}", future=True)
+test_engine = create_engine(f"sqlite+pysqlite:///:memory:", future=True)
+
+metadata = MetaData()
+
+candle_table = Table(
+    'candle', metadata,
+    Column('symbol', String, primary_key=True),
+    Column('vs_currency', String, primary_key=True),
+    Column('timeframe', String, primary_key=True),
+    Column('timestamp', Integer, primary_key=True),  # Open time in milliseconds
+    Column('open', Float),
+    Column('high', Float),
+    Column('low', Float),
+    Column('close', Float),
+    Column('volume', Float),
+)
+
+metadata.create_all(engine)
+metadata.create_all(test_engine)
+
+
+class CandleStore:
+    """
+    Local store of OHLCV candles keyed by market and timeframe. Candles are
+    persisted in SQLite and the most recent ones are kept in memory as compact
+    CandleFrames. Only the candles newer than the last stored one are downloaded
+    from the exchange.
+    """
+    def __init__(self, exchange_handler: ex_han.ExchangeHandler, db_engine=engine,
+                 max_candles_in_memory=MAX_CANDLES_PER_REQUEST, clock=None,
+                 dtype=np.float64):
+        """
+        :param exchange_handler: ExchangeHandler to download candles from
+        :param db_engine: SQLAlchemy engine where candles are persisted
+        :param max_candles_in_memory: maximum candles kept in memory per market and timeframe
+        :param clock: function returning the current time in milliseconds. If
+        None, local time is used
+        :param dtype: dtype of the OHLCV values kept in memory. np.float32 halves
+        their memory use
+        """
+        self._exchange_handler = exchange_handler
+        self._db_engine = db_engine
+        self._max_candles_in_memory = max_candles_in_memory
+        # (symbol, vs_currency, timeframe) -> CandleFrame
+        self._candles_in_memory = {}
+        self._dtype = dtype
+        self._lock = threading.Lock()
+        self._clock = clock if clock is not None else _local_time_ms
+
+    def get_candles_last_one_not_finished(self, symbol, vs_currency, timeframe,
+                                          num_candles):
+        """
+        Same output as ExchangeHandler.get_candles_last_one_not_finished, but only
+        the missing candles are downloaded
+        :param symbol: asset symbol
+        :param vs_currency: vs_currency symbol to complete market
+        :param timeframe: timeframe of the candles
+        :param num_candles: total number of candles, including the unfinished one
+        :return: pd.DataFrame
+        """
+        since, limit = self._missing_candles_request(symbol, vs_currency,
+                                                     timeframe, num_candles)
+        new_candles = self._exchange_handler.get_candles_last_one_not_finished(
+            symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+            num_candles=limit, since=since)
+
+        return self._store_and_provide_window(symbol, vs_currency, timeframe,
+                                              num_candles, since, new_candles)
+
+    async def get_candles_last_one_not_finished_async(self, symbol, vs_currency,
+                                                      timeframe, num_candles):
+        """
+        Asynchronous version of get_candles_last_one_not_finished
+        """
+        since, limit = self._missing_candles_request(symbol, vs_currency,
+                                                     timeframe, num_candles)
+        new_candles = await self._exchange_handler.get_candles_last_one_not_finished_async(
+            symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+            num_candles=limit, since=since)
+
+        return self._store_and_provide_window(symbol, vs_currency, timeframe,
+                                              num_candles, since, new_candles)
+
+    def get_candles_for_strategy(self, symbol, vs_currency, timeframe, num_candles):
+        """
+        Same as get_candles_last_one_not_finished, but without the unfinished candle
+        """
+        return self.get_candles_last_one_not_finished(symbol=symbol,
+                                                      vs_currency=vs_currency,
+                                                      timeframe=timeframe,
+                                                      num_candles=num_candles).iloc[:-1]
+
+    def get_candles_since(self, symbol, vs_currency, timeframe, num_candles, since):
+        """
+        Gets num_candles candles starting at since. They are served from disk if
+        all of them are already stored, otherwise they are downloaded and stored
+        :param since: open time in milliseconds of the first candle
+        :return: pd.DataFrame
+        """
+        since = cc.candle_open_time(timeframe, since)
+        candle_ms = cc.timeframe_to_milliseconds(timeframe)
+        until = since + (num_candles - 1) * candle_ms
+
+        stored = self.get_stored_candles(symbol, vs_currency, timeframe,
+                                         since=since, until=until)
+        last_closed = cc.last_closed_candle_open_time(timeframe, self._clock())
+
+        # Unfinished candles are always downloaded again
+        if len(stored) == num_candles and until <= last_closed:
+            return stored
+
+        new_candles = self._exchange_handler.get_candles_last_one_not_finished(
+            symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+            num_candles=num_candles, since=since)
+
+        with self._lock:
+            self._persist(symbol, vs_currency, timeframe, CandleFrame.from_df(new_candles))
+
+        return new_candles
+
+    def get_stored_candles(self, symbol, vs_currency, timeframe, since=None,
+                           until=None):
+        """
+        Gets candles from disk without accessing the exchange. Useful for backtesting
+        :param since: open time in milliseconds of the first candle (included)
+        :param until: open time in milliseconds of the last candle (included)
+        :return: pd.DataFrame with the same format as the exchange handler ones
+        """
+        return self._load(symbol, vs_currency, timeframe, since=since,
+                          until=until).to_df()
+
+    def on_kline(self, kline):
+        """
+        Subscriber of marketstream.MarketDataHub. Streamed klines update the
+        candles in memory, and closed ones are stored, so that they do not need to
+        be downloaded later. Updates of the unfinished candle arrive every few
+        seconds and are overwritten by the next one, so they are not stored
+        :param kline: marketstream.KlineEvent
+        """
+        kline_frame = CandleFrame.from_ohlcv([[kline.timestamp, kline.open, kline.high,
+                                               kline.low, kline.close, kline.volume]])
+
+        self._update_in_memory(kline, kline_frame)
+        if kline.is_closed:
+            # Outside the lock, so that scans do not wait for the write
+            self._persist(kline.symbol, kline.vs_currency, kline.timeframe, kline_frame)
+
+    def _update_in_memory(self, kline, kline_frame):
+        key = (kline.symbol, kline.vs_currency, kline.timeframe)
+
+        with self._lock:
+            candles = self._candles_in_memory.get(key)
+            if candles is None or len(candles) == 0:
+                return
+
+            last_timestamp = int(candles.timestamp[-1])
+            if kline.timestamp == last_timestamp:
+                candles = CandleFrame.concat([candles[:-1], kline_frame.astype(self._dtype)])
+            elif kline.timestamp == last_timestamp + cc.timeframe_to_milliseconds(kline.timeframe):
+                candles = CandleFrame.concat([candles, kline_frame.astype(self._dtype)])
+            else:
+                # Candles in memory must be contiguous. Missing ones are
+                # downloaded in the next request
+                return
+
+            self._candles_in_memory[key] = candles[-self._max_candles_in_memory:]
+
+    def _missing_candles_request(self, symbol, vs_currency, timeframe, num_candles):
+        """
+        :return: since and limit parameters to download the missing candles
+        """
+        with self._lock:
+            candles = self._candles_in_memory_or_disk(symbol, vs_currency,
+                                                      timeframe, num_candles)
+
+        if len(candles) < num_candles:
+            return None, num_candles
+
+        # The last stored candle may have been unfinished, so it is downloaded again
+        last_timestamp = int(candles.timestamp[-1])
+        candle_ms = cc.timeframe_to_milliseconds(timeframe)
+        missing_candles = (self._clock() - last_timestamp) // candle_ms + 1
+
+        if missing_candles >= min(num_candles, MAX_CANDLES_PER_REQUEST):
+            # The stored candles are too old to be completed
+            return None, num_candles
+
+        return last_timestamp, missing_candles + 1
+
+    def _store_and_provide_window(self, symbol, vs_currency, timeframe,
+                                  num_candles, since, new_candles):
+        key = (symbol, vs_currency, timeframe)
+        new_frame = CandleFrame.from_df(new_candles)
+
+        with self._lock:
+            # Persisted with full precision, whatever the dtype kept in memory
+            self._persist(symbol, vs_currency, timeframe, new_frame)
+            new_frame = new_frame.astype(self._dtype)
+
+            if since is None:
+                # Fresh window, previous candles may not be contiguous
+                candles = new_frame
+            else:
+                candles = self._candles_in_memory[key]
+                candles = CandleFrame.concat([
+                    candles[:np.searchsorted(candles.timestamp, since)], new_frame
+                ])
+
+            # Views of the same candles, nothing is copied
+            self._candles_in_memory[key] = candles[
+                -max(num_candles, self._max_candles_in_memory):
+            ]
+            window = self._candles_in_memory[key][-num_candles:]
+
+        return window.to_df()
+
+    def _candles_in_memory_or_disk(self, symbol, vs_currency, timeframe, num_candles):
+        key = (symbol, vs_currency, timeframe)
+
+        if key not in self._candles_in_memory or \
+                len(self._candles_in_memory[key]) < num_candles:
+            candles = self._load(symbol, vs_currency, timeframe,
+                                 limit=max(num_candles, self._max_candles_in_memory))
+            self._candles_in_memory[key] = _last_contiguous_candles(
+                candles, timeframe).astype(self._dtype)
+
+        return self._candles_in_memory[key]
+
+    def _load(self, symbol, vs_currency, timeframe, since=None, until=None,
+              limit=None):
+        conditions = [candle_table.c.symbol == symbol,
+                      candle_table.c.vs_currency == vs_currency,
+                      candle_table.c.timeframe == timeframe]
+        if since is not None:
+            conditions.append(candle_table.c.timestamp >= since)
+        if until is not None:
+            conditions.append(candle_table.c.timestamp <= until)
+
+        query = select(*[candle_table.c[column] for column in OHLCV_COLUMNS]) \
+            .where(and_(*conditions)) \
+            .order_by(candle_table.c.timestamp.desc())
+        if limit is not None:
+            query = query.limit(limit)
+
+        with self._db_engine.connect() as conn:
+            rows = conn.execute(query).all()
+
+        return CandleFrame.from_ohlcv(rows[::-1])
+
+    def _persist(self, symbol, vs_currency, timeframe, candles: CandleFrame):
+        if len(candles) == 0:
+            return
+
+        rows = [
+            {'symbol': symbol, 'vs_currency': vs_currency, 'timeframe': timeframe,
+             **dict(zip(OHLCV_COLUMNS, [timestamp, *values]))}
+            for timestamp, values in zip(candles.timestamp.tolist(),
+                                         candles.ohlcv()[:, 1:].tolist())
+        ]
+        statement = insert(candle_table)
+        statement = statement.on_conflict_do_update(
+            index_elements=['symbol', 'vs_currency', 'timeframe', 'timestamp'],
+            set_={column: statement.excluded[column] for column in OHLCV_COLUMNS[1:]}
+        )
+
+        with self._db_engine.begin() as conn:
+            conn.execute(statement, rows)
+
+
+def _last_contiguous_candles(candles: CandleFrame, timeframe):
+    """
+    :return: view of the last candles without gaps between them
+    """
+    if len(candles) == 0:
+        return candles
+
+    gaps = np.flatnonzero(np.diff(candles.timestamp) !=
+                          cc.timeframe_to_milliseconds(timeframe))
+    # The first candle is always a gap since it has no previous one
+    last_gap = gaps[-1] + 1 if len(gaps) else 0
+
+    return candles[last_gap:]
+
+
+def _local_time_ms():
+    return int(time.time() * 1000)
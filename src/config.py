@@ -13,3 +13,27 @@ MAX_VS_CURRENCY_TO_USE = 13  # This value is changed during execution (once at t
 
 FILE_NAME_TO_CLOSE_BOT = "close_bot"
 
+SCAN_MAX_CONCURRENCY = 10  # Maximum number of markets whose data is fetched at the same time
+EXIT_MONITOR_INTERVAL_SECONDS = 2  # Time between opened positions checks
+CANDLE_CLOSE_GRACE_SECONDS = 5  # Time given to the exchange to publish a closed candle
+SERVER_TIME_SYNC_SECONDS = 60 * 60  # Time between exchange server time synchronizations
+PRICE_SNAPSHOT_MAX_AGE_SECONDS = 1  # Time a price snapshot can be reused
+FEE_CACHE_TTL_SECONDS = 24 * 60 * 60  # Time trading fees are kept in cache
+MARKET_CACHE_TTL_SECONDS = 6 * 60 * 60  # Time market limits and precision are kept in cache
+
+STREAM_PRICE_MAX_AGE_SECONDS = 5  # Time a streamed price is used since its reception
+STREAM_PRICE_RANGE_MINUTES = 24 * 60  # Minutes whose streamed high and low are kept per market
+STREAM_RECONNECT_DELAY_SECONDS = 5  # Time to wait before watching again a failed stream
+INDICATOR_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Memory budget of memoized indicator results
+MAX_PIVOTS_PER_MARKET = 1000  # Confirmed local extrema kept per market and candle column
+REQUEST_WEIGHT_PER_MINUTE = 6000  # Binance spot request weight limit per IP and minute
+REQUEST_BURST_WEIGHT = 1200  # Request weight that can be spent at once after being idle
+SCAN_RESERVED_REQUEST_WEIGHT = 300  # Request weight scans leave available for exits and orders
+EXCHANGE_RETRY_ATTEMPTS = 3  # Attempts of an exchange read request failed by network errors
+EXCHANGE_RETRY_BASE_SECONDS = .5  # Longest wait before the first retry. It doubles on each retry
+EXCHANGE_RETRY_MAX_SECONDS = 8  # Longest wait between retries
+CIRCUIT_BREAKER_FAILURES = 5  # Consecutive network errors of an endpoint that open its circuit
+CIRCUIT_BREAKER_RESET_SECONDS = 30  # Time an open circuit rejects requests before trying one
+BOT_RESTART_MAX_SECONDS = 5 * 60  # Longest wait before restarting the bot after a network error
+PORTFOLIO_BALANCE_TTL_SECONDS = 60 * 60  # Time balances are only updated with fills before fetching them again
+PORTFOLIO_PRICE_MAX_AGE_SECONDS = 60  # Time the price of a held asset is reused to value the portfolio
@@ -5,6 +5,7 @@ import mplfinance
 import pandas as pd
 import sqlalchemy.exc
 
+import candlestore as cs
 import config
 import exchangehandler as ex_han
 from repository import provide_sqlalchemy_repository
@@ -19,6 +20,7 @@ eh = ex_han.BinanceCcxtExchangeHandler(
         }
     )
 )
+candle_store = cs.CandleStore(exchange_handler=eh)
 
 def extract_trade_span_candles(trade_id_db: int, candles_before, candles_after):
     repo = provide_sqlalchemy_repository(real_db=True)
@@ -47,7 +49,8 @@ def extract_trade_span_candles(trade_id_db: int, candles_before, candles_after):
 
     n_candles = candles_before + candles_in_trade + candles_after
 
-    candles = eh.get_candles_last_one_not_finished(
+    # Candles already downloaded for previous plots are read from disk
+    candles = candle_store.get_candles_since(
         symbol=symbol,
         vs_currency=vs_currency_symbol,
         timeframe=timeframe,
@@ -0,0 +1,57 @@
+from dataclasses import dataclass
+import threading
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class DustRecord:
+    symbol: str
+    vs_currency: str
+    requested_amount: float  # Amount of symbol asked to be sold
+    sold_amount: float  # Amount of symbol filled
+    dust_amount: float  # Amount of symbol of the position left unsold
+    price: float  # Fill price, or current price if nothing was sold. Used to value the dust
+    timestamp: int  # Fill time in milliseconds, None if nothing was sold
+
+    @property
+    def dust_value(self):
+        """
+        :return: value of the dust in vs_currency at the fill price
+        """
+        return self.dust_amount * self.price
+
+
+class DustReport:
+    """
+    Reconciliation of the sells: amounts of the positions that could not be sold
+    because of the amount precision of the market or the fees paid in the asset
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._records = []
+
+    def record(self, record: DustRecord):
+        with self._lock:
+            self._records.append(record)
+
+    def records(self):
+        """
+        :return: list of DustRecord, in the order the sells were filled
+        """
+        with self._lock:
+            return list(self._records)
+
+    def total_by_asset(self):
+        """
+        :return: dict (symbol, vs_currency) -> (dust amount, dust value in vs_currency)
+        """
+        totals = {}
+        for record in self.records():
+            market = (record.symbol, record.vs_currency)
+            amount, value = totals.get(market, (0., 0.))
+            totals[market] = (amount + record.dust_amount, value + record.dust_value)
+
+        return totals
+
+    def clear(self):
+        with self._lock:
+            self._records.clear()
@@ -1,19 +1,54 @@
 from abc import ABC, abstractmethod
+import asyncio
+import time
 
 import ccxt
+import ccxt.async_support as ccxt_async
 import numpy as np
-import pandas as pd
 
 import config
 import commonutils as cu
+import dustreport as dr
+import requestscheduler as rs
+import retrypolicy as rtp
+from candleframe import CandleFrame
 
 
 MAX_VS_CURRENCY_WHEN_NONE = 10000   # Max amount of vs_currency to use when
                                     # not specified by exchange
 
+
+def candles_list_to_df(candles_list):
+    """
+    Converts the list of candles returned by ccxt into the DataFrame used by
+    the strategies
+    :param candles_list: list of [timestamp, open, high, low, close, volume]
+    :return: pd.DataFrame
+    """
+    return CandleFrame.from_ohlcv(candles_list).to_df()
+
+
 class ExchangeHandler(ABC):
     def __init__(self, exchange_api):
         self._exchange_api = exchange_api
+        # Latest streamed prices (marketstream.LatestPriceBook). If None or the
+        # price is not available, prices are requested to the exchange
+        self._price_book = None
+        # Amounts of the positions left unsold by sell_market_order_diminishing_amount
+        self.dust_report = dr.DustReport()
+
+    def attach_price_book(self, price_book):
+        """
+        Makes current prices be read from the given marketstream.LatestPriceBook
+        whenever it has a recent price of the market
+        """
+        self._price_book = price_book
+
+    def _streamed_price(self, symbol, vs_currency):
+        if self._price_book is None:
+            return None
+
+        return self._price_book.price(symbol, vs_currency)
 
     @abstractmethod
     def buy_market_order(self, symbol, vs_currency, amount):
@@ -37,18 +72,83 @@ class ExchangeHandler(ABC):
         """
         raise NotImplementedError
 
-    @abstractmethod
+    def _amount_to_precision(self, symbol, vs_currency, amount):
+        """
+        Reduces the decimals in amount to those of the market. By default, amount
+        is not changed
+        :return: amount with corrected precision
+        """
+        return amount
+
+    def sellable_amount(self, symbol, vs_currency, amount):
+        """
+        :param symbol: symbol to sell
+        :param vs_currency: vs_currency to complete the market
+        :param amount: amount of symbol to sell
+        :return: largest amount up to amount that can be sold: limited by the free
+        balance, which has the fees paid in symbol already deducted, and truncated
+        to the precision of the market. 0 if it is below the precision
+        """
+        return self._sellable_amounts(symbol, vs_currency, amount)[1]
+
+    def _sellable_amounts(self, symbol, vs_currency, amount):
+        """
+        :return: amount available in the free balance and sellable amount
+        """
+        available_amount = min(amount, self.get_free_balance(symbol))
+
+        return available_amount, self._truncated_amount(symbol, vs_currency,
+                                                        available_amount)
+
+    def _truncated_amount(self, symbol, vs_currency, amount):
+        try:
+            return self._amount_to_precision(symbol=symbol, vs_currency=vs_currency,
+                                             amount=amount)
+        except ccxt.InvalidOrder:
+            return 0.
+
     def sell_market_order_diminishing_amount(self, symbol, vs_currency, amount):
         """
         Sells in the market symbol vs_currency the specified amount of symbol.
-        If the exchange is not able to sell the specified amount, then reduce it
-        little by little until it can.
+        If the exchange is not able to sell the specified amount, it is reduced
+        once to the sellable amount, so a single order is placed. It is computed
+        again only if the free balance changes before the order is filled. What
+        is left in the account of the amount is recorded in dust_report, even if
+        the whole amount is below the precision of the market and nothing is sold
         :param symbol: symbol to sell
         :param vs_currency: vs_currency to complete the market
         :param amount: amount of symbol to sell
-        :return: filled order
-        """
-        raise NotImplementedError
+        :return: filled order, None if it could not be placed. If sellable_amount
+        is 0 after None is returned, the amount can not be sold at all
+        """
+        for _ in range(2):
+            available_amount, sellable_amount = self._sellable_amounts(symbol, vs_currency,
+                                                                       amount)
+            if sellable_amount <= 0:
+                self.dust_report.record(dr.DustRecord(
+                    symbol=symbol, vs_currency=vs_currency, requested_amount=amount,
+                    sold_amount=0., dust_amount=available_amount,
+                    price=self.get_current_price(symbol=symbol, vs_currency=vs_currency),
+                    timestamp=None))
+                return None
+
+            try:
+                sell_order = self._sell_market_order(symbol=symbol, vs_currency=vs_currency,
+                                                     amount=sellable_amount)
+                break
+            except ccxt.InsufficientFunds:
+                continue
+        else:
+            return None
+
+        if sell_order is not None:
+            self.dust_report.record(dr.DustRecord(
+                symbol=symbol, vs_currency=vs_currency, requested_amount=amount,
+                sold_amount=sell_order['amount'],
+                dust_amount=max(available_amount - sell_order['amount'], 0.),
+                price=sell_order['price'], timestamp=sell_order['timestamp']))
+
+        return sell_order
 
     @abstractmethod
     def fetch_market(self, symbol: str, vs_currency):
@@ -89,6 +189,54 @@ class ExchangeHandler(ABC):
         """
         raise NotImplementedError
 
+    def get_candle_frame_last_one_not_finished(self, symbol, vs_currency, timeframe,
+                                               num_candles, since=None,
+                                               dtype=np.float64):
+        """
+        Same candles as get_candles_last_one_not_finished, as a compact CandleFrame.
+        The unfinished candle can be removed without copying with closed()
+        :param dtype: dtype of the OHLCV values, np.float64 or np.float32
+        :return: CandleFrame
+        """
+        return CandleFrame.from_df(self.get_candles_last_one_not_finished(
+            symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+            num_candles=num_candles, since=since), dtype=dtype)
+
+    async def get_candles_last_one_not_finished_async(self, symbol, vs_currency,
+                                                      timeframe, num_candles,
+                                                      since=None):
+        """
+        Asynchronous version of get_candles_last_one_not_finished. By default, the
+        blocking implementation is run in a worker thread
+        :param symbol: asset symbol
+        :param vs_currency: vs_currency symbol to complete market
+        :param timeframe: timeframe to fetch candles from 5m, 15m, 30m, 1h, ...
+        :param num_candles: total number of candles to fetch
+        :param since: since date to fetch candles
+        :return: pd.DataFrame
+        """
+        return await asyncio.to_thread(self.get_candles_last_one_not_finished,
+                                       symbol=symbol, vs_currency=vs_currency,
+                                       timeframe=timeframe,
+                                       num_candles=num_candles, since=since)
+
+    async def get_current_price_async(self, symbol, vs_currency):
+        """
+        Asynchronous version of get_current_price. By default, the blocking
+        implementation is run in a worker thread
+        :param symbol: asset to trade
+        :param vs_currency: currency to complete the market
+        :return: float
+        """
+        return await asyncio.to_thread(self.get_current_price, symbol=symbol,
+                                       vs_currency=vs_currency)
+
+    async def close_async(self):
+        """
+        Releases the resources used by the asynchronous methods
+        """
+        pass
+
     @abstractmethod
     def get_fee_factor(self, symbol, vs_currency, type='spot'):
         """
@@ -129,13 +277,65 @@ class ExchangeHandler(ABC):
         """
         raise NotImplementedError
 
-    def get_total_amount_in_symbol(self, symbol):
+    def get_current_prices(self, markets):
+        """
+        Gets the current price of several markets. By default, get_current_price
+        is called for each one of them
+        :param markets: list of (symbol, vs_currency) tuples
+        :return: dict (symbol, vs_currency) -> float
+        """
+        if self._price_book is not None:
+            prices = self._price_book.prices(markets)
+            return {**prices, **{
+                (symbol, vs_currency): self.get_current_price(symbol=symbol,
+                                                              vs_currency=vs_currency)
+                for symbol, vs_currency in markets
+                if (symbol, vs_currency) not in prices
+            }}
+
+        return {
+            (symbol, vs_currency): self.get_current_price(symbol=symbol,
+                                                          vs_currency=vs_currency)
+            for symbol, vs_currency in markets
+        }
+
+    def get_server_time(self):
+        """
+        Gets the current time of the exchange server. By default, the local time
+        :return: timestamp in milliseconds
+        """
+        return int(time.time() * 1000)
+
+    def get_total_balances(self):
+        """
+        Gets the total (free and used) balance of every asset held
+        :return: dict symbol -> amount, without zero balances
+        """
+        raise NotImplementedError
+
+    def has_market(self, symbol, vs_currency):
+        """
+        :param symbol: asset to trade
+        :param vs_currency: currency to complete the market
+        :return: True if the market exists in the exchange. By default, True
+        """
+        return True
+
+    def get_total_amount_in_symbol(self, symbol=config.VS_CURRENCY):
         """
-        Gets the total amount of symbol in account
+        Gets the total amount of symbol in account. Only the assets held are
+        priced, and those without a market against symbol are not counted
         :param symbol: symbol to fetch the total amount
         :return: amount of symbol
         """
-        raise NotImplementedError
+        balances = self.get_total_balances()
+        markets = [(asset, symbol) for asset in balances
+                   if asset != symbol and self.has_market(asset, symbol)]
+        prices = self.get_current_prices(markets)
+
+        return balances.get(symbol, 0.) + sum(
+            balances[asset] * prices[(asset, vs_currency)] for asset, vs_currency in markets
+            if prices.get((asset, vs_currency)) is not None)
 
     @abstractmethod
     def withdraw_fiat_to_bank_account(self, fiat_symbol, fiat_quantity, swift):
@@ -154,11 +354,114 @@ class CcxtExchangeHandler(ExchangeHandler):
     in ccxt until they give support for OCO orders. Then it should not be needed
     to create child classes to manage these types of order.
     """
-    def __init__(self, exchange_api: ccxt.Exchange):
+    def __init__(self, exchange_api: ccxt.Exchange,
+                 async_exchange_api: ccxt_async.Exchange = None,
+                 fee_ttl_seconds=config.FEE_CACHE_TTL_SECONDS,
+                 market_ttl_seconds=config.MARKET_CACHE_TTL_SECONDS,
+                 request_scheduler: rs.RequestScheduler = None,
+                 retry_policy: rtp.RetryPolicy = None):
         if not isinstance(exchange_api, ccxt.Exchange):
             raise TypeError("Error exchange_api should be of type ccxt.Exchange")
 
+        if async_exchange_api is not None and not isinstance(async_exchange_api,
+                                                             ccxt_async.Exchange):
+            raise TypeError("Error async_exchange_api should be of type "
+                            "ccxt.async_support.Exchange")
+
+        # Requests of both apis wait for the shared request weight, so that exits
+        # and orders are served before scans
+        self._request_scheduler = request_scheduler
+        if request_scheduler is not None:
+            exchange_api = rs.ScheduledExchangeApi(exchange_api, request_scheduler)
+            if async_exchange_api is not None:
+                async_exchange_api = rs.ScheduledExchangeApi(async_exchange_api,
+                                                             request_scheduler)
+        # Read requests failed by network errors are retried, and endpoints that
+        # keep failing are rejected for a while. Each retry waits for its weight
+        if retry_policy is not None:
+            exchange_api = rtp.ResilientExchangeApi(exchange_api, retry_policy)
+            if async_exchange_api is not None:
+                async_exchange_api = rtp.ResilientExchangeApi(async_exchange_api,
+                                                              retry_policy)
+
         super().__init__(exchange_api)
+        # Used by the asynchronous methods. If None, they fall back to threads
+        self._async_exchange_api = async_exchange_api
+
+        # Exchange metadata cache. Fees, limits and precision almost never change
+        self._fee_ttl_seconds = fee_ttl_seconds
+        self._market_ttl_seconds = market_ttl_seconds
+        self._fees = {}  # market symbol -> (fee factors, fetch time)
+        self._markets_loaded_at = None
+
+    @property
+    def request_scheduler(self):
+        return self._request_scheduler
+
+    def open_circuits(self):
+        """
+        :return: list of (ccxt method name, market symbol) whose requests are
+        rejected after repeated network errors
+        """
+        return [circuit for api in (self._exchange_api, self._async_exchange_api)
+                if isinstance(api, rtp.ResilientExchangeApi)
+                for circuit in api.open_circuits()]
+
+    def preload_metadata(self):
+        """
+        Fetches the metadata of every market (limits, precision and fees) in bulk
+        so that scanning a market does not need any metadata request
+        """
+        self._load_markets(reload=True)
+
+        try:
+            fees = self._exchange_api.fetch_trading_fees()
+        except ccxt.errors.NotSupported:
+            return
+
+        fetched_at = time.monotonic()
+        for market_symbol, fee_factors in fees.items():
+            self._fees[market_symbol] = (fee_factors, fetched_at)
+
+    def invalidate_metadata(self, symbol=None, vs_currency=None):
+        """
+        Forces the metadata to be fetched again on next use
+        :param symbol: if specified with vs_currency, only the fees of that market
+        are invalidated. Otherwise, every cached metadata is invalidated
+        :param vs_currency: right-hand side of market symbol
+        """
+        if symbol is not None and vs_currency is not None:
+            self._fees.pop(self._market_from_symbol_and_vs_currency(symbol, vs_currency),
+                           None)
+        else:
+            self._fees.clear()
+            self._markets_loaded_at = None
+
+    def _load_markets(self, reload=False):
+        """
+        Loads markets information if it has not been loaded yet, it is older than
+        the market ttl or reload is True
+        """
+        markets_expired = self._markets_loaded_at is None or \
+            time.monotonic() - self._markets_loaded_at >= self._market_ttl_seconds
+
+        if reload or markets_expired:
+            self._exchange_api.load_markets(reload=True)
+            self._markets_loaded_at = time.monotonic()
+
+    def _market(self, market_symbol):
+        """
+        :param market_symbol: symbol of the market as used by the exchange
+        :return: ccxt market structure, from cache if possible
+        """
+        self._load_markets()
+
+        try:
+            return self._exchange_api.market(symbol=market_symbol)
+        except ccxt.errors.ExchangeError as e:
+            # New listings are not in the cached markets
+            self._load_markets(reload=True)
+            return self._exchange_api.market(symbol=market_symbol)
 
     def _amount_to_precision(self, symbol, vs_currency, amount):
         """
@@ -169,13 +472,10 @@ class CcxtExchangeHandler(ExchangeHandler):
         :return: amount with corrected precision
         """
         market = self._market_from_symbol_and_vs_currency(symbol, vs_currency)
-        try:
-            amount = self._exchange_api.amount_to_precision(symbol=market,
-                                                            amount=amount)
-        except ccxt.errors.ExchangeError as e:
-            self._exchange_api.load_markets()
-            amount = self._exchange_api.amount_to_precision(symbol=market,
-                                                            amount=amount)
+        # Ensures markets (and their precision) are loaded without extra requests
+        self._market(market)
+        amount = self._exchange_api.amount_to_precision(symbol=market,
+                                                        amount=amount)
 
         return float(amount)
 
@@ -252,36 +552,13 @@ class CcxtExchangeHandler(ExchangeHandler):
 
         return order_info
 
-    def sell_market_order_diminishing_amount(self, symbol, vs_currency, amount):
-        """
-        See description in parent class
-        """
-        min_qty = None
-
-        while amount > 0:
-            try:
-                sell_order = self._sell_market_order(symbol=symbol,
-                                                     vs_currency=vs_currency,
-                                                     amount=amount)
-
-                return sell_order
-            except ccxt.InsufficientFunds:
-                if min_qty is None:
-                    min_qty = self.fetch_market(symbol=symbol,
-                                                vs_currency=vs_currency)['min_qty']
-                amount -= min_qty / 2
-
     def fetch_market(self, symbol: str, vs_currency):
         """
         See description in parent class
         """
         market_symbol = self._market_from_symbol_and_vs_currency(symbol=symbol,
                                                                  vs_currency=vs_currency)
-        try:
-            market = self._exchange_api.market(symbol=market_symbol)
-        except ccxt.errors.ExchangeError as e:
-            self._exchange_api.load_markets()
-            market = self._exchange_api.market(symbol=market_symbol)
+        market = self._market(market_symbol)
 
         min_price = market['limits']['cost']['min']
 
@@ -317,43 +594,87 @@ class CcxtExchangeHandler(ExchangeHandler):
                                                             timeframe=timeframe,
                                                             num_candles=num_candles,
                                                             since=since)
-        candles_strategy_df = candles_df.iloc[:-1].copy()
-        return candles_strategy_df
+        # The unfinished candle is dropped without copying the others
+        return candles_df.iloc[:-1]
 
     def get_candles_last_one_not_finished(self, symbol, vs_currency, timeframe,
                                          num_candles, since=None):
         """
         See description in parent class
         """
+        return self.get_candle_frame_last_one_not_finished(
+            symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+            num_candles=num_candles, since=since).to_df()
+
+    def get_candle_frame_last_one_not_finished(self, symbol, vs_currency, timeframe,
+                                               num_candles, since=None,
+                                               dtype=np.float64):
+        """
+        See description in parent class
+        """
         market = self._market_from_symbol_and_vs_currency(symbol, vs_currency)
 
         # Get candles open, high, low, close, volume information
         candles_list = self._exchange_api.fetch_ohlcv(symbol=market, timeframe=timeframe,
                                                       limit=num_candles, since=since)
 
-        # Take all candles except for the current one (still not closed) and give
-        # them some columns names in the data frame
-        candles_df = pd.DataFrame(candles_list, columns=['datetime', 'open',
-                                                         'high', 'low', 'close',
-                                                         'volume'])
+        return CandleFrame.from_ohlcv(candles_list, dtype=dtype)
+
+    async def get_candles_last_one_not_finished_async(self, symbol, vs_currency,
+                                                      timeframe, num_candles,
+                                                      since=None):
+        """
+        See description in parent class
+        """
+        if self._async_exchange_api is None:
+            return await super().get_candles_last_one_not_finished_async(
+                symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+                num_candles=num_candles, since=since)
+
+        market = self._market_from_symbol_and_vs_currency(symbol, vs_currency)
+
+        candles_list = await self._async_exchange_api.fetch_ohlcv(symbol=market,
+                                                                  timeframe=timeframe,
+                                                                  limit=num_candles,
+                                                                  since=since)
+
+        return candles_list_to_df(candles_list)
 
-        # Convert timestamp from Unix format to YYYY-MM-DD hh:mm:ss.sss format
-        candles_df['datetime'] = pd.to_datetime(candles_df['datetime'], unit='ms')
-        # Candle color
-        candles_df['is_green'] = candles_df['open'] < candles_df['close']
-        candles_df['is_red'] = candles_df['open'] > candles_df['close']
-        # Low values of the candle bodies
-        candles_df['candle_body_low'] = np.where(candles_df['is_green'] == True, candles_df['open'], candles_df['close'])
-        candles_df['candle_body_high'] = np.where(candles_df['is_green'] == True, candles_df['close'], candles_df['open'])
+    async def get_current_price_async(self, symbol, vs_currency):
+        """
+        See description in parent class
+        """
+        streamed_price = self._streamed_price(symbol, vs_currency)
+        if streamed_price is not None:
+            return streamed_price
+
+        close = (await self.get_candles_last_one_not_finished_async(symbol=symbol,
+                                                                    vs_currency=vs_currency,
+                                                                    timeframe='1m',
+                                                                    num_candles=1))['close']
+
+        return list(close)[0]
 
-        return candles_df
+    async def close_async(self):
+        """
+        See description in parent class
+        """
+        if self._async_exchange_api is not None:
+            await self._async_exchange_api.close()
 
     def get_fee_factor(self, symbol, vs_currency, type='spot'):
         """
         See description in parent class
         """
         market = self._market_from_symbol_and_vs_currency(symbol, vs_currency)
+
+        if market in self._fees:
+            fee_factors, fetched_at = self._fees[market]
+            if time.monotonic() - fetched_at < self._fee_ttl_seconds:
+                return fee_factors
+
         fee_factors = self._exchange_api.fetch_trading_fee(market)
+        self._fees[market] = (fee_factors, time.monotonic())
 
         return fee_factors
 
@@ -373,6 +694,10 @@ class CcxtExchangeHandler(ExchangeHandler):
         """
         See description in parent class
         """
+        streamed_price = self._streamed_price(symbol, vs_currency)
+        if streamed_price is not None:
+            return streamed_price
+
         close = self.get_candles_last_one_not_finished(symbol=symbol,
                                                        vs_currency=vs_currency,
                                                        timeframe='1m',
@@ -380,52 +705,54 @@ class CcxtExchangeHandler(ExchangeHandler):
 
         return list(close)[0]
 
-    def get_total_amount_in_symbol(self, symbol=config.VS_CURRENCY):
+    def get_current_prices(self, markets):
+        """
+        See description in parent class
+        Streamed prices are used when available. The rest of prices are retrieved
+        in a single tickers request
+        """
+        markets = list(markets)
+        streamed_prices = self._price_book.prices(markets) \
+            if self._price_book is not None else {}
+        markets = [market for market in markets if market not in streamed_prices]
+        if not markets:
+            return streamed_prices
+
+        market_symbols = {
+            self._market_from_symbol_and_vs_currency(symbol, vs_currency): (symbol, vs_currency)
+            for symbol, vs_currency in markets
+        }
+        tickers = self._exchange_api.fetch_tickers(list(market_symbols.keys()))
+
+        return {
+            **streamed_prices,
+            **{market: tickers[market_symbol]['last']
+               for market_symbol, market in market_symbols.items()
+               if market_symbol in tickers and tickers[market_symbol]['last'] is not None}
+        }
+
+    def get_server_time(self):
         """
         See description in parent class
-        This method is susceptible to not work with other symbols
-        """
-        # Retrieve balances from account
-        balances = self._exchange_api.fetch_balance()
-        # Extract total balances as a dictionary (includes balances with value 0)
-        balances = balances.pop('total')
-
-        # Store non_zero_balances
-        non_zero_balances = {}
-        for key, val in balances.items():
-            if val > 0:
-                non_zero_balances[key] = val
-
-        symbol_balance = non_zero_balances.pop(symbol)
-
-        # Retrieve tickers to convert each balance to the specified symbol
-        tickers = self._exchange_api.fetch_tickers()
-        # Store only useful tickers
-        useful_tickers = {}
-        for key, ticker in tickers.items():
-            if key.endswith(symbol):
-                useful_tickers[key] = ticker
-
-        # Find non-matching elements
-        ticker_symbols = set(
-            map(
-                lambda x: x.split('/')[0],
-                set(useful_tickers.keys())
-            )
-        )
-        balances_symbols = set(non_zero_balances.keys())
-
-        different_symbols = balances_symbols.difference(ticker_symbols)
-
-        for sym in different_symbols:
-            non_zero_balances.pop(sym)
-
-        for sym, val in non_zero_balances.items():
-            last_pair_price = useful_tickers[f'{sym}/{symbol}']['last']
-            if last_pair_price is not None:
-                symbol_balance += last_pair_price * val
-
-        return symbol_balance
+        """
+        return self._exchange_api.fetch_time()
+
+    def get_total_balances(self):
+        """
+        See description in parent class
+        """
+        return {asset: float(amount)
+                for asset, amount in self._exchange_api.fetch_balance()['total'].items()
+                if amount}
+
+    def has_market(self, symbol, vs_currency):
+        """
+        See description in parent class
+        """
+        self._load_markets()
+
+        return self._market_from_symbol_and_vs_currency(symbol, vs_currency) in \
+            self._exchange_api.markets
 
     def withdraw_fiat_to_bank_account(self, fiat_symbol, fiat_quantity, swift):
         self._exchange_api.withdraw(code=fiat_symbol, amount=fiat_quantity, address='wallet')
@@ -0,0 +1,151 @@
+from dataclasses import dataclass
+import time
+
+import ccxt
+
+import candleclock as cc
+import exchangehandler as ex_han
+import model
+
+
+MAX_CANDLES_PER_CHECK = 1000  # Maximum number of candles requested per position
+
+
+class ExitReason:
+    TAKE_PROFIT = "take_profit"
+    MIN_NOTIONAL = "min_notional"
+    STOP_LOSS = "stop_loss"
+
+
+@dataclass(slots=True, kw_only=True)
+class ExitDecision:
+    trade: model.Trade
+    exit_price: float
+    reason: str  # ExitReason
+    high: float  # Highest price since the last check
+    low: float  # Lowest price since the last check
+
+
+def current_take_profit(trade):
+    return trade.modified_take_profit if trade.modified_take_profit is not None else trade.take_profit
+
+
+def current_stop_loss(trade):
+    return trade.modified_stop_loss if trade.modified_stop_loss is not None else trade.stop_loss
+
+
+def decide_exit(trade, high, low, min_vs_currency_to_enter_market):
+    """
+    Applies the exit priority rules to the price range of a position
+    :param trade: opened trade
+    :param high: highest price since the last check
+    :param low: lowest price since the last check
+    :param min_vs_currency_to_enter_market: minimum notional of the market. Used
+    to sell if the price is foreseen to go below it
+    :return: ExitDecision or None if the position must remain opened
+    """
+    if high >= current_take_profit(trade):
+        exit_price, reason = current_take_profit(trade), ExitReason.TAKE_PROFIT
+    elif min_vs_currency_to_enter_market <= low <= min_vs_currency_to_enter_market * 1.004:
+        exit_price, reason = low, ExitReason.MIN_NOTIONAL
+    elif low <= current_stop_loss(trade):
+        exit_price, reason = current_stop_loss(trade), ExitReason.STOP_LOSS
+    else:
+        return None
+
+    return ExitDecision(trade=trade, exit_price=exit_price, reason=reason,
+                        high=high, low=low)
+
+
+class PositionExitEvaluator:
+    """
+    Decides which opened positions must be closed. Each position costs one candle
+    request per check, which covers the whole interval since its previous check,
+    so that wicks happening between checks are not missed. If the market is
+    streamed and the stream covers that interval, no request is made.
+    """
+    def __init__(self, exchange_handler: ex_han.ExchangeHandler, timeframe='1m',
+                 clock=None, price_book=None):
+        """
+        :param exchange_handler: ExchangeHandler to fetch candles and markets from
+        :param timeframe: timeframe of the candles used to compute price ranges
+        :param clock: function returning the current time in milliseconds. If
+        None, local time is used
+        :param price_book: marketstream.LatestPriceBook with the streamed prices
+        """
+        self._exchange_handler = exchange_handler
+        self._timeframe = timeframe
+        self._price_book = price_book
+        self._clock = clock if clock is not None else lambda: int(time.time() * 1000)
+        # trade id -> open time in milliseconds of the last candle checked
+        self._last_checked_candle = {}
+
+    def evaluate(self, opened_trades):
+        """
+        :param opened_trades: list of opened trades
+        :return: list of ExitDecision for the positions that must be closed.
+        Positions whose prices can not be fetched due to network errors are
+        evaluated again in the next call, from their last check
+        """
+        decisions = []
+        for trade in opened_trades:
+            try:
+                decision = self.evaluate_trade(trade)
+            except ccxt.NetworkError:
+                continue
+            if decision is not None:
+                decisions.append(decision)
+
+        return decisions
+
+    def evaluate_trade(self, trade):
+        """
+        :param trade: opened trade
+        :return: ExitDecision or None if the position must remain opened
+        """
+        # Fetched first, so that the last check is not moved if it fails
+        market_info = self._exchange_handler.fetch_market(symbol=trade.symbol,
+                                                          vs_currency=trade.vs_currency_symbol)
+        high, low = self._price_range_since_last_check(trade)
+
+        return decide_exit(trade, high=high, low=low,
+                           min_vs_currency_to_enter_market=market_info['min_vs_currency'])
+
+    def forget(self, trade):
+        """
+        Removes the stored information of a trade. Must be called once it is closed
+        """
+        self._last_checked_candle.pop(trade.id, None)
+
+    def _price_range_since_last_check(self, trade):
+        since = self._last_checked_candle.get(trade.id)
+
+        if since is not None and self._price_book is not None:
+            streamed_range = self._price_book.price_range(trade.symbol,
+                                                          trade.vs_currency_symbol,
+                                                          since)
+            if streamed_range is not None:
+                high, low, last_timestamp = streamed_range
+                self._last_checked_candle[trade.id] = cc.candle_open_time(
+                    self._timeframe, last_timestamp)
+                return high, low
+
+        if since is None:
+            num_candles = 1
+        else:
+            # The last checked candle is requested again since it was unfinished.
+            # One more candle is requested to tolerate clock differences
+            elapsed_candles = (self._clock() - since) // \
+                cc.timeframe_to_milliseconds(self._timeframe) + 2
+            num_candles = int(min(max(elapsed_candles, 1), MAX_CANDLES_PER_CHECK))
+
+        # Only high, low and open times are needed, so no DataFrame is built
+        candles = self._exchange_handler.get_candle_frame_last_one_not_finished(
+            symbol=trade.symbol, vs_currency=trade.vs_currency_symbol,
+            timeframe=self._timeframe, num_candles=num_candles, since=since)
+
+        self._last_checked_candle[trade.id] = cc.candle_open_time(
+            self._timeframe, int(candles.timestamp[-1])
+        )
+
+        return float(candles.high.max()), float(candles.low.min())
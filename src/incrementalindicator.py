@@ -0,0 +1,316 @@
+from abc import ABC, abstractmethod
+from collections import deque
+import math
+
+import numpy as np
+import pandas as pd
+
+
+class IncrementalIndicator(ABC):
+    """
+    Indicator updated with each closed candle in constant time. Fed with the same
+    candles, its values are the ones of the equivalent indicator in indicator.py.
+    Until warm_up_candles candles have been received, value has the same
+    placeholder as the batch indicator (NaN or 0).
+    """
+    warm_up_candles: int
+
+    @abstractmethod
+    def update(self, high, low, close):
+        """
+        Adds a closed candle
+        :return: value of the indicator after the candle
+        """
+        raise NotImplementedError
+
+    @property
+    @abstractmethod
+    def value(self):
+        """
+        :return: value of the indicator after the last candle
+        """
+        raise NotImplementedError
+
+    @property
+    def is_ready(self):
+        """
+        :return: True once the warm-up period has finished
+        """
+        return self.num_candles >= self.warm_up_candles
+
+    def seed(self, df: pd.DataFrame):
+        """
+        Adds every candle of df, in order
+        :param df: dataframe with high, low and close columns
+        :return: list with the value after each candle
+        """
+        return [self.update(high, low, close) for high, low, close in zip(
+            df['high'].to_numpy(dtype=float), df['low'].to_numpy(dtype=float),
+            df['close'].to_numpy(dtype=float)
+        )]
+
+
+class _ExponentialAverage:
+    """
+    Same recursion as pandas ewm(adjust=False)
+    """
+    def __init__(self, alpha):
+        self._alpha = alpha
+        self.value = math.nan
+
+    def update(self, x):
+        if math.isnan(self.value):
+            self.value = x
+        else:
+            old_weight = 1 - self._alpha
+            self.value = (old_weight * self.value + self._alpha * x) / \
+                (old_weight + self._alpha)
+
+        return self.value
+
+
+class _RollingExtremes:
+    """
+    Minimum and maximum of the last window values, with monotonic queues so that
+    each update takes amortized constant time
+    """
+    def __init__(self, window):
+        self._window = window
+        self._count = 0
+        self._minimums = deque()  # (position, value) with increasing values
+        self._maximums = deque()  # (position, value) with decreasing values
+
+    def update(self, x):
+        position = self._count
+        self._count += 1
+
+        while self._minimums and self._minimums[-1][1] >= x:
+            self._minimums.pop()
+        self._minimums.append((position, x))
+        while self._maximums and self._maximums[-1][1] <= x:
+            self._maximums.pop()
+        self._maximums.append((position, x))
+
+        oldest_position = position - self._window + 1
+        if self._minimums[0][0] < oldest_position:
+            self._minimums.popleft()
+        if self._maximums[0][0] < oldest_position:
+            self._maximums.popleft()
+
+    @property
+    def minimum(self):
+        return self._minimums[0][1] if self._count >= self._window else math.nan
+
+    @property
+    def maximum(self):
+        return self._maximums[0][1] if self._count >= self._window else math.nan
+
+
+class _RollingMean:
+    """
+    Mean of the last window values. NaN if any of them is NaN, as pandas rolling
+    """
+    def __init__(self, window):
+        self._values = deque(maxlen=window)
+
+    def update(self, x):
+        self._values.append(x)
+        if len(self._values) < self._values.maxlen:
+            return math.nan
+
+        return sum(self._values) / len(self._values)
+
+
+class IncrementalEma(IncrementalIndicator):
+    """
+    Same values as indicator.get_ema. Warm-up: period candles
+    """
+    def __init__(self, period: int):
+        self.warm_up_candles = period
+        self.num_candles = 0
+        self._average = _ExponentialAverage(alpha=2 / (period + 1))
+
+    def update(self, high, low, close):
+        self.num_candles += 1
+        self._average.update(close)
+
+        return self.value
+
+    @property
+    def value(self):
+        return self._average.value if self.is_ready else math.nan
+
+
+class IncrementalAtr(IncrementalIndicator):
+    """
+    Same values as indicator.get_atr. Warm-up: period candles, before them the
+    value is 0 as in ta
+    """
+    def __init__(self, period: int = 14):
+        self.warm_up_candles = period
+        self.num_candles = 0
+        self._period = period
+        self._previous_close = None
+        self._true_ranges = []  # Only kept during the warm-up
+        self._atr = 0.
+
+    def update(self, high, low, close):
+        if self._previous_close is None:
+            true_range = high - low
+        else:
+            true_range = max(high - low, abs(high - self._previous_close),
+                             abs(low - self._previous_close))
+        self._previous_close = close
+        self.num_candles += 1
+
+        if self.num_candles < self._period:
+            self._true_ranges.append(true_range)
+        elif self.num_candles == self._period:
+            self._true_ranges.append(true_range)
+            self._atr = float(np.mean(self._true_ranges))
+            self._true_ranges = []
+        else:
+            self._atr = (self._atr * (self._period - 1) + true_range) / float(self._period)
+
+        return self.value
+
+    @property
+    def value(self):
+        return self._atr
+
+
+class IncrementalRsi(IncrementalIndicator):
+    """
+    Same values as indicator.get_rsi. Warm-up: period candles
+    """
+    def __init__(self, period: int = 14):
+        self.warm_up_candles = period
+        self.num_candles = 0
+        self._previous_close = None
+        self._average_up = _ExponentialAverage(alpha=1 / period)
+        self._average_down = _ExponentialAverage(alpha=1 / period)
+
+    def update(self, high, low, close):
+        diff = 0. if self._previous_close is None else close - self._previous_close
+        self._previous_close = close
+        self.num_candles += 1
+
+        self._average_up.update(diff if diff > 0 else 0.)
+        self._average_down.update(-diff if diff < 0 else 0.)
+
+        return self.value
+
+    @property
+    def value(self):
+        if not self.is_ready:
+            return math.nan
+
+        if self._average_down.value == 0:
+            return 100.
+
+        relative_strength = self._average_up.value / self._average_down.value
+        return 100 - (100 / (1 + relative_strength))
+
+
+class IncrementalStochasticRsi(IncrementalIndicator):
+    """
+    Same values as indicator.get_stochastic_rsi. value is a dict with stoch, k
+    and d. Warm-up: 2 * period - 1 candles for stoch, smooth1 - 1 more for k and
+    smooth2 - 1 more for d
+    """
+    def __init__(self, period: int = 14, smooth1: int = 3, smooth2: int = 3):
+        self.warm_up_candles = 2 * period + smooth1 + smooth2 - 3
+        self.num_candles = 0
+        self._rsi = IncrementalRsi(period)
+        self._rsi_extremes = _RollingExtremes(period)
+        self._k_mean = _RollingMean(smooth1)
+        self._d_mean = _RollingMean(smooth2)
+        self._value = {'stoch': math.nan, 'k': math.nan, 'd': math.nan}
+
+    def update(self, high, low, close):
+        self.num_candles += 1
+        rsi = self._rsi.update(high, low, close)
+
+        if math.isnan(rsi):
+            stoch = math.nan
+        else:
+            self._rsi_extremes.update(rsi)
+            lowest, highest = self._rsi_extremes.minimum, self._rsi_extremes.maximum
+            # 0 / 0 is NaN as in pandas
+            stoch = math.nan if highest == lowest else (rsi - lowest) / (highest - lowest)
+
+        k = self._k_mean.update(stoch)
+        d = self._d_mean.update(k)
+        self._value = {'stoch': stoch, 'k': k, 'd': d}
+
+        return self.value
+
+    @property
+    def value(self):
+        return dict(self._value)
+
+
+class IncrementalAtrStopLoss(IncrementalIndicator):
+    """
+    Same values as indicator.get_atr_stop_loss for the last candle. value is a
+    dict with high_band and low_band. Warm-up: atr_period candles
+    """
+    def __init__(self, atr_period=12, atr_factor=1.5):
+        self._atr = IncrementalAtr(atr_period)
+        self.warm_up_candles = self._atr.warm_up_candles
+        self._atr_factor = atr_factor
+        self._value = {'high_band': math.nan, 'low_band': math.nan}
+
+    @property
+    def num_candles(self):
+        return self._atr.num_candles
+
+    def update(self, high, low, close):
+        atr = self._atr.update(high, low, close)
+        self._value = {'high_band': high + atr * self._atr_factor,
+                       'low_band': low - atr * self._atr_factor}
+
+        return self.value
+
+    @property
+    def value(self):
+        return dict(self._value)
+
+
+class MarketIndicatorState:
+    """
+    Incremental indicators of one market, fed with the closed candles of
+    consecutive scans. Only the candles not seen in previous scans are added, and
+    the indicators are seeded again when the candles are not contiguous.
+    """
+    def __init__(self, indicator_factory):
+        """
+        :param indicator_factory: function returning a dict name -> IncrementalIndicator
+        """
+        self._indicator_factory = indicator_factory
+        self.indicators = None
+        self._last_candle_time = None
+
+    def update(self, closed_candles: pd.DataFrame):
+        """
+        :param closed_candles: closed candles with datetime, high, low and close
+        columns, oldest first. They must include the last candle of the previous
+        call to be considered contiguous
+        :return: dict name -> IncrementalIndicator after the last candle
+        """
+        if len(closed_candles) == 0:
+            return self.indicators
+
+        datetimes = closed_candles['datetime']
+        if self.indicators is None or self._last_candle_time is None or \
+                not (datetimes == self._last_candle_time).any():
+            self.indicators = self._indicator_factory()
+            new_candles = closed_candles
+        else:
+            new_candles = closed_candles[datetimes > self._last_candle_time]
+
+        for indicator in self.indicators.values():
+            indicator.seed(new_candles)
+        self._last_candle_time = datetimes.iloc[-1]
+
+        return self.indicators
@@ -5,8 +5,17 @@ from ta.trend import EMAIndicator
 from ta.momentum import RSIIndicator, StochRSIIndicator, StochasticOscillator
 from ta.volatility import AverageTrueRange, BollingerBands
 
+try:
+    import numba
+except ImportError:
+    # Optional. Only used to speed up loops that can not be vectorized
+    numba = None
+
 pd.set_option('display.max_rows', None)
 
+# Maximum number of pairs of lows compared at once by get_bullish_divergence
+DIVERGENCE_BLOCK_ELEMENTS = 4_000_000
+
 
 def get_local_minimums(df_column: pd.DataFrame, n: int):
     """
@@ -89,40 +98,58 @@ def get_bullish_divergence(type: str, candle_body_low_series: pd.DataFrame, cand
     inv_lows_df['indicator_low'] = lows_df['lowest']
     # Remove rows where there are no indicator minimum
     inv_lows_df = inv_lows_df[~inv_lows_df['indicator_low'].isna()]
-    # Reverse DataFrame order to iterate over it and get a easier way to detect divergence
+    # Reverse DataFrame order to keep the order of the divergences returned
     inv_lows_df = inv_lows_df[::-1]
 
+    is_divergence = _lows_with_divergence(type,
+                                          inv_lows_df.index.values,
+                                          inv_lows_df['price_lows'].to_numpy(dtype=float),
+                                          inv_lows_df['indicator_low'].to_numpy(dtype=float))
     # List to populate with tuples (index, bool) containing indication of divergence
-    divergences = []
-
-    # Look for divergence
-    for row in inv_lows_df.itertuples():
-        row_index = row[0]
-        row_price_low = row[1]
-        row_indicator_low = row[2]
-
-        for row_loop_2 in inv_lows_df.itertuples():
-            row_index_loop_2 = row_loop_2[0]
-            row_price_low_loop_2 = row_loop_2[1]
-            row_indicator_low_loop_2 = row_loop_2[2]
-
-            if row_index_loop_2 < row_index:
-                if type == 'r':
-                    if row_price_low_loop_2 > row_price_low and row_indicator_low_loop_2 < row_indicator_low:
-                        divergences.append((row_index, True))
-                        break
-                elif type == 'h':
-                    if row_price_low_loop_2 < row_price_low and row_indicator_low_loop_2 > row_indicator_low:
-                        divergences.append((row_index, True))
-                        break
-                else:
-                    raise ValueError(f"Expected value 'r' or 'h' for type, instead {type} was given.")
+    divergences = list(zip(inv_lows_df.index[is_divergence], [True] * int(is_divergence.sum())))
 
     divergence_col = pd.DataFrame(divergences, columns=['index', 'r_bull']).set_index('index')
 
     return divergence_col
 
 
+def _lows_with_divergence(type: str, indexes: np.ndarray, price_lows: np.ndarray,
+                          indicator_lows: np.ndarray):
+    """
+    For each low, checks whether there is a previous low (lower index) with a
+    divergence. Every pair of lows is compared at once, in blocks of rows so that
+    memory usage is bounded
+    :param type: r o h for regular or hidden divergence, respectively
+    :param indexes: index of each low
+    :param price_lows: price of each low
+    :param indicator_lows: indicator value of each low
+    :return: boolean array, True where there is a divergence
+    """
+    if type not in ('r', 'h'):
+        raise ValueError(f"Expected value 'r' or 'h' for type, instead {type} was given.")
+
+    num_lows = len(indexes)
+    is_divergence = np.zeros(num_lows, dtype=bool)
+    block_size = max(1, DIVERGENCE_BLOCK_ELEMENTS // max(num_lows, 1))
+
+    for block_start in range(0, num_lows, block_size):
+        block = slice(block_start, block_start + block_size)
+        is_previous = indexes[np.newaxis, :] < indexes[block, np.newaxis]
+
+        if type == 'r':
+            # Higher price low and lower indicator low before
+            has_divergence = (price_lows[np.newaxis, :] > price_lows[block, np.newaxis]) & \
+                             (indicator_lows[np.newaxis, :] < indicator_lows[block, np.newaxis])
+        else:
+            # Lower price low and higher indicator low before
+            has_divergence = (price_lows[np.newaxis, :] < price_lows[block, np.newaxis]) & \
+                             (indicator_lows[np.newaxis, :] > indicator_lows[block, np.newaxis])
+
+        is_divergence[block] = (is_previous & has_divergence).any(axis=1)
+
+    return is_divergence
+
+
 def get_rsi(df: pd.DataFrame):
     rsi_indicator = RSIIndicator(df['close'])
     rsi = rsi_indicator.rsi()
@@ -216,15 +243,58 @@ def super_trend(df: pd.DataFrame, atr_period: int, multiplier: float):
     # HL2 is simply the average of high and low prices
     hl2 = (high + low) / 2
     # upperband and lowerband calculation
-    # notice that final bands are set to be equal to the respective bands
-    final_upperband = upperband = hl2 + (multiplier * atr)
-    final_lowerband = lowerband = hl2 - (multiplier * atr)
+    upperband = (hl2 + (multiplier * atr)).to_numpy(dtype=float)
+    lowerband = (hl2 - (multiplier * atr)).to_numpy(dtype=float)
 
-    # initialize Supertrend column to True
-    supertrend = [True] * len(df)
+    supertrend, final_lowerband, final_upperband = super_trend_arrays(
+        close.to_numpy(dtype=float), upperband, lowerband)
+
+    return pd.DataFrame({
+        'supertrend': supertrend,
+        'lowerband': final_lowerband,
+        'upperband': final_upperband
+    }, index=df.index)
 
-    for i in range(1, len(df.index)):
-        curr, prev = i, i-1
+
+def super_trend_arrays(close: np.ndarray, upperband: np.ndarray, lowerband: np.ndarray):
+    """
+    Computes the trend and final bands of the Supertrend indicator. It is
+    JIT-compiled when numba is installed
+    :param close: close prices
+    :param upperband: basic upper band (hl2 + multiplier * atr)
+    :param lowerband: basic lower band (hl2 - multiplier * atr)
+    :return: tuple of arrays (supertrend, final_lowerband, final_upperband)
+    """
+    # notice that final bands are initialized to the respective bands
+    if numba is not None:
+        supertrend = np.ones(len(close), dtype=np.bool_)
+        final_upperband = np.array(upperband, dtype=np.float64)
+        final_lowerband = np.array(lowerband, dtype=np.float64)
+        _super_trend_kernel_jit(np.asarray(close, dtype=np.float64), supertrend,
+                                final_lowerband, final_upperband)
+
+        return supertrend, final_lowerband, final_upperband
+
+    # Python lists are much faster than arrays when accessed element by element
+    supertrend = [True] * len(close)
+    final_upperband = np.asarray(upperband, dtype=float).tolist()
+    final_lowerband = np.asarray(lowerband, dtype=float).tolist()
+    _super_trend_kernel(np.asarray(close, dtype=float).tolist(), supertrend,
+                        final_lowerband, final_upperband)
+
+    return (np.array(supertrend, dtype=bool), np.array(final_lowerband, dtype=float),
+            np.array(final_upperband, dtype=float))
+
+
+def _super_trend_kernel(close, supertrend, final_lowerband, final_upperband):
+    """
+    Fills supertrend and adjusts the final bands in place. Supertrend must be
+    initialized to True
+    """
+    nan = np.nan
+
+    for curr in range(1, len(close)):
+        prev = curr - 1
 
         # if current close price crosses above upperband
         if close[curr] > final_upperband[prev]:
@@ -237,32 +307,33 @@ def super_trend(df: pd.DataFrame, atr_period: int, multiplier: float):
             supertrend[curr] = supertrend[prev]
 
             # adjustment to the final bands
-            if supertrend[curr] == True and final_lowerband[curr] < final_lowerband[prev]:
+            if supertrend[curr] and final_lowerband[curr] < final_lowerband[prev]:
                 final_lowerband[curr] = final_lowerband[prev]
-            if supertrend[curr] == False and final_upperband[curr] > final_upperband[prev]:
+            if not supertrend[curr] and final_upperband[curr] > final_upperband[prev]:
                 final_upperband[curr] = final_upperband[prev]
 
         # to remove bands according to the trend direction
-        if supertrend[curr] == True:
-            final_upperband[curr] = np.nan
+        if supertrend[curr]:
+            final_upperband[curr] = nan
         else:
-            final_lowerband[curr] = np.nan
+            final_lowerband[curr] = nan
 
-    return pd.DataFrame({
-        'supertrend': supertrend,
-        'lowerband': final_lowerband,
-        'upperband': final_upperband
-    }, index=df.index)
+
+_super_trend_kernel_jit = numba.njit(cache=True)(_super_trend_kernel) \
+    if numba is not None else None
 
 
-def support_and_resistance(df: pd.DataFrame, margin = .002):
+def support_and_resistance(df: pd.DataFrame, margin = .002, lows=None):
     """
     It is ideal to get the maximum number of candles in the df
     :param df:
     :param margin:
+    :param lows: local minimums of df['low'] with n=2 (e.g. from a
+    localextrema.MarketLocalExtrema). If None, they are computed
     :return:
     """
-    lows = get_local_minimums(df['low'], 2)
+    if lows is None:
+        lows = get_local_minimums(df['low'], 2)
     count, division = np.histogram(lows)
     division = np.array(division)
 
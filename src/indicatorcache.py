@@ -0,0 +1,159 @@
+from collections import OrderedDict
+from dataclasses import dataclass
+import sys
+import threading
+
+import numpy as np
+import pandas as pd
+
+import config
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class IndicatorCacheStats:
+    hits: int
+    misses: int
+    evictions: int
+    entries: int
+    size_bytes: int
+
+    @property
+    def hit_ratio(self):
+        requests = self.hits + self.misses
+        return self.hits / requests if requests else 0.
+
+
+def result_size_bytes(result):
+    """
+    :return: approximate memory used by an indicator result
+    """
+    if isinstance(result, (pd.Series, pd.DataFrame)):
+        memory = result.memory_usage(index=True, deep=True)
+        return int(memory.sum()) if isinstance(memory, pd.Series) else int(memory)
+    if isinstance(result, np.ndarray):
+        return result.nbytes
+    if isinstance(result, dict):
+        return sys.getsizeof(result) + sum(result_size_bytes(value)
+                                           for value in result.values())
+    if isinstance(result, (list, tuple)):
+        return sys.getsizeof(result) + sum(result_size_bytes(value)
+                                           for value in result)
+
+    return sys.getsizeof(result)
+
+
+class IndicatorCache:
+    """
+    LRU memoization of indicator results. The key is the indicator function, the
+    market, the timeframe, the parameters and the candles given: first and last
+    candle time, number of candles and values of the last candle (so that an
+    unfinished candle that changes is not served from cache). Least recently used
+    results are evicted when their total size exceeds max_bytes.
+
+    Results are shared between callers, so they must not be modified.
+    """
+    def __init__(self, max_bytes=config.INDICATOR_CACHE_MAX_BYTES):
+        """
+        :param max_bytes: memory budget of the cached results
+        """
+        self._max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._results = OrderedDict()  # key -> (result, size in bytes)
+        self._size_bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def compute(self, indicator_function, df: pd.DataFrame, market, timeframe=None,
+                **params):
+        """
+        Returns indicator_function(df, **params), computing it only if it is not
+        cached
+        :param indicator_function: function of indicator.py receiving df
+        :param df: candles with datetime column, oldest first
+        :param market: (symbol, vs_currency) of the candles
+        :param timeframe: timeframe of the candles. If None, the time between the
+        last two candles is used
+        :param params: parameters of indicator_function, as keyword arguments
+        :return: result of indicator_function
+        """
+        key = self._key(indicator_function, df, market, timeframe, params)
+
+        with self._lock:
+            if key in self._results:
+                self._hits += 1
+                self._results.move_to_end(key)
+                return self._results[key][0]
+            self._misses += 1
+
+        result = indicator_function(df, **params)
+        self._store(key, result)
+
+        return result
+
+    def memoize(self, indicator_function, market, timeframe=None):
+        """
+        :return: function with the signature of indicator_function whose results
+        are cached for the given market
+        """
+        def memoized(df, **params):
+            return self.compute(indicator_function, df, market, timeframe, **params)
+
+        return memoized
+
+    def stats(self):
+        """
+        :return: IndicatorCacheStats
+        """
+        with self._lock:
+            return IndicatorCacheStats(hits=self._hits, misses=self._misses,
+                                       evictions=self._evictions,
+                                       entries=len(self._results),
+                                       size_bytes=self._size_bytes)
+
+    def clear(self):
+        """
+        Removes every result. Counters are kept
+        """
+        with self._lock:
+            self._results.clear()
+            self._size_bytes = 0
+
+    def _store(self, key, result):
+        size_bytes = result_size_bytes(result)
+        if size_bytes > self._max_bytes:
+            # It would evict everything else
+            return
+
+        with self._lock:
+            if key in self._results:
+                return
+
+            self._results[key] = (result, size_bytes)
+            self._size_bytes += size_bytes
+
+            while self._size_bytes > self._max_bytes:
+                _, (_, evicted_size_bytes) = self._results.popitem(last=False)
+                self._size_bytes -= evicted_size_bytes
+                self._evictions += 1
+
+    @staticmethod
+    def _key(indicator_function, df, market, timeframe, params):
+        datetimes = df['datetime']
+        if len(df) == 0:
+            candles_key = (0,)
+        else:
+            if timeframe is None and len(df) > 1:
+                timeframe = datetimes.iloc[-1] - datetimes.iloc[-2]
+            last_candle = df.iloc[-1]
+            candles_key = (len(df), datetimes.iloc[0], datetimes.iloc[-1],
+                           tuple(float(last_candle[column])
+                                 for column in ('open', 'high', 'low', 'close', 'volume')
+                                 if column in df.columns))
+
+        return (indicator_function, tuple(market), timeframe,
+                tuple(sorted(params.items())), candles_key)
+
+
+# Cache shared by the strategies
+indicator_cache = IndicatorCache()
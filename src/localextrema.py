@@ -0,0 +1,154 @@
+from collections import deque
+import copy
+
+import numpy as np
+import pandas as pd
+
+import config
+
+
+class StreamingLocalExtrema:
+    """
+    Local extrema of a series received one value at a time, with the same rule as
+    indicator.get_local_minimums/get_local_maximums (scipy argrelextrema): a value
+    is an extremum if the comparator holds against the n values before and after
+    it. A pivot is confirmed once n values have followed it. Only the last
+    max_pivots confirmed pivots are kept.
+    """
+    def __init__(self, n: int, comparator=np.less, max_pivots=config.MAX_PIVOTS_PER_MARKET):
+        """
+        :param n: number of values to be checked before and after
+        :param comparator: np.less for minimums, np.greater for maximums
+        :param max_pivots: maximum number of confirmed pivots kept
+        """
+        self._n = n
+        self._comparator = comparator
+        # Last (label, value) pairs, enough to check the candidate and the tail
+        self._window = deque(maxlen=2 * n + 1)
+        self.num_values = 0
+        self.pivots = deque(maxlen=max_pivots)  # (label, value), oldest first
+
+    def update(self, label, value):
+        """
+        Adds the next value of the series
+        :param label: label of the value (e.g. candle time)
+        :return: (label, value) of the pivot confirmed with this value, or None
+        """
+        self._window.append((label, value))
+        self.num_values += 1
+
+        # The first value is never an extremum, as in argrelextrema
+        if self.num_values - 1 - self._n < 1:
+            return None
+
+        candidate = len(self._window) - 1 - self._n
+        if self._is_extremum(candidate):
+            self.pivots.append(self._window[candidate])
+            return self._window[candidate]
+
+        return None
+
+    def seed(self, labels, values):
+        """
+        Adds several values in order
+        :return: list of the pivots confirmed
+        """
+        pivots = [self.update(label, value) for label, value in zip(labels, values)]
+
+        return [pivot for pivot in pivots if pivot is not None]
+
+    def copy(self):
+        """
+        :return: independent copy of the detector, to add values that may be
+        revised later without changing this one
+        """
+        other = copy.copy(self)
+        other._window = deque(self._window, maxlen=self._window.maxlen)
+        other.pivots = deque(self.pivots, maxlen=self.pivots.maxlen)
+
+        return other
+
+    def provisional_pivots(self):
+        """
+        Extrema among the last n values, which are not confirmed yet. As in
+        argrelextrema, they are only compared with the values available after them
+        :return: list of (label, value)
+        """
+        provisional = []
+        first_position = max(self.num_values - self._n, 1)
+
+        for position in range(first_position, self.num_values):
+            candidate = len(self._window) - (self.num_values - position)
+            if self._is_extremum(candidate):
+                provisional.append(self._window[candidate])
+
+        return provisional
+
+    def _is_extremum(self, candidate):
+        value = self._window[candidate][1]
+        neighbours = [self._window[i][1]
+                      for i in range(max(candidate - self._n, 0),
+                                     min(candidate + self._n + 1, len(self._window)))
+                      if i != candidate]
+        # The last value has no neighbours after it. It is compared with itself
+        if candidate == len(self._window) - 1:
+            neighbours.append(value)
+
+        return all(self._comparator(value, neighbour) for neighbour in neighbours)
+
+
+class MarketLocalExtrema:
+    """
+    Local extrema of a candle column of one market, fed with the candles of
+    consecutive scans. Only the candles not seen in previous scans are added, and
+    the detector is created again when the candles are not contiguous. The last
+    candle of each scan may be unfinished, so it is only added to a copy of the
+    detector, and it is added again in the next scan with its final values.
+    """
+    def __init__(self, column: str, n: int, comparator=np.less,
+                 max_pivots=config.MAX_PIVOTS_PER_MARKET):
+        """
+        :param column: column of the candles whose extrema are detected
+        """
+        self._column = column
+        self._n = n
+        self._comparator = comparator
+        self._max_pivots = max_pivots
+        # Detector fed with every candle except the last one of the previous call
+        self._detector = None
+        self._last_candle_time = None
+
+    def update(self, df: pd.DataFrame):
+        """
+        :param df: candles with datetime column, oldest first. The last one may be
+        unfinished. They must include the last candle of the previous call to be
+        considered contiguous
+        :return: extrema within df, in the format of indicator.get_local_minimums.
+        Pivots of the first n candles of df can differ from it, since they were
+        confirmed with the candles before df
+        """
+        if len(df) == 0:
+            return df[self._column].iloc[:0]
+
+        datetimes = df['datetime']
+        previous_candles = df.iloc[:-1]
+        if self._detector is None or self._last_candle_time is None or \
+                not (datetimes == self._last_candle_time).any():
+            self._detector = StreamingLocalExtrema(self._n, self._comparator,
+                                                   self._max_pivots)
+            new_candles = previous_candles
+        else:
+            # The last candle of the previous call may have changed since then
+            new_candles = previous_candles[previous_candles['datetime'] >= self._last_candle_time]
+
+        self._detector.seed(new_candles['datetime'], new_candles[self._column])
+        self._last_candle_time = datetimes.iloc[-1]
+
+        detector = self._detector.copy()
+        detector.update(self._last_candle_time, df[self._column].iloc[-1])
+
+        pivots = list(detector.pivots) + detector.provisional_pivots()
+        positions = pd.Index(datetimes).get_indexer([label for label, _ in pivots])
+        positions = positions[positions >= 0]
+
+        return df[self._column].iloc[positions]
@@ -0,0 +1,463 @@
+from abc import ABC, abstractmethod
+import asyncio
+from collections import OrderedDict
+import dataclasses
+from dataclasses import dataclass
+import json
+import threading
+import time
+
+import ccxt.pro as ccxt_pro
+
+import candleclock as cc
+import commonutils as cu
+import config
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class TradeEvent:
+    symbol: str
+    vs_currency: str
+    timestamp: int  # Exchange time in milliseconds
+    price: float
+    amount: float
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class KlineEvent:
+    symbol: str
+    vs_currency: str
+    timeframe: str
+    timestamp: int  # Open time in milliseconds
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
+    is_closed: bool
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class StreamInterruptedEvent:
+    """
+    Published when a stream of a market is interrupted, so that subscribers know
+    that some events of the market may have been lost
+    """
+    symbol: str
+    vs_currency: str
+    timestamp: int  # Local time in milliseconds
+
+
+_EVENT_TYPES = {
+    'trade': TradeEvent,
+    'kline': KlineEvent,
+    'interrupted': StreamInterruptedEvent,
+}
+
+
+def event_to_dict(event):
+    """
+    :return: dict that can be serialized as JSON and read with event_from_dict
+    """
+    event_type = next(name for name, cls in _EVENT_TYPES.items()
+                      if isinstance(event, cls))
+
+    return {'type': event_type, **dataclasses.asdict(event)}
+
+
+def event_from_dict(event_dict):
+    """
+    :param event_dict: dict created with event_to_dict
+    :return: TradeEvent, KlineEvent or StreamInterruptedEvent
+    """
+    event_dict = dict(event_dict)
+    event_type = event_dict.pop('type')
+
+    return _EVENT_TYPES[event_type](**event_dict)
+
+
+class LatestPriceBook:
+    """
+    Latest price of each streamed market, and the highest and lowest prices of
+    each minute, so that price ranges can be computed without requesting candles
+    """
+    def __init__(self, max_age_seconds=config.STREAM_PRICE_MAX_AGE_SECONDS,
+                 max_minutes=config.STREAM_PRICE_RANGE_MINUTES, clock=None):
+        """
+        :param max_age_seconds: time since the last event of a market after which
+        its price is no longer served
+        :param max_minutes: number of minutes whose high and low are kept per market
+        :param clock: function returning the current time in milliseconds. If
+        None, local time is used
+        """
+        self._max_age_ms = max_age_seconds * 1000
+        self._max_minutes = max_minutes
+        self._clock = clock if clock is not None else lambda: int(time.time() * 1000)
+        self._lock = threading.Lock()
+        # (symbol, vs_currency) -> (price, exchange timestamp, local reception time)
+        self._last_prices = {}
+        # (symbol, vs_currency) -> OrderedDict minute open time -> [high, low]
+        self._minutes = {}
+        # (symbol, vs_currency) -> exchange timestamp since which no event was lost
+        self._tracking_since = {}
+
+    def on_event(self, event):
+        """
+        Subscriber of MarketDataHub
+        """
+        market = (event.symbol, event.vs_currency)
+
+        with self._lock:
+            if isinstance(event, StreamInterruptedEvent):
+                self._last_prices.pop(market, None)
+                self._minutes.pop(market, None)
+                self._tracking_since.pop(market, None)
+            elif isinstance(event, TradeEvent):
+                self._update(market, event.timestamp, event.price, event.price,
+                             event.price)
+            elif isinstance(event, KlineEvent):
+                if event.timeframe == '1m':
+                    self._update(market, event.timestamp, event.close, event.high,
+                                 event.low)
+                else:
+                    # Klines of other timeframes only provide the last price
+                    self._update(market, event.timestamp, event.close, None, None)
+
+    def _update(self, market, timestamp, price, high, low):
+        last_price = self._last_prices.get(market)
+        if last_price is None or timestamp >= last_price[1]:
+            self._last_prices[market] = (price, timestamp, self._clock())
+
+        if high is None:
+            return
+
+        self._tracking_since.setdefault(market, timestamp)
+        minutes = self._minutes.setdefault(market, OrderedDict())
+        minute = cc.candle_open_time('1m', timestamp)
+
+        if minute in minutes:
+            minutes[minute][0] = max(minutes[minute][0], high)
+            minutes[minute][1] = min(minutes[minute][1], low)
+        else:
+            minutes[minute] = [high, low]
+            while len(minutes) > self._max_minutes:
+                minutes.popitem(last=False)
+
+    def price(self, symbol, vs_currency):
+        """
+        :return: latest streamed price of the market, or None if it is not
+        available or too old
+        """
+        with self._lock:
+            last_price = self._last_prices.get((symbol, vs_currency))
+
+        if last_price is None or self._clock() - last_price[2] > self._max_age_ms:
+            return None
+
+        return last_price[0]
+
+    def prices(self, markets):
+        """
+        :param markets: iterable of (symbol, vs_currency) tuples
+        :return: dict (symbol, vs_currency) -> price, only with the available ones
+        """
+        prices = {market: self.price(*market) for market in markets}
+
+        return {market: price for market, price in prices.items() if price is not None}
+
+    def price_range(self, symbol, vs_currency, since):
+        """
+        :param since: time in milliseconds
+        :return: (high, low, timestamp of the last event) since the given time, or
+        None if the stream does not cover the whole interval
+        """
+        market = (symbol, vs_currency)
+
+        if self.price(symbol, vs_currency) is None:
+            return None
+
+        with self._lock:
+            tracking_since = self._tracking_since.get(market)
+            minutes = self._minutes.get(market)
+            if tracking_since is None or tracking_since > since or not minutes or \
+                    next(iter(minutes)) > cc.candle_open_time('1m', since):
+                return None
+
+            ranges = [minute_range for minute, minute_range in minutes.items()
+                      if minute >= cc.candle_open_time('1m', since)]
+            last_timestamp = self._last_prices[market][1]
+
+        if not ranges:
+            return None
+
+        return (max(high for high, _ in ranges), min(low for _, low in ranges),
+                last_timestamp)
+
+
+class MarketDataHub:
+    """
+    Publishes market events to its subscribers. Events are delivered in the thread
+    of the feed that publishes them, so subscribers must be fast and thread safe.
+    The latest prices are always kept in price_book.
+    """
+    def __init__(self, price_book: LatestPriceBook = None):
+        self.price_book = price_book if price_book is not None else LatestPriceBook()
+        self._lock = threading.Lock()
+        # (callback, event type or None for every event)
+        self._subscribers = []
+        self.subscribe(self.price_book.on_event)
+
+    def subscribe(self, callback, event_type=None):
+        """
+        :param callback: function receiving each event
+        :param event_type: TradeEvent, KlineEvent or StreamInterruptedEvent. If
+        None, every event is received
+        :return: callback, so that it can be used to unsubscribe
+        """
+        with self._lock:
+            self._subscribers = self._subscribers + [(callback, event_type)]
+
+        return callback
+
+    def unsubscribe(self, callback):
+        with self._lock:
+            self._subscribers = [(c, t) for c, t in self._subscribers
+                                 if c != callback]
+
+    def publish(self, event):
+        """
+        Delivers the event to every subscriber. Errors in a subscriber are logged,
+        so that they do not stop the feed
+        """
+        for callback, event_type in self._subscribers:
+            if event_type is not None and not isinstance(event, event_type):
+                continue
+
+            try:
+                callback(event)
+            except Exception:
+                cu.log_traceback()
+
+
+class MarketFeed(ABC):
+    """
+    Source of market events published in a MarketDataHub
+    """
+    @abstractmethod
+    def start(self, hub: MarketDataHub):
+        """
+        Starts publishing events in a background thread
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def stop(self):
+        """
+        Stops publishing events and waits for the background thread to finish
+        """
+        raise NotImplementedError
+
+
+class ExchangeStreamFeed(MarketFeed):
+    """
+    Streams trades and klines from the websockets of a ccxt.pro exchange
+    """
+    def __init__(self, exchange_api: ccxt_pro.Exchange, markets,
+                 kline_timeframes=(),
+                 reconnect_delay_seconds=config.STREAM_RECONNECT_DELAY_SECONDS):
+        """
+        :param exchange_api: ccxt.pro exchange. It is closed when the feed stops
+        :param markets: list of (symbol, vs_currency) tuples to stream
+        :param kline_timeframes: timeframes whose klines are streamed
+        :param reconnect_delay_seconds: time to wait before watching again a
+        stream that failed
+        """
+        if not isinstance(exchange_api, ccxt_pro.Exchange):
+            raise TypeError("Error exchange_api should be of type ccxt.pro.Exchange")
+
+        self._exchange_api = exchange_api
+        # Only the updates since the previous call are returned by watch methods
+        self._exchange_api.options['newUpdates'] = True
+        self._markets = list(dict.fromkeys(markets))
+        self._kline_timeframes = list(kline_timeframes)
+        self._reconnect_delay_seconds = reconnect_delay_seconds
+        self._hub = None
+        self._thread = None
+        self._loop = None
+        self._stop_event = None
+
+    def start(self, hub: MarketDataHub):
+        """
+        See description in parent class
+        """
+        self._hub = hub
+        self._loop = asyncio.new_event_loop()
+        self._stop_event = asyncio.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        See description in parent class
+        """
+        if self._thread is None:
+            return
+
+        self._loop.call_soon_threadsafe(self._stop_event.set)
+        self._thread.join()
+        self._thread = None
+
+    def _run(self):
+        try:
+            self._loop.run_until_complete(self._watch_all())
+        finally:
+            self._loop.run_until_complete(self._exchange_api.close())
+            self._loop.close()
+
+    async def _watch_all(self):
+        tasks = [asyncio.create_task(self._watch_trades(symbol, vs_currency))
+                 for symbol, vs_currency in self._markets]
+        tasks += [asyncio.create_task(self._watch_klines(symbol, vs_currency, timeframe))
+                  for symbol, vs_currency in self._markets
+                  for timeframe in self._kline_timeframes]
+
+        await self._stop_event.wait()
+
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _watch_trades(self, symbol, vs_currency):
+        market_symbol = f"{symbol}/{vs_currency}".upper()
+
+        while True:
+            try:
+                trades = await self._exchange_api.watch_trades(market_symbol)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                await self._on_stream_error(symbol, vs_currency)
+                continue
+
+            for trade in trades:
+                self._hub.publish(TradeEvent(symbol=symbol, vs_currency=vs_currency,
+                                             timestamp=trade['timestamp'],
+                                             price=trade['price'],
+                                             amount=trade['amount']))
+
+    async def _watch_klines(self, symbol, vs_currency, timeframe):
+        market_symbol = f"{symbol}/{vs_currency}".upper()
+        # Last kline received. It is closed once a newer one is received
+        last_kline = None
+
+        while True:
+            try:
+                klines = await self._exchange_api.watch_ohlcv(market_symbol, timeframe)
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                last_kline = None
+                await self._on_stream_error(symbol, vs_currency)
+                continue
+
+            for kline in klines:
+                if last_kline is not None and kline[0] > last_kline[0]:
+                    self._hub.publish(self._kline_event(symbol, vs_currency,
+                                                        timeframe, last_kline,
+                                                        is_closed=True))
+                last_kline = kline
+                self._hub.publish(self._kline_event(symbol, vs_currency, timeframe,
+                                                    kline, is_closed=False))
+
+    async def _on_stream_error(self, symbol, vs_currency):
+        cu.log_traceback()
+        self._hub.publish(StreamInterruptedEvent(symbol=symbol,
+                                                 vs_currency=vs_currency,
+                                                 timestamp=int(time.time() * 1000)))
+        await asyncio.sleep(self._reconnect_delay_seconds)
+
+    @staticmethod
+    def _kline_event(symbol, vs_currency, timeframe, kline, is_closed):
+        timestamp, open_, high, low, close, volume = kline[:6]
+
+        return KlineEvent(symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+                          timestamp=timestamp, open=open_, high=high, low=low,
+                          close=close, volume=volume, is_closed=is_closed)
+
+
+class ReplayFeed(MarketFeed):
+    """
+    Replays the events stored in a JSON lines file (see MarketEventRecorder), so
+    that streaming can be used offline
+    """
+    def __init__(self, file_path, speed=None):
+        """
+        :param file_path: path of the JSON lines file with one event per line
+        :param speed: 1 replays events with the time between them given by their
+        timestamps, 2 twice as fast, etc. If None, as fast as possible
+        """
+        self._file_path = file_path
+        self._speed = speed
+        self._thread = None
+        self._stop_event = threading.Event()
+
+    def events(self):
+        """
+        :return: generator of the events in the file
+        """
+        with open(self._file_path) as f:
+            for line in f:
+                if line.strip():
+                    yield event_from_dict(json.loads(line))
+
+    def replay(self, hub: MarketDataHub):
+        """
+        Publishes every event in the calling thread
+        """
+        previous_timestamp = None
+
+        for event in self.events():
+            if self._stop_event.is_set():
+                return
+
+            if self._speed is not None and previous_timestamp is not None:
+                delay = (event.timestamp - previous_timestamp) / 1000 / self._speed
+                if delay > 0:
+                    self._stop_event.wait(delay)
+            previous_timestamp = event.timestamp
+
+            hub.publish(event)
+
+    def start(self, hub: MarketDataHub):
+        """
+        See description in parent class
+        """
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self.replay, args=(hub,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        See description in parent class
+        """
+        if self._thread is None:
+            return
+
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+
+
+class MarketEventRecorder:
+    """
+    Subscriber that appends the received events to a JSON lines file, which can
+    be replayed later with ReplayFeed
+    """
+    def __init__(self, file_path):
+        self._file_path = file_path
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            with open(self._file_path, 'a') as f:
+                f.write(json.dumps(event_to_dict(event)) + '\n')
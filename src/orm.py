@@ -1,5 +1,6 @@
 from sqlalchemy import create_engine, Table, Column, Integer, Float, String, Boolean
 from sqlalchemy.orm import registry
+from sqlalchemy.pool import QueuePool
 
 import filesystemutils as fs
 import model
@@ -9,8 +10,18 @@ import model
 _home_dir = fs.home_directory(True)
 _real_db_path = f"{_home_dir}/trading.db"
 
+# Connection pool of the real database. The bot uses one session per scan tick
+POOL_SIZE = 5  # Connections kept opened
+POOL_MAX_OVERFLOW = 5  # Extra connections allowed under load
+POOL_TIMEOUT_SECONDS = 30  # Time to wait for a free connection before raising
+POOL_RECYCLE_SECONDS = 60 * 60  # Connections older than this are replaced
+
 #                      "kind_of_db+API://(path)"
-engine = create_engine(f"sqlite+pysqlite:///{_real_db_path}", future=True)
+engine = create_engine(f"sqlite+pysqlite:///{_real_db_path}", future=True,
+                       poolclass=QueuePool, pool_size=POOL_SIZE,
+                       max_overflow=POOL_MAX_OVERFLOW,
+                       pool_timeout=POOL_TIMEOUT_SECONDS,
+                       pool_recycle=POOL_RECYCLE_SECONDS, pool_pre_ping=True)
 test_engine = create_engine(f"sqlite+pysqlite:///:memory:", future=True)
 
 
@@ -0,0 +1,511 @@
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import math
+import time
+
+import ccxt
+import numpy as np
+
+import candleclock as cc
+import exchangehandler as ex_han
+from candleframe import CandleFrame
+
+
+PAPER_FEE_FACTOR = .001  # Taker and maker fee factor of the paper exchange
+PAPER_MIN_VS_CURRENCY = 5.  # Minimum notional of the markets, as most Binance spot markets
+PAPER_AMOUNT_DECIMALS = 5  # Decimals of the amounts of the markets
+SYNTHETIC_BLOCK_CANDLES = 1024  # Synthetic candles generated at once per market
+
+
+class SimulatedClock:
+    """
+    Time moved forward by its owner instead of waiting
+    """
+    def __init__(self, now_ms=0):
+        self.now_ms = now_ms
+
+    def __call__(self):
+        """
+        :return: current simulated time in milliseconds
+        """
+        return self.now_ms
+
+    def datetime(self):
+        """
+        :return: current simulated time as naive UTC datetime, like the candles
+        """
+        return datetime.fromtimestamp(self.now_ms / 1000, tz=timezone.utc).replace(tzinfo=None)
+
+
+def _local_clock():
+    return int(time.time() * 1000)
+
+
+def aggregate_candles(frame: CandleFrame, timeframe):
+    """
+    :param frame: candles of a timeframe that divides the given one
+    :param timeframe: timeframe of the aggregated candles
+    :return: CandleFrame with the candles of timeframe, and index in frame of the
+    first candle of each one of them
+    """
+    if len(frame) == 0:
+        return frame, np.zeros(0, dtype=np.int64)
+
+    open_time = cc.candle_open_time(timeframe, frame.timestamp)
+    starts = np.flatnonzero(np.diff(open_time, prepend=open_time[0] - 1))
+    ends = np.append(starts[1:], len(frame)) - 1
+
+    return CandleFrame.from_ohlcv(np.column_stack([
+        open_time[starts], frame.open[starts],
+        np.maximum.reduceat(frame.high, starts), np.minimum.reduceat(frame.low, starts),
+        frame.close[ends], np.add.reduceat(frame.volume, starts),
+    ]), dtype=frame.dtype), starts
+
+
+@dataclass(slots=True, kw_only=True)
+class MarketRules:
+    min_vs_currency: float = PAPER_MIN_VS_CURRENCY  # Minimum notional of an order
+    max_vs_currency: float = ex_han.MAX_VS_CURRENCY_WHEN_NONE  # Maximum notional of an order
+    amount_decimals: int = PAPER_AMOUNT_DECIMALS  # Decimals of the amounts
+    min_qty: float = None  # Minimum amount. If None, the unit of the last decimal
+    max_qty: float = math.inf  # Maximum amount
+
+    def __post_init__(self):
+        if self.min_qty is None:
+            self.min_qty = 10 ** -self.amount_decimals
+
+    def market_info(self):
+        """
+        :return: dict with the format of ExchangeHandler.fetch_market
+        """
+        return {
+            'min_price': self.min_vs_currency,
+            'max_price': math.inf,
+            'min_qty': self.min_qty,
+            'max_qty': self.max_qty,
+            'order_types': ['MARKET'],
+            'oco_allowed': False,
+            'min_vs_currency': self.min_vs_currency,  # Minimum quantity of vs_currency
+            'max_vs_currency': self.max_vs_currency,  # Max quantity of vs_currency
+        }
+
+    def amount_to_precision(self, amount):
+        """
+        :return: amount truncated to amount_decimals, as the exchange does
+        """
+        scale = 10 ** self.amount_decimals
+        # Rounded first so that representation errors do not remove a unit
+        return math.floor(round(amount * scale, 6)) / scale
+
+    def accepts(self, amount, cost):
+        """
+        :return: True if an order of the given amount and cost (in vs_currency)
+        is within the limits
+        """
+        return self.min_qty <= amount <= self.max_qty and \
+            self.min_vs_currency <= cost <= self.max_vs_currency
+
+
+class PriceFeed(ABC):
+    """
+    Prices against which a PaperExchangeHandler fills orders
+    """
+    @property
+    @abstractmethod
+    def markets(self):
+        """
+        :return: list of (symbol, vs_currency) of the feed
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def now_ms(self):
+        """
+        :return: current time of the feed in milliseconds
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def candles(self, market, timeframe, num_candles, since=None):
+        """
+        :param market: (symbol, vs_currency)
+        :param timeframe: timeframe of the candles
+        :param num_candles: maximum number of candles
+        :param since: if given, open time in milliseconds from which candles are
+        returned. Otherwise, the last ones are returned
+        :return: CandleFrame whose last candle is the current (unfinished) one
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def current_price(self, market):
+        """
+        :return: current price of the market, None if it has no price yet
+        """
+        raise NotImplementedError
+
+
+class RecordedPriceFeed(PriceFeed):
+    """
+    Serves recorded candles up to the time of a clock. Candles of larger
+    timeframes are aggregated from the recorded ones, so the unfinished candle
+    only contains the prices known at the current time. The current price is the
+    close of the last recorded candle.
+    """
+    def __init__(self, candles, timeframe, clock=None):
+        """
+        :param candles: dict (symbol, vs_currency) -> recorded candles of timeframe,
+        as CandleFrame or with the format of an ExchangeHandler, oldest first
+        :param timeframe: timeframe of the recorded candles
+        :param clock: function returning the current time in milliseconds, e.g. a
+        SimulatedClock. If None, local time is used
+        """
+        self._candles = {market: df if isinstance(df, CandleFrame) else CandleFrame.from_df(df)
+                         for market, df in candles.items()}
+        self._timeframe = timeframe
+        self._clock = clock if clock is not None else _local_clock
+        # (market, timeframe) -> recorded candles used, aggregated CandleFrame and
+        # index of their first recorded candles
+        self._aggregated = {}
+
+    @property
+    def markets(self):
+        return list(self._candles)
+
+    @property
+    def timeframe(self):
+        return self._timeframe
+
+    def now_ms(self):
+        return self._clock()
+
+    def recorded(self, market):
+        """
+        :return: CandleFrame with every recorded candle of the market
+        """
+        return self._candles[market]
+
+    def aggregated(self, market, timeframe):
+        """
+        :return: CandleFrame with every recorded candle of the market aggregated to
+        timeframe, and index of the first recorded candle of each one of them
+        """
+        recorded = self.recorded(market)
+        key = (market, timeframe)
+        if key not in self._aggregated or self._aggregated[key][0] != len(recorded):
+            timeframe_ms = cc.timeframe_to_milliseconds(timeframe)
+            recorded_ms = cc.timeframe_to_milliseconds(self._timeframe)
+            if timeframe_ms % recorded_ms != 0:
+                raise ValueError(f"Candles of {timeframe} can not be built from "
+                                 f"candles of {self._timeframe}")
+
+            if timeframe == self._timeframe:
+                self._aggregated[key] = len(recorded), recorded, np.arange(len(recorded))
+            else:
+                self._aggregated[key] = (len(recorded), *aggregate_candles(recorded, timeframe))
+
+        return self._aggregated[key][1:]
+
+    def _recorded_until_now(self, market):
+        """
+        :return: number of recorded candles opened until the current time
+        """
+        return int(np.searchsorted(self.recorded(market).timestamp, self.now_ms(), side='right'))
+
+    def candles(self, market, timeframe, num_candles, since=None):
+        available = self._recorded_until_now(market)
+        recorded = self.recorded(market)
+        if available == 0:
+            return recorded[:0]
+
+        candles, starts = self.aggregated(market, timeframe)
+        # Candles until the one containing the last recorded candle available
+        num_available = int(np.searchsorted(candles.timestamp,
+                                            recorded.timestamp[available - 1], side='right'))
+
+        if since is None:
+            first = max(num_available - num_candles, 0)
+            last = num_available
+        else:
+            first = int(np.searchsorted(candles.timestamp, since))
+            last = min(first + num_candles, num_available)
+
+        if last < num_available or first == last or timeframe == self._timeframe:
+            return candles[first:last]
+
+        unfinished = aggregate_candles(recorded[starts[last - 1]:available], timeframe)[0]
+        return CandleFrame.concat([candles[first:last - 1], unfinished])
+
+    def current_price(self, market):
+        available = self._recorded_until_now(market)
+
+        return float(self.recorded(market).close[available - 1]) if available else None
+
+
+class SyntheticPriceFeed(RecordedPriceFeed):
+    """
+    Seeded random walk candles of every market, generated as time goes by from
+    start_ms. The same seed always gives the same prices, whatever the times at
+    which they are requested.
+    """
+    def __init__(self, markets, timeframe='1m', clock=None, seed=0, initial_price=100.,
+                 volatility=.002, start_ms=None):
+        """
+        :param markets: list of (symbol, vs_currency)
+        :param timeframe: timeframe of the generated candles
+        :param clock: function returning the current time in milliseconds. If
+        None, local time is used
+        :param seed: seed of the random walks
+        :param initial_price: open price of the first candle of every market
+        :param volatility: standard deviation of the logarithmic return per candle
+        :param start_ms: open time of the first candle. If None, the candle of the
+        current time
+        """
+        super().__init__({}, timeframe=timeframe, clock=clock)
+        self._seed = seed
+        self._initial_price = initial_price
+        self._volatility = volatility
+        self._start_ms = cc.candle_open_time(timeframe, start_ms if start_ms is not None
+                                             else self.now_ms())
+        empty = CandleFrame.from_ohlcv([])
+        self._candles = {market: empty for market in markets}
+        self._market_indexes = {market: i for i, market in enumerate(markets)}
+
+    def recorded(self, market):
+        candles = self._candles[market]
+        timeframe_ms = cc.timeframe_to_milliseconds(self._timeframe)
+        needed = (self.now_ms() - self._start_ms) // timeframe_ms + 1
+
+        if needed > len(candles):
+            blocks = [candles]
+            while len(candles) + sum(len(block) for block in blocks[1:]) < needed:
+                blocks.append(self._block(market, blocks[-1], len(blocks) - 1 +
+                                          len(candles) // SYNTHETIC_BLOCK_CANDLES))
+            candles = self._candles[market] = CandleFrame.concat(blocks)
+
+        return candles
+
+    def _block(self, market, previous, block_index):
+        """
+        :return: CandleFrame with the next SYNTHETIC_BLOCK_CANDLES candles after previous
+        """
+        rng = np.random.default_rng([self._seed, self._market_indexes[market], block_index])
+        timeframe_ms = cc.timeframe_to_milliseconds(self._timeframe)
+        open_price = previous.close[-1] if len(previous) else self._initial_price
+        close = open_price * np.exp(np.cumsum(
+            rng.normal(scale=self._volatility, size=SYNTHETIC_BLOCK_CANDLES)))
+        open_ = np.concatenate([[open_price], close[:-1]])
+        wicks = np.abs(rng.normal(scale=self._volatility / 2,
+                                  size=(2, SYNTHETIC_BLOCK_CANDLES)))
+
+        return CandleFrame.from_ohlcv(np.column_stack([
+            self._start_ms + (block_index * SYNTHETIC_BLOCK_CANDLES +
+                              np.arange(SYNTHETIC_BLOCK_CANDLES)) * timeframe_ms,
+            open_, np.maximum(open_, close) * (1 + wicks[0]),
+            np.minimum(open_, close) * (1 - wicks[1]),
+            close, rng.random(SYNTHETIC_BLOCK_CANDLES) * 1000,
+        ]))
+
+
+class PaperExchangeHandler(ex_han.ExchangeHandler):
+    """
+    Local exchange without network. It keeps the balances and fills market orders
+    at the current price of a PriceFeed, applying fees, amount precision and
+    notional limits. As in Binance spot markets, the fee of a buy is paid in the
+    bought asset and the fee of a sell in vs_currency.
+    """
+    def __init__(self, price_feed: PriceFeed, balances, fee_factor=PAPER_FEE_FACTOR,
+                 market_rules=None):
+        """
+        :param price_feed: PriceFeed of the prices and candles
+        :param balances: dict symbol -> initial free amount
+        :param fee_factor: taker and maker fee factor
+        :param market_rules: MarketRules of every market, or dict (symbol,
+        vs_currency) -> MarketRules. Markets without rules use the default ones
+        """
+        super().__init__(exchange_api=None)
+        self._price_feed = price_feed
+        self._balances = dict(balances)
+        self._fee_factor = fee_factor
+        if isinstance(market_rules, MarketRules):
+            self._default_rules, self._market_rules = market_rules, {}
+        else:
+            self._default_rules, self._market_rules = MarketRules(), dict(market_rules or {})
+        self._next_order_id = 1
+
+    @property
+    def price_feed(self):
+        return self._price_feed
+
+    @property
+    def balances(self):
+        return dict(self._balances)
+
+    def _rules(self, symbol, vs_currency):
+        return self._market_rules.get((symbol, vs_currency), self._default_rules)
+
+    def get_candle_frame_last_one_not_finished(self, symbol, vs_currency, timeframe,
+                                               num_candles, since=None,
+                                               dtype=np.float64):
+        """
+        See description in parent class
+        """
+        return self._price_feed.candles((symbol, vs_currency), timeframe, num_candles,
+                                        since=since).astype(dtype)
+
+    def get_candles_last_one_not_finished(self, symbol, vs_currency, timeframe,
+                                         num_candles, since=None):
+        """
+        See description in parent class
+        """
+        return self.get_candle_frame_last_one_not_finished(
+            symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+            num_candles=num_candles, since=since).to_df()
+
+    def get_candles_for_strategy(self, symbol, vs_currency, timeframe, num_candles,
+                                 since=None):
+        """
+        See description in parent class
+        """
+        return self.get_candle_frame_last_one_not_finished(
+            symbol=symbol, vs_currency=vs_currency, timeframe=timeframe,
+            num_candles=num_candles, since=since).closed().to_df()
+
+    def get_current_price(self, symbol, vs_currency):
+        """
+        See description in parent class. None if the feed has no price yet
+        """
+        return self._price_feed.current_price((symbol, vs_currency))
+
+    def get_server_time(self):
+        """
+        See description in parent class
+        """
+        return self._price_feed.now_ms()
+
+    def _amount_to_precision(self, symbol, vs_currency, amount):
+        """
+        Reduces the decimals in amount to those of the market
+        """
+        return self._rules(symbol, vs_currency).amount_to_precision(amount)
+
+    def _order(self, price, amount, cost, fee_in_asset):
+        order_id = str(self._next_order_id)
+        self._next_order_id += 1
+
+        return {
+            "exchange_id": order_id,
+            "timestamp": self._price_feed.now_ms(),
+            "price": price,
+            "amount": amount,
+            "cost": cost,
+            "fee_in_asset": fee_in_asset,
+        }
+
+    def buy_market_order(self, symbol, vs_currency, amount):
+        """
+        See description in parent class. None if the order is not within the
+        limits of the market or there are not enough funds
+        """
+        amount = self._amount_to_precision(symbol=symbol, vs_currency=vs_currency,
+                                           amount=amount)
+        price = self.get_current_price(symbol=symbol, vs_currency=vs_currency)
+        if price is None:
+            return None
+
+        cost = amount * price
+        if not self._rules(symbol, vs_currency).accepts(amount, cost) or \
+                cost > self.get_free_balance(vs_currency):
+            return None
+
+        fee_in_asset = amount * self._fee_factor
+        self._balances[vs_currency] -= cost
+        self._balances[symbol] = self.get_free_balance(symbol) + amount - fee_in_asset
+
+        return self._order(price, amount, cost, fee_in_asset)
+
+    def _sell_market_order(self, symbol, vs_currency, amount):
+        """
+        See description in parent class. None if the order is not within the
+        limits of the market. Raises ccxt.InsufficientFunds if there is not enough
+        symbol, as the exchange does
+        """
+        amount = self._amount_to_precision(symbol=symbol, vs_currency=vs_currency,
+                                           amount=amount)
+        if amount > self.get_free_balance(symbol):
+            raise ccxt.InsufficientFunds(f"Not enough {symbol} to sell {amount}")
+
+        price = self.get_current_price(symbol=symbol, vs_currency=vs_currency)
+        if price is None:
+            return None
+
+        cost = amount * price
+        if not self._rules(symbol, vs_currency).accepts(amount, cost):
+            return None
+
+        fee = cost * self._fee_factor
+        self._balances[symbol] -= amount
+        self._balances[vs_currency] = self.get_free_balance(vs_currency) + cost - fee
+
+        return self._order(price, amount, cost, fee)
+
+    def fetch_market(self, symbol: str, vs_currency):
+        """
+        See description in parent class
+        """
+        return self._rules(symbol, vs_currency).market_info()
+
+    def get_fee_factor(self, symbol, vs_currency, type='spot'):
+        """
+        See description in parent class
+        """
+        return {'maker': self._fee_factor, 'taker': self._fee_factor}
+
+    def _market_from_symbol_and_vs_currency(self, symbol, vs_currency):
+        """
+        See description in parent class
+        """
+        return f"{symbol}/{vs_currency}".upper()
+
+    def get_free_balance(self, symbol):
+        """
+        See description in parent class
+        """
+        return self._balances.get(symbol, 0.)
+
+    def get_total_balances(self):
+        """
+        See description in parent class. No balance is locked in open orders
+        """
+        return {asset: amount for asset, amount in self._balances.items() if amount}
+
+    def has_market(self, symbol, vs_currency):
+        """
+        See description in parent class. Only the markets of the price feed exist
+        """
+        return (symbol, vs_currency) in self._price_feed.markets
+
+    def withdraw_fiat_to_bank_account(self, fiat_symbol, fiat_quantity, swift):
+        """
+        See description in parent class. The quantity is debited from the paper
+        balance at once. Raises ccxt.InsufficientFunds if there is not enough
+        fiat_symbol, as the exchange does
+        :return: withdrawal with the fields of a ccxt transaction
+        """
+        if fiat_quantity > self.get_free_balance(fiat_symbol):
+            raise ccxt.InsufficientFunds(f"Not enough {fiat_symbol} to withdraw {fiat_quantity}")
+
+        self._balances[fiat_symbol] -= fiat_quantity
+        withdrawal_id = str(self._next_order_id)
+        self._next_order_id += 1
+
+        return {
+            "id": withdrawal_id,
+            "timestamp": self._price_feed.now_ms(),
+            "type": "withdrawal",
+            "currency": fiat_symbol,
+            "amount": fiat_quantity,
+            "address": swift,
+            "status": "ok",
+        }
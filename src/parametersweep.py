@@ -0,0 +1,279 @@
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+import itertools
+from multiprocessing import shared_memory
+import os
+
+import numpy as np
+
+import backtester as bt
+from candleframe import CandleFrame, OHLCV_COLUMNS
+
+
+TASKS_PER_WORKER = 4  # Parameter chunks per worker. More chunks balance uneven runs better
+
+# Candles of the current worker process, attached by _attach_shared_candles
+_worker_candles = None
+
+
+@dataclass(slots=True, kw_only=True)
+class SweepResult:
+    parameters: dict  # Keyword arguments of the strategy
+    num_trades: int  # Closed trades
+    win_rate: float  # Per one of closed trades with positive result
+    expectancy: float  # Mean result after fees per closed trade, in vs_currency. NaN without trades
+    total_result: float  # Sum of the results after fees, in vs_currency
+    max_drawdown: float  # Largest fall of the cumulative result, in vs_currency
+    rank: int = None  # Position in the ranking, starting at 1
+
+
+def grid_parameters(grid):
+    """
+    :param grid: dict parameter name -> list of values
+    :return: list with every combination of values, as dicts parameter name -> value
+    """
+    names = list(grid)
+
+    return [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+
+
+def random_parameters(space, num_samples, seed=0):
+    """
+    :param space: dict parameter name -> list of values to choose from, or
+    (low, high) tuple to sample uniformly. Integers are sampled if both are int
+    :param num_samples: number of parameter sets
+    :param seed: the same seed always gives the same parameter sets
+    :return: list of dicts parameter name -> value
+    """
+    rng = np.random.default_rng(seed)
+    samples = [{} for _ in range(num_samples)]
+
+    for name, values in space.items():
+        if isinstance(values, tuple):
+            low, high = values
+            if isinstance(low, int) and isinstance(high, int):
+                sampled = rng.integers(low, high, endpoint=True, size=num_samples)
+            else:
+                sampled = rng.uniform(low, high, size=num_samples)
+        else:
+            sampled = [values[i] for i in rng.integers(len(values), size=num_samples)]
+
+        for sample, value in zip(samples, sampled):
+            sample[name] = value.item() if isinstance(value, np.generic) else value
+
+    return samples
+
+
+def max_drawdown(results):
+    """
+    :param results: results of the trades, in the order they were closed
+    :return: largest fall of the cumulative result from a previous maximum. The
+    result starts at 0
+    """
+    cumulative = np.concatenate([[0.], np.cumsum(results)])
+
+    return float(np.max(np.maximum.accumulate(cumulative) - cumulative))
+
+
+def sweep_result(parameters, trades, exit_times):
+    """
+    :param parameters: keyword arguments of the strategy
+    :param trades: trades returned by backtester.VectorizedBacktester.run
+    :param exit_times: array with the exit time of each trade, NaN if opened
+    :return: SweepResult
+    """
+    closed = trades['exit_index'].to_numpy() >= 0
+    results = trades['result'].to_numpy(dtype=float)[closed]
+    results = results[np.argsort(exit_times[closed], kind='stable')]
+    num_trades = len(results)
+
+    return SweepResult(parameters=parameters, num_trades=num_trades,
+                       win_rate=float(np.mean(results > 0)) if num_trades else 0.,
+                       expectancy=float(np.mean(results)) if num_trades else float('nan'),
+                       total_result=float(np.sum(results)),
+                       max_drawdown=max_drawdown(results))
+
+
+def rank_results(results):
+    """
+    Ranks by the sum of the positions by expectancy (highest first) and by max
+    drawdown (lowest first). Ties are broken by expectancy. Results without trades
+    are ranked last
+    :param results: list of SweepResult
+    :return: the same results sorted by rank, with rank set
+    """
+    with_trades = [result for result in results if result.num_trades]
+    without_trades = [result for result in results if not result.num_trades]
+
+    expectancy = np.array([result.expectancy for result in with_trades])
+    drawdown = np.array([result.max_drawdown for result in with_trades])
+    positions = np.argsort(np.argsort(-expectancy, kind='stable'), kind='stable') + \
+        np.argsort(np.argsort(drawdown, kind='stable'), kind='stable')
+    order = np.lexsort((-expectancy, positions))
+
+    ranked = [with_trades[i] for i in order] + without_trades
+    for rank, result in enumerate(ranked, start=1):
+        result.rank = rank
+
+    return ranked
+
+
+class SharedCandles:
+    """
+    Candles of several markets copied once into a single shared memory block, so
+    that worker processes read them without copying. It must be closed when the
+    workers finish:
+
+        with SharedCandles(dfs) as shared_candles:
+            ...
+    """
+    def __init__(self, dfs):
+        """
+        :param dfs: dict (symbol, vs_currency) -> candles with the format of an
+        ExchangeHandler or CandleFrame, oldest first
+        """
+        frames = {market: df if isinstance(df, CandleFrame) else CandleFrame.from_df(df)
+                  for market, df in dfs.items()}
+        num_candles = sum(len(frame) for frame in frames.values())
+        # (market, first candle, number of candles) of each market
+        self.layout = []
+        self._memory = shared_memory.SharedMemory(
+            create=True, size=max(_shared_size(num_candles), 1))
+
+        timestamp, values = _shared_arrays(self._memory, num_candles)
+        start = 0
+        for market, frame in frames.items():
+            timestamp[start:start + len(frame)] = frame.timestamp
+            values[:, start:start + len(frame)] = frame.ohlcv()[:, 1:].T
+            self.layout.append((market, start, len(frame)))
+            start += len(frame)
+
+    @property
+    def name(self):
+        return self._memory.name
+
+    def close(self):
+        self._memory.close()
+        self._memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+
+def _shared_size(num_candles):
+    return num_candles * np.dtype(np.int64).itemsize + \
+        len(OHLCV_COLUMNS) * num_candles * np.dtype(np.float64).itemsize
+
+
+def _shared_arrays(memory, num_candles):
+    """
+    :return: timestamp and values arrays of the candles in the shared memory
+    """
+    timestamp = np.ndarray((num_candles,), dtype=np.int64, buffer=memory.buf)
+    values = np.ndarray((len(OHLCV_COLUMNS), num_candles), dtype=np.float64,
+                        buffer=memory.buf, offset=timestamp.nbytes)
+
+    return timestamp, values
+
+
+def _attach_shared_candles(name, layout):
+    """
+    Initializer of the worker processes: makes the candles of SharedCandles
+    available to _run_parameters as DataFrame views of the shared memory
+    """
+    global _worker_candles
+
+    # Workers share the resource tracker of the parent process, which unlinks the block
+    memory = shared_memory.SharedMemory(name=name)
+    num_candles = sum(length for _, _, length in layout)
+    timestamp, values = _shared_arrays(memory, num_candles)
+
+    dfs = {market: CandleFrame(timestamp=timestamp[start:start + length],
+                               values=values[:, start:start + length]).to_df(copy=False)
+           for market, start, length in layout}
+    # The memory object is kept so that the block stays mapped
+    _worker_candles = memory, dfs
+
+
+def _run_parameters(strategy_class, backtester_arguments, parameters, dfs=None):
+    """
+    Backtests the strategy with the given parameters on the candles of the worker
+    :return: SweepResult
+    """
+    if dfs is None:
+        dfs = _worker_candles[1]
+
+    backtester = bt.VectorizedBacktester(strategy_class(**parameters), **backtester_arguments)
+    trades = backtester.run(dfs)
+
+    exit_times = np.full(len(trades), np.nan)
+    exit_indexes = trades['exit_index'].to_numpy()
+    for market, indexes in trades.groupby(['symbol', 'vs_currency_symbol']).indices.items():
+        closed = indexes[exit_indexes[indexes] >= 0]
+        timestamps = dfs[market]['datetime'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+        exit_times[closed] = timestamps[exit_indexes[closed]]
+
+    return sweep_result(parameters, trades, exit_times)
+
+
+def _run_parameters_chunk(strategy_class, backtester_arguments, parameter_sets):
+    return [_run_parameters(strategy_class, backtester_arguments, parameters)
+            for parameters in parameter_sets]
+
+
+class ParameterSweep:
+    """
+    Backtests a strategy with many sets of parameters in a pool of processes. The
+    candles are placed once in shared memory, so every worker reads the same
+    copy, and only parameters and results are sent between processes.
+    """
+    def __init__(self, strategy_class, dfs, timeframe, fee_factor, workers=None,
+                 **backtester_arguments):
+        """
+        :param strategy_class: Strategy class implementing backtest_signals. Its
+        constructor receives each set of parameters
+        :param dfs: dict (symbol, vs_currency) -> candles with the format of an
+        ExchangeHandler, oldest first
+        :param timeframe: timeframe of the candles
+        :param fee_factor: taker fee factor of every trade
+        :param workers: number of processes. If None, one per CPU. With 1, the
+        sweep runs in the current process
+        :param backtester_arguments: other arguments of backtester.VectorizedBacktester
+        """
+        self._strategy_class = strategy_class
+        self._dfs = dfs
+        self._workers = workers if workers is not None else os.cpu_count()
+        self._backtester_arguments = {'timeframe': timeframe, 'fee_factor': fee_factor,
+                                      **backtester_arguments}
+
+    def run(self, parameter_sets):
+        """
+        :param parameter_sets: list of dicts parameter name -> value, e.g. from
+        grid_parameters or random_parameters
+        :return: list of SweepResult, ranked with rank_results
+        """
+        parameter_sets = list(parameter_sets)
+
+        if self._workers == 1:
+            return rank_results([_run_parameters(self._strategy_class,
+                                                 self._backtester_arguments, parameters,
+                                                 dfs=self._dfs)
+                                 for parameters in parameter_sets])
+
+        chunk_size = max(-(-len(parameter_sets) // (self._workers * TASKS_PER_WORKER)), 1)
+        chunks = [parameter_sets[start:start + chunk_size]
+                  for start in range(0, len(parameter_sets), chunk_size)]
+
+        with SharedCandles(self._dfs) as shared_candles, \
+                ProcessPoolExecutor(max_workers=self._workers,
+                                    initializer=_attach_shared_candles,
+                                    initargs=(shared_candles.name,
+                                              shared_candles.layout)) as executor:
+            results = executor.map(_run_parameters_chunk,
+                                   itertools.repeat(self._strategy_class),
+                                   itertools.repeat(self._backtester_arguments), chunks)
+            return rank_results([result for chunk in results for result in chunk])
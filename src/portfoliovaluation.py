@@ -0,0 +1,145 @@
+from dataclasses import dataclass
+import threading
+import time
+
+import config
+import exchangehandler as ex_han
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class Valuation:
+    equity: float  # Value of every priced asset held, in vs_currency
+    values: dict  # asset -> value in vs_currency
+    unpriced: list  # Assets held without market against vs_currency or without price
+
+
+class PortfolioValuation:
+    """
+    Equity of the account in a vs_currency. Balances are fetched once and then
+    updated with the fills of the orders placed by the bot, so they are only
+    fetched again every balance_ttl_seconds to include deposits, withdrawals and
+    fees paid in other assets. Only the assets held are priced, and their prices
+    are reused for price_max_age_seconds.
+    """
+    def __init__(self, exchange_handler: ex_han.ExchangeHandler,
+                 vs_currency=config.VS_CURRENCY,
+                 balance_ttl_seconds=config.PORTFOLIO_BALANCE_TTL_SECONDS,
+                 price_max_age_seconds=config.PORTFOLIO_PRICE_MAX_AGE_SECONDS,
+                 clock=time.monotonic):
+        """
+        :param exchange_handler: ExchangeHandler of the account
+        :param vs_currency: currency in which the portfolio is valued
+        :param balance_ttl_seconds: time balances are only updated with fills
+        :param price_max_age_seconds: time the price of an asset is reused
+        :param clock: function returning the current time in seconds
+        """
+        self._exchange_handler = exchange_handler
+        self._vs_currency = vs_currency
+        self._balance_ttl_seconds = balance_ttl_seconds
+        self._price_max_age_seconds = price_max_age_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._balances = None
+        self._balances_fetched_at = None
+        self._prices = {}  # asset -> (price, fetch time)
+        self._markets = {}  # asset -> True if it has a market against vs_currency
+
+    def refresh(self):
+        """
+        Fetches the balances again on next use
+        """
+        with self._lock:
+            self._balances = None
+
+    def balances(self):
+        """
+        :return: dict asset -> total amount held
+        """
+        with self._lock:
+            return dict(self._current_balances())
+
+    def _balances_are_fresh(self):
+        return self._balances is not None and \
+            self._clock() - self._balances_fetched_at < self._balance_ttl_seconds
+
+    def _current_balances(self):
+        if not self._balances_are_fresh():
+            self._balances = self._exchange_handler.get_total_balances()
+            self._balances_fetched_at = self._clock()
+
+        return self._balances
+
+    def _add(self, asset, amount):
+        # Balances fetched after the fill already include it, so fills are only
+        # applied to the balances loaded before them. If they are not loaded or
+        # expired, the next fetch includes the fill
+        if not self._balances_are_fresh():
+            return
+        self._balances[asset] = self._balances.get(asset, 0.) + amount
+
+    def record_buy(self, symbol, vs_currency, order):
+        """
+        Updates the balances with a filled buy order, whose fee is paid in symbol
+        :param order: order returned by ExchangeHandler.buy_market_order
+        """
+        with self._lock:
+            self._add(symbol, order['amount'] - order['fee_in_asset'])
+            self._add(vs_currency, -order['cost'])
+            self._record_price(symbol, vs_currency, order)
+
+    def record_sell(self, symbol, vs_currency, order):
+        """
+        Updates the balances with a filled sell order, whose fee is paid in vs_currency
+        :param order: order returned by ExchangeHandler.sell_market_order_diminishing_amount
+        """
+        with self._lock:
+            self._add(symbol, -order['amount'])
+            self._add(vs_currency, order['cost'] - order['fee_in_asset'])
+            self._record_price(symbol, vs_currency, order)
+
+    def _record_price(self, symbol, vs_currency, order):
+        # The fill price is the latest price of the market
+        if vs_currency == self._vs_currency and order['price']:
+            self._prices[symbol] = (order['price'], self._clock())
+
+    def _has_market(self, asset):
+        if asset not in self._markets:
+            self._markets[asset] = self._exchange_handler.has_market(asset, self._vs_currency)
+
+        return self._markets[asset]
+
+    def valuation(self):
+        """
+        :return: Valuation of the assets held. Only the prices older than
+        price_max_age_seconds are requested, all of them at once. If a price is not
+        returned, the previous one is kept
+        """
+        with self._lock:
+            balances = self._current_balances()
+            held = [asset for asset, amount in balances.items()
+                    if amount > 0 and asset != self._vs_currency]
+            now = self._clock()
+            stale = [(asset, self._vs_currency) for asset in held
+                     if self._has_market(asset) and
+                     (asset not in self._prices or
+                      now - self._prices[asset][1] > self._price_max_age_seconds)]
+
+            if stale:
+                prices = self._exchange_handler.get_current_prices(stale)
+                for (asset, _), price in prices.items():
+                    if price is not None:
+                        self._prices[asset] = (price, now)
+
+            values = {asset: balances[asset] * self._prices[asset][0]
+                      for asset in held if asset in self._prices}
+            if balances.get(self._vs_currency):
+                values[self._vs_currency] = balances[self._vs_currency]
+
+            return Valuation(equity=sum(values.values()), values=values,
+                             unpriced=[asset for asset in held if asset not in values])
+
+    def equity(self):
+        """
+        :return: value of every priced asset held, in vs_currency
+        """
+        return self.valuation().equity
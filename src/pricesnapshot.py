@@ -0,0 +1,76 @@
+from dataclasses import dataclass
+import time
+
+import config
+import exchangehandler as ex_han
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class PriceSnapshot:
+    prices: dict  # (symbol, vs_currency) -> price (None if not available)
+    taken_at: float  # Unix time in seconds when prices were fetched
+
+    def price(self, symbol, vs_currency):
+        """
+        :return: price of the market, or None if it was not in the snapshot
+        """
+        return self.prices.get((symbol, vs_currency))
+
+    def age_seconds(self, now=None):
+        """
+        :param now: Unix time in seconds. If None, current time is used
+        :return: seconds since prices were fetched
+        """
+        if now is None:
+            now = time.time()
+
+        return now - self.taken_at
+
+    def covers(self, markets):
+        """
+        :param markets: iterable of (symbol, vs_currency) tuples
+        :return: True if every market was requested in this snapshot
+        """
+        return all(market in self.prices for market in markets)
+
+
+class PriceSnapshotService:
+    """
+    Provides the prices of several markets with a single bulk request per tick.
+    The same snapshot is reused until it is older than max_age_seconds.
+    """
+    def __init__(self, exchange_handler: ex_han.ExchangeHandler,
+                 max_age_seconds=config.PRICE_SNAPSHOT_MAX_AGE_SECONDS):
+        self._exchange_handler = exchange_handler
+        self._max_age_seconds = max_age_seconds
+        self._last_snapshot = None
+
+    def take_snapshot(self, markets):
+        """
+        Fetches the current prices of the given markets
+        :param markets: iterable of (symbol, vs_currency) tuples
+        :return: PriceSnapshot
+        """
+        markets = list(dict.fromkeys(markets))
+        prices = self._exchange_handler.get_current_prices(markets)
+        # Markets without price are kept to know they were requested
+        prices = {market: prices.get(market) for market in markets}
+        self._last_snapshot = PriceSnapshot(prices=prices, taken_at=time.time())
+
+        return self._last_snapshot
+
+    def snapshot(self, markets):
+        """
+        Returns the last snapshot if it is fresh enough and contains every market.
+        Otherwise, a new one is taken
+        :param markets: iterable of (symbol, vs_currency) tuples
+        :return: PriceSnapshot
+        """
+        markets = list(markets)
+        last_snapshot = self._last_snapshot
+
+        if last_snapshot is not None and last_snapshot.covers(markets) and \
+                last_snapshot.age_seconds() <= self._max_age_seconds:
+            return last_snapshot
+
+        return self.take_snapshot(markets)
@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+import logging
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+
+import candleclock as cc
+import commonutils as cu
+import exitevaluator as ex_ev
+import paperexchange as pe
+import portfoliovaluation as pv
+import pricesnapshot as ps
+import repository as rp
+import services
+import strategy as st
+
+
+REPLAY_STRATEGY_CANDLES = 200  # Candles given to the strategy in each scan, as in services
+
+# Globals of services replaced during a replay
+REPLAYED_SERVICES_GLOBALS = ['eh', 'candle_store', 'price_snapshots', 'exit_evaluator',
+                             'market_hub', '_ticks', 'now', 'externalnotifier',
+                             'portfolio']
+
+
+@contextmanager
+def replayed_services(exchange_handler: pe.PaperExchangeHandler, repository, clock,
+                      timeframe, notifications):
+    """
+    Makes services trade in the simulated exchange. Its globals are restored at
+    the end, so only one replay can run at a time
+    :param exchange_handler: PaperExchangeHandler of the replay
+    :param repository: repository where trades are stored
+    :param clock: SimulatedClock of the replay
+    :param timeframe: timeframe of the candles used to check exits
+    :param notifications: list where external notifications are appended
+    """
+    replaced = {name: getattr(services, name) for name in REPLAYED_SERVICES_GLOBALS}
+    logger = cu.logger
+    try:
+        services.eh = exchange_handler
+        services.candle_store = None
+        services.market_hub = None
+        services.price_snapshots = ps.PriceSnapshotService(exchange_handler=exchange_handler)
+        services.exit_evaluator = ex_ev.PositionExitEvaluator(exchange_handler=exchange_handler,
+                                                              timeframe=timeframe, clock=clock)
+        services._ticks = threading.local()
+        services._ticks.repository = repository
+        services.portfolio = pv.PortfolioValuation(exchange_handler=exchange_handler,
+                                                   clock=lambda: clock() / 1000)
+        services.now = clock.datetime
+        services.externalnotifier = SimpleNamespace(externally_notify=notifications.append)
+        # Replays must not fill the log of the bot
+        cu.logger = logging.getLogger('replay')
+        cu.logger.disabled = True
+        yield
+    finally:
+        for name, value in replaced.items():
+            setattr(services, name, value)
+        cu.logger = logger
+
+
+class ReplayBacktester:
+    """
+    Pushes recorded candles through the services of the bot: the markets are
+    scanned with compute_strategy_and_try_to_enter when a candle of the strategy
+    timeframe closes, and opened positions are managed and closed after every
+    recorded candle, as the main loop of run_bot does. Orders are filled by a
+    PaperExchangeHandler fed with the recorded candles, and trades are stored in
+    an InMemoryRepository.
+    Time is simulated, so nothing waits.
+
+    Each step happens at the close of a recorded candle, so the finer their
+    timeframe, the closer the replay is to the bot: strategies see the first
+    recorded candle of the new strategy candle, and orders are filled at the
+    close of the recorded candle in which exits are found.
+    """
+    def __init__(self, strategy: st.Strategy, candles, timeframe, strategy_timeframe,
+                 vs_currency_available, fee_factor=pe.PAPER_FEE_FACTOR,
+                 market_rules=None, num_candles=REPLAY_STRATEGY_CANDLES):
+        """
+        :param strategy: Strategy to replay
+        :param candles: dict (symbol, vs_currency) -> recorded candles of timeframe,
+        as CandleFrame or with the format of an ExchangeHandler, oldest first
+        :param timeframe: timeframe of the recorded candles
+        :param strategy_timeframe: timeframe of the strategy. Multiple of timeframe
+        :param vs_currency_available: initial free amount of each vs_currency
+        :param fee_factor: taker and maker fee factor
+        :param market_rules: paperexchange.MarketRules of every market, or dict
+        (symbol, vs_currency) -> MarketRules. If None, the default ones
+        :param num_candles: candles given to the strategy in each scan
+        """
+        self._strategy = strategy
+        self._timeframe = timeframe
+        self._strategy_timeframe = strategy_timeframe
+        self._num_candles = num_candles
+        self._markets = list(candles)
+        self.clock = pe.SimulatedClock()
+        self.price_feed = pe.RecordedPriceFeed(candles, timeframe=timeframe, clock=self.clock)
+        self.exchange_handler = pe.PaperExchangeHandler(
+            self.price_feed,
+            balances={vs_currency: vs_currency_available for _, vs_currency in candles},
+            fee_factor=fee_factor, market_rules=market_rules)
+        self.repository = rp.InMemoryRepository()
+        self.notifications = []
+
+    def run(self):
+        """
+        Replays every recorded candle
+        :return: list of model.Trade, in the order they were opened
+        """
+        timeframe_ms = cc.timeframe_to_milliseconds(self._timeframe)
+        recorded = {market: self.price_feed.recorded(market)
+                    for market in self._markets}
+        first_scans = {market: self._first_scan(market) for market in self._markets}
+        steps = np.unique(np.concatenate([candles.timestamp for candles in recorded.values()]))
+        scan_steps = cc.candle_open_time(self._strategy_timeframe, steps) == steps
+
+        with replayed_services(self.exchange_handler, self.repository, self.clock,
+                               timeframe=self._timeframe, notifications=self.notifications):
+            for open_time, is_scan_step in zip(steps.tolist(), scan_steps.tolist()):
+                # Last instant of the recorded candle, once its prices are known
+                self.clock.now_ms = open_time + timeframe_ms - 1
+                if is_scan_step:
+                    self._scan([market for market in self._markets
+                                if first_scans[market] <= open_time and
+                                self._is_recorded(recorded[market], open_time)])
+
+                services.manage_opened_positions()
+
+        return self.repository.get_trades()
+
+    def _first_scan(self, market):
+        """
+        :return: open time of the first recorded candle in which the strategy has
+        num_candles candles
+        """
+        candles, _ = self.price_feed.aggregated(market, self._strategy_timeframe)
+        if len(candles) < self._num_candles:
+            return np.iinfo(np.int64).max
+
+        return int(candles.timestamp[self._num_candles - 1])
+
+    @staticmethod
+    def _is_recorded(candles, open_time):
+        index = np.searchsorted(candles.timestamp, open_time)
+        return index < len(candles) and candles.timestamp[index] == open_time
+
+    def _scan(self, markets):
+        for symbol, vs_currency in services.markets_without_opened_positions(markets):
+            df = self.exchange_handler.get_candles_last_one_not_finished(
+                symbol=symbol, vs_currency=vs_currency,
+                timeframe=self._strategy_timeframe, num_candles=self._num_candles)
+            services.compute_strategy_and_try_to_enter(
+                symbol=symbol, vs_currency=vs_currency, strategy=self._strategy,
+                strategy_entry_timeframe=self._strategy_timeframe, is_real=True, df=df,
+                current_price=self.exchange_handler.get_current_price(symbol=symbol,
+                                                                      vs_currency=vs_currency))
+
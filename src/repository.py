@@ -1,6 +1,8 @@
 from abc import ABC, abstractmethod
+import dataclasses
 
 from sqlalchemy import and_, text
+from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import Session
 
 import commonconstants as cc
@@ -67,21 +69,171 @@ class AbstractRepository(ABC):
         raise NotImplementedError
 
 
+class OpenPositionIndex:
+    """
+    In-memory index of the opened trades keyed by (symbol, vs_currency_symbol).
+    It stores copies of the trades that are not bound to any session, so they
+    must only be read. Repositories that use it keep it consistent with the
+    database by updating it after each commit.
+    """
+    def __init__(self):
+        self._trades = {}
+        self._is_loaded = False
+
+    @property
+    def is_loaded(self):
+        return self._is_loaded
+
+    def load(self, trades):
+        """
+        Replaces the content of the index
+        :param trades: every opened trade in the database
+        """
+        self._trades = {}
+        for trade in trades:
+            self.put(trade)
+        self._is_loaded = True
+
+    def invalidate(self):
+        """
+        Forces the index to be loaded again from the database on next use
+        """
+        self._trades = {}
+        self._is_loaded = False
+
+    def get(self, symbol, vs_currency):
+        """
+        :return: opened trade of the market or None if there is no one
+        """
+        return self._trades.get((symbol, vs_currency))
+
+    def all(self):
+        """
+        :return: list with every opened trade
+        """
+        return list(self._trades.values())
+
+    def put(self, trade):
+        self._trades[(trade.symbol, trade.vs_currency_symbol)] = _trade_snapshot(trade)
+
+    def remove(self, id):
+        for key, trade in list(self._trades.items()):
+            if trade.id == id:
+                del self._trades[key]
+
+    def update(self, id, **values):
+        for trade in self._trades.values():
+            if trade.id == id:
+                for attribute, value in values.items():
+                    setattr(trade, attribute, value)
+
+
+def _trade_snapshot(trade):
+    """
+    :return: copy of the trade not bound to any session
+    """
+    snapshot = dataclasses.replace(trade)
+    snapshot.id = trade.id
+    return snapshot
+
+
 class SqlAlchemyRepository(AbstractRepository):
+    """
+    It can be used as a unit of work:
+
+        with provide_sqlalchemy_repository(real_db=True) as repo:
+            ...
+
+    Inside the with block, commit only flushes the changes, so that every write
+    is performed in a single transaction that is committed when the block
+    finishes. The session is always closed at the end. Entries and exits of real
+    trades are the exception: they record orders already filled in the exchange,
+    so commit stores them at once instead of risking their loss in a rollback.
+    """
+    def __init__(self, session, open_position_index: OpenPositionIndex = None):
+        """
+        :param session: SQLAlchemy session
+        :param open_position_index: if specified, opened positions are served from
+        it, and it is updated on every commit
+        """
+        super().__init__(session)
+        self._open_position_index = open_position_index
+        # Index updates to apply once the current changes are committed
+        self._pending_index_updates = []
+        self._in_unit_of_work = False
+        # True if the changes to commit include entries or exits of real trades
+        self._pending_real_orders = False
+
+    def __enter__(self):
+        self._in_unit_of_work = True
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._in_unit_of_work = False
+        try:
+            if exc_type is not None and issubclass(exc_type, SQLAlchemyError):
+                self.rollback()
+            else:
+                # Changes are kept even if other exceptions are raised, since
+                # they reflect orders already executed in the exchange
+                self.commit()
+        finally:
+            self.close()
+
+        return False
+
+    def rollback(self):
+        self._session.rollback()
+        self._pending_index_updates = []
+        self._pending_real_orders = False
+        if self._open_position_index is not None:
+            # Flushed changes may already be in the index
+            self._open_position_index.invalidate()
+
+    def close(self):
+        self._session.close()
+
     def add_trade(self, trade):
         self._session.add(trade)
+        self._pending_real_orders |= bool(trade.is_real)
+        if trade.status == model.TradeStatus.OPENED:
+            self._update_index_on_commit(lambda: self._open_position_index.put(trade))
 
     def get_trade(self, id):
         return self._session.query(model.Trade).filter_by(id=id).one()
 
     def commit(self):
-        self._session.commit()
+        if self._in_unit_of_work and not self._pending_real_orders:
+            # Committed at the end of the unit of work
+            self._session.flush()
+        else:
+            self._session.commit()
+            self._pending_real_orders = False
+
+        pending_index_updates = self._pending_index_updates
+        self._pending_index_updates = []
+        for index_update in pending_index_updates:
+            index_update()
+
+    def load_open_position_index(self):
+        """
+        Loads every opened trade in the database into the open position index
+        """
+        self._open_position_index.load(self._query_opened_positions())
+
+    def _update_index_on_commit(self, index_update):
+        if self._open_position_index is not None:
+            self._pending_index_updates.append(index_update)
 
     def update_trade_on_oco_order_creation(self, id, oco_stop_exchange_id,
                                            oco_limit_exchange_id):
         trade = self.get_trade(id)
         trade.oco_stop_exchange_id = oco_stop_exchange_id
         trade.oco_limit_exchange_id = oco_limit_exchange_id
+        self._update_index_on_commit(
+            lambda: self._open_position_index.update(id, oco_stop_exchange_id=oco_stop_exchange_id,
+                                                     oco_limit_exchange_id=oco_limit_exchange_id)
+        )
         self.commit()
 
     def update_trade_on_exit_position(self, id, vs_currency_result_no_fees,
@@ -93,9 +245,25 @@ class SqlAlchemyRepository(AbstractRepository):
         trade.crypto_quantity_exit = crypto_quantity_exit
         trade.exit_fee_vs_currency = exit_fee_vs_currency
         trade.exit_date = exit_date
+        self._pending_real_orders |= bool(trade.is_real)
+        if status != model.TradeStatus.OPENED:
+            self._update_index_on_commit(lambda: self._open_position_index.remove(id))
         self.commit()
 
     def get_opened_positions(self, symbol=None, vs_currency=None):
+        if self._open_position_index is None:
+            return self._query_opened_positions(symbol=symbol, vs_currency=vs_currency)
+
+        if not self._open_position_index.is_loaded:
+            self.load_open_position_index()
+
+        if (symbol is None) or (vs_currency is None):
+            return self._open_position_index.all()
+
+        trade = self._open_position_index.get(symbol, vs_currency)
+        return [trade] if trade is not None else []
+
+    def _query_opened_positions(self, symbol=None, vs_currency=None):
         if (symbol is None) or (vs_currency is None):
             return self._session.query(model.Trade).filter_by(status=model.TradeStatus.OPENED).all()
         elif (symbol is not None) and (vs_currency is not None):
@@ -110,11 +278,17 @@ class SqlAlchemyRepository(AbstractRepository):
     def modify_stop_loss(self, id, new_stop_loss):
         trade = self.get_trade(id)
         trade.modified_stop_loss = new_stop_loss
+        self._update_index_on_commit(
+            lambda: self._open_position_index.update(id, modified_stop_loss=new_stop_loss)
+        )
         self.commit()
 
     def modify_take_profit(self, id, new_take_profit):
         trade = self.get_trade(id)
         trade.modified_take_profit = new_take_profit
+        self._update_index_on_commit(
+            lambda: self._open_position_index.update(id, modified_take_profit=new_take_profit)
+        )
         self.commit()
 
     def get_results_for_day_month_year(self, day, month, year):
@@ -133,19 +307,86 @@ class SqlAlchemyRepository(AbstractRepository):
         return results
 
 
-def provide_sqlalchemy_repository(real_db):
+class InMemoryRepository(AbstractRepository):
+    """
+    Keeps the trades in memory, without any database. Like SqlAlchemyRepository
+    with an OpenPositionIndex, opened positions are served as read-only copies.
+    Changes are stored as soon as they are made, so commit does nothing.
+    """
+    def __init__(self):
+        super().__init__(session=None)
+        self._trades = {}  # id -> trade
+        self._open_position_index = OpenPositionIndex()
+        self._open_position_index.load([])
+
+    def add_trade(self, trade):
+        trade.id = len(self._trades) + 1
+        self._trades[trade.id] = trade
+        if trade.status == model.TradeStatus.OPENED:
+            self._open_position_index.put(trade)
+
+    def get_trade(self, id):
+        return self._trades[id]
+
+    def get_trades(self):
+        """
+        :return: list with every trade, in the order they were added
+        """
+        return list(self._trades.values())
+
+    def commit(self):
+        pass
+
+    def update_trade_on_oco_order_creation(self, id, oco_stop_exchange_id,
+                                           oco_limit_exchange_id):
+        self._update_trade(id, oco_stop_exchange_id=oco_stop_exchange_id,
+                           oco_limit_exchange_id=oco_limit_exchange_id)
+
+    def update_trade_on_exit_position(self, id, vs_currency_result_no_fees,
+                                      status, crypto_quantity_exit,
+                                      exit_fee_vs_currency, exit_date):
+        self._update_trade(id, vs_currency_result_no_fees=vs_currency_result_no_fees,
+                           status=status, crypto_quantity_exit=crypto_quantity_exit,
+                           exit_fee_vs_currency=exit_fee_vs_currency, exit_date=exit_date)
+        if status != model.TradeStatus.OPENED:
+            self._open_position_index.remove(id)
+
+    def get_opened_positions(self, symbol=None, vs_currency=None):
+        if (symbol is None) or (vs_currency is None):
+            return self._open_position_index.all()
+
+        trade = self._open_position_index.get(symbol, vs_currency)
+        return [trade] if trade is not None else []
+
+    def modify_stop_loss(self, id, new_stop_loss):
+        self._update_trade(id, modified_stop_loss=new_stop_loss)
+
+    def modify_take_profit(self, id, new_take_profit):
+        self._update_trade(id, modified_take_profit=new_take_profit)
+
+    def _update_trade(self, id, **values):
+        trade = self.get_trade(id)
+        for attribute, value in values.items():
+            setattr(trade, attribute, value)
+        self._open_position_index.update(id, **values)
+
+
+def provide_sqlalchemy_repository(real_db, open_position_index=None):
     """
     Tested indirectly through sqlalchemyrepository_testing fixture
     :param real_db: if True uses real database connection, otherwise uses testing
+    :param open_position_index: OpenPositionIndex shared between repositories
     :return: SqlAlchemyRepository
     """
     if real_db:
         return SqlAlchemyRepository(
-            Session(orm.engine)
+            Session(orm.engine),
+            open_position_index=open_position_index
         )
     else:
         return SqlAlchemyRepository(
-            Session(orm.test_engine)
+            Session(orm.test_engine),
+            open_position_index=open_position_index
         )
 
 if __name__ == "__main__":
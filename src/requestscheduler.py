@@ -0,0 +1,244 @@
+import asyncio
+from collections import Counter
+from contextlib import contextmanager
+import contextvars
+from dataclasses import dataclass
+from enum import IntEnum
+import heapq
+import itertools
+import threading
+import time
+
+import config
+
+
+class Priority(IntEnum):
+    EXIT = 0  # Checks and orders of opened positions
+    ORDER = 1  # Entry orders and account requests
+    SCAN = 2  # Market data of the scans
+
+
+# ccxt method -> (request weight in the Binance spot limit, priority). Other
+# methods (e.g. amount_to_precision) are not requests and are not scheduled
+BINANCE_REQUEST_WEIGHTS = {
+    'fetch_ohlcv': (2, Priority.SCAN),
+    'fetch_ticker': (2, Priority.SCAN),
+    'fetch_tickers': (80, Priority.SCAN),  # Weight of the request without symbols
+    'fetch_time': (1, Priority.SCAN),
+    'load_markets': (20, Priority.SCAN),
+    'fetch_trading_fee': (1, Priority.SCAN),
+    'fetch_trading_fees': (1, Priority.SCAN),
+    'create_order': (1, Priority.ORDER),
+    'fetch_balance': (20, Priority.ORDER),
+    'fetch_free_balance': (20, Priority.ORDER),
+    'withdraw': (1, Priority.ORDER),
+}
+USED_WEIGHT_HEADER = 'x-mbx-used-weight-1m'  # Weight used in the current minute, sent by Binance
+
+# Priority of the requests made in the current context. The priority of a request
+# is the most urgent one between this and the one of its method
+_request_priority = contextvars.ContextVar('request_priority', default=Priority.SCAN)
+
+
+@contextmanager
+def request_priority(priority):
+    """
+    Makes the requests made inside the block (and in the threads and tasks they
+    start) at least as urgent as priority:
+
+        with request_priority(Priority.EXIT):
+            ...
+    """
+    token = _request_priority.set(priority)
+    try:
+        yield
+    finally:
+        _request_priority.reset(token)
+
+
+@dataclass(slots=True, kw_only=True, frozen=True)
+class PriorityStats:
+    requests: int  # Requests granted
+    weight: int  # Weight of the requests granted
+    queued: int  # Requests waiting now
+    max_queued: int  # Largest number of requests waiting at once
+    total_wait_seconds: float  # Time waited by the requests granted
+    max_wait_seconds: float  # Longest time waited by a request
+
+    @property
+    def mean_wait_seconds(self):
+        return self.total_wait_seconds / self.requests if self.requests else 0.
+
+
+class RequestScheduler:
+    """
+    Token bucket of exchange request weight shared by every thread and task.
+    Waiting requests are granted by priority (and in arrival order within a
+    priority), so exits and orders are never queued behind scans, and scans can
+    not spend the last reserved_weight tokens.
+
+    The bucket holds burst_weight tokens and is refilled so that no minute ever
+    spends more than weight_per_minute: a full burst plus a minute of refill.
+    """
+    def __init__(self, weight_per_minute=config.REQUEST_WEIGHT_PER_MINUTE,
+                 burst_weight=config.REQUEST_BURST_WEIGHT,
+                 reserved_weight=config.SCAN_RESERVED_REQUEST_WEIGHT,
+                 clock=time.monotonic):
+        """
+        :param weight_per_minute: request weight limit of the exchange
+        :param burst_weight: capacity of the bucket
+        :param reserved_weight: tokens that scans leave for the other priorities
+        :param clock: function returning the current time in seconds
+        """
+        if not 0 < burst_weight < weight_per_minute:
+            raise ValueError("burst_weight must be positive and lower than weight_per_minute")
+        if not 0 <= reserved_weight < burst_weight:
+            raise ValueError("reserved_weight must be lower than burst_weight")
+
+        self._weight_per_minute = weight_per_minute
+        self._capacity = burst_weight
+        self._refill_per_second = (weight_per_minute - burst_weight) / 60
+        self._reserved = {Priority.SCAN: reserved_weight}
+        self._clock = clock
+        self._tokens = float(burst_weight)
+        self._updated_at = clock()
+
+        self._condition = threading.Condition()
+        self._waiting = []  # Heap of (priority, arrival) of the waiting requests
+        self._arrivals = itertools.count()
+        self._queued = Counter()
+        self._max_queued = Counter()
+        self._requests = Counter()
+        self._weight = Counter()
+        self._total_wait = Counter()
+        self._max_wait = Counter()
+
+    @property
+    def tokens(self):
+        with self._condition:
+            self._refill()
+            return self._tokens
+
+    def _refill(self):
+        now = self._clock()
+        self._tokens = min(self._capacity,
+                           self._tokens + (now - self._updated_at) * self._refill_per_second)
+        self._updated_at = now
+
+    def acquire(self, weight, priority=Priority.SCAN):
+        """
+        Blocks until the request can be sent and spends its weight
+        :param weight: request weight. Heavier requests than the bucket spend all of it
+        :param priority: Priority of the request
+        :return: seconds waited
+        """
+        weight = min(weight, self._capacity - self._reserved.get(priority, 0))
+        needed = weight + self._reserved.get(priority, 0)
+
+        with self._condition:
+            ticket = (priority, next(self._arrivals))
+            heapq.heappush(self._waiting, ticket)
+            self._queued[priority] += 1
+            self._max_queued[priority] = max(self._max_queued[priority],
+                                             self._queued[priority])
+            # Requests behind a less urgent one must be able to overtake it
+            self._condition.notify_all()
+            start = self._clock()
+            try:
+                while True:
+                    self._refill()
+                    if self._waiting[0] != ticket:
+                        self._condition.wait()
+                    elif self._tokens < needed:
+                        self._condition.wait((needed - self._tokens) / self._refill_per_second)
+                    else:
+                        break
+            finally:
+                self._waiting.remove(ticket)
+                heapq.heapify(self._waiting)
+                self._queued[priority] -= 1
+                self._condition.notify_all()
+
+            self._tokens -= weight
+            waited = self._clock() - start
+            self._requests[priority] += 1
+            self._weight[priority] += weight
+            self._total_wait[priority] += waited
+            self._max_wait[priority] = max(self._max_wait[priority], waited)
+
+        return waited
+
+    async def acquire_async(self, weight, priority=Priority.SCAN):
+        """
+        Asynchronous version of acquire. The wait happens in a worker thread
+        """
+        return await asyncio.to_thread(self.acquire, weight, priority)
+
+    def observe_used_weight(self, used_weight):
+        """
+        Corrects the bucket with the weight used in the current minute reported by
+        the exchange, which includes requests of other processes with the same IP
+        """
+        with self._condition:
+            self._refill()
+            self._tokens = min(self._tokens, max(self._weight_per_minute - used_weight, 0))
+
+    def stats(self):
+        """
+        :return: dict Priority -> PriorityStats
+        """
+        with self._condition:
+            return {priority: PriorityStats(requests=self._requests[priority],
+                                            weight=self._weight[priority],
+                                            queued=self._queued[priority],
+                                            max_queued=self._max_queued[priority],
+                                            total_wait_seconds=self._total_wait[priority],
+                                            max_wait_seconds=self._max_wait[priority])
+                    for priority in Priority}
+
+
+class ScheduledExchangeApi:
+    """
+    Proxy of a ccxt exchange (synchronous or asynchronous) whose requests wait
+    for a RequestScheduler. Every other attribute is the one of the exchange
+    """
+    def __init__(self, exchange_api, scheduler: RequestScheduler,
+                 weights=BINANCE_REQUEST_WEIGHTS):
+        """
+        :param exchange_api: ccxt.Exchange or ccxt.async_support.Exchange
+        :param scheduler: RequestScheduler shared by every exchange api
+        :param weights: dict method name -> (request weight, Priority)
+        """
+        self._exchange_api = exchange_api
+        self._scheduler = scheduler
+        self._weights = weights
+
+    def __getattr__(self, name):
+        attribute = getattr(self._exchange_api, name)
+        if name not in self._weights or not callable(attribute):
+            return attribute
+
+        weight, priority = self._weights[name]
+
+        if asyncio.iscoroutinefunction(attribute):
+            async def scheduled_request(*args, **kwargs):
+                await self._scheduler.acquire_async(
+                    weight, min(priority, _request_priority.get()))
+                result = await attribute(*args, **kwargs)
+                self._observe_used_weight()
+                return result
+        else:
+            def scheduled_request(*args, **kwargs):
+                self._scheduler.acquire(weight, min(priority, _request_priority.get()))
+                result = attribute(*args, **kwargs)
+                self._observe_used_weight()
+                return result
+
+        return scheduled_request
+
+    def _observe_used_weight(self):
+        headers = getattr(self._exchange_api, 'last_response_headers', None) or {}
+        for header, value in headers.items():
+            if header.lower() == USED_WEIGHT_HEADER:
+                self._scheduler.observe_used_weight(int(value))
+                return
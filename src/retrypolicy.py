@@ -0,0 +1,189 @@
+import asyncio
+from dataclasses import dataclass
+import random
+import threading
+import time
+
+import ccxt
+
+import config
+import requestscheduler as rs
+
+
+# ccxt methods that place orders or move funds. A network error does not tell
+# whether they were executed, so they are never retried, and they are never
+# rejected by an open circuit because exits must always be attempted
+NOT_RETRIED_METHODS = frozenset({'create_order', 'withdraw'})
+
+
+class CircuitOpenError(ccxt.NetworkError):
+    """
+    Raised instead of sending a request to an endpoint whose circuit is open
+    """
+
+
+@dataclass(slots=True, kw_only=True)
+class RetryPolicy:
+    attempts: int = config.EXCHANGE_RETRY_ATTEMPTS  # Attempts of a request, including the first one
+    base_seconds: float = config.EXCHANGE_RETRY_BASE_SECONDS  # Longest wait before the first retry
+    max_seconds: float = config.EXCHANGE_RETRY_MAX_SECONDS  # Longest wait between retries
+    failures_to_open: int = config.CIRCUIT_BREAKER_FAILURES  # Consecutive failures that open a circuit
+    reset_seconds: float = config.CIRCUIT_BREAKER_RESET_SECONDS  # Time a circuit stays open
+
+    def backoff_seconds(self, retry, rng=random):
+        """
+        Exponential backoff with full jitter, so that retries of many requests
+        failed at once are spread instead of hitting the exchange together
+        :param retry: number of the retry, starting at 0
+        :return: seconds to wait before the retry
+        """
+        return rng.uniform(0, min(self.max_seconds, self.base_seconds * 2 ** retry))
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests to an endpoint after failures_to_open consecutive
+    network errors. Requests are rejected with CircuitOpenError during
+    reset_seconds; then a single trial request is let through, which closes the
+    circuit if it succeeds or opens it again if it fails.
+    """
+    def __init__(self, failures_to_open, reset_seconds, clock=time.monotonic):
+        self._failures_to_open = failures_to_open
+        self._reset_seconds = reset_seconds
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at = None
+        self._trial_in_flight = False
+
+    @property
+    def is_open(self):
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_request(self):
+        """
+        Raises CircuitOpenError if the request must not be sent
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return
+            if self._trial_in_flight or \
+                    self._clock() - self._opened_at < self._reset_seconds:
+                raise CircuitOpenError("Circuit open after repeated network errors")
+            self._trial_in_flight = True
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._trial_in_flight or self._failures >= self._failures_to_open:
+                self._opened_at = self._clock()
+            self._trial_in_flight = False
+
+
+def endpoint(method_name, args, kwargs):
+    """
+    :return: key of the circuit of a request: the method and, if given, its market
+    symbol. Failures in the candles of one market do not affect the others
+    """
+    symbol = kwargs.get('symbol', args[0] if args and isinstance(args[0], str) else None)
+
+    return method_name, symbol
+
+
+class ResilientExchangeApi:
+    """
+    Proxy of a ccxt exchange (synchronous or asynchronous) whose requests are
+    retried with jittered exponential backoff on network errors, and rejected
+    while the circuit of their endpoint is open. Other errors (e.g. unknown
+    markets) are raised at once and do not count as
+    failures. Every other attribute is the one of the exchange
+    """
+    def __init__(self, exchange_api, retry_policy: RetryPolicy,
+                 methods=frozenset(rs.BINANCE_REQUEST_WEIGHTS), sleep=time.sleep,
+                 clock=time.monotonic):
+        """
+        :param exchange_api: ccxt exchange, or a proxy of it such as
+        requestscheduler.ScheduledExchangeApi
+        :param retry_policy: RetryPolicy of the requests
+        :param methods: names of the methods that make requests
+        :param sleep: function used to wait between retries of synchronous requests
+        :param clock: function returning the current time in seconds, for the circuits
+        """
+        self._exchange_api = exchange_api
+        self._retry_policy = retry_policy
+        self._methods = methods
+        self._sleep = sleep
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._circuits = {}  # endpoint -> CircuitBreaker
+
+    def open_circuits(self):
+        """
+        :return: list of (method name, market symbol) whose requests are rejected
+        """
+        with self._lock:
+            circuits = list(self._circuits.items())
+
+        return [key for key, circuit in circuits if circuit.is_open]
+
+    def _circuit(self, key):
+        with self._lock:
+            if key not in self._circuits:
+                self._circuits[key] = CircuitBreaker(self._retry_policy.failures_to_open,
+                                                     self._retry_policy.reset_seconds,
+                                                     clock=self._clock)
+            return self._circuits[key]
+
+    def __getattr__(self, name):
+        attribute = getattr(self._exchange_api, name)
+        if name not in self._methods or name in NOT_RETRIED_METHODS or \
+                not callable(attribute):
+            return attribute
+
+        if asyncio.iscoroutinefunction(attribute):
+            async def resilient_request(*args, **kwargs):
+                circuit = self._circuit(endpoint(name, args, kwargs))
+                for retry in range(self._retry_policy.attempts):
+                    circuit.before_request()
+                    try:
+                        result = await attribute(*args, **kwargs)
+                    except ccxt.NetworkError:
+                        circuit.record_failure()
+                        if retry == self._retry_policy.attempts - 1 or circuit.is_open:
+                            raise
+                        await asyncio.sleep(self._retry_policy.backoff_seconds(retry))
+                    except Exception:
+                        # The exchange answered, so the endpoint works
+                        circuit.record_success()
+                        raise
+                    else:
+                        circuit.record_success()
+                        return result
+        else:
+            def resilient_request(*args, **kwargs):
+                circuit = self._circuit(endpoint(name, args, kwargs))
+                for retry in range(self._retry_policy.attempts):
+                    circuit.before_request()
+                    try:
+                        result = attribute(*args, **kwargs)
+                    except ccxt.NetworkError:
+                        circuit.record_failure()
+                        if retry == self._retry_policy.attempts - 1 or circuit.is_open:
+                            raise
+                        self._sleep(self._retry_policy.backoff_seconds(retry))
+                    except Exception:
+                        # The exchange answered, so the endpoint works
+                        circuit.record_success()
+                        raise
+                    else:
+                        circuit.record_success()
+                        return result
+
+        return resilient_request
@@ -0,0 +1,153 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import time
+
+import ccxt
+
+import config
+import exchangehandler as ex_han
+
+
+class AsyncMarketScanEngine:
+    """
+    Scans markets concurrently. The candles and prices needed by the strategy are
+    fetched asynchronously for many markets at once (bounded by max_concurrency),
+    while the evaluation of each market (strategy, entries and exits) is run one
+    market at a time in a single worker thread. This way the entry and exit
+    semantics are the same as in a sequential scan.
+    """
+    def __init__(self, exchange_handler: ex_han.ExchangeHandler, evaluate_market,
+                 timeframe, num_candles=200,
+                 max_concurrency=config.SCAN_MAX_CONCURRENCY, monitor=None,
+                 monitor_interval_seconds=config.EXIT_MONITOR_INTERVAL_SECONDS,
+                 candle_source=None):
+        """
+        :param exchange_handler: ExchangeHandler used to fetch market data
+        :param evaluate_market: blocking function called with symbol, vs_currency,
+        df and current_price keyword arguments for each scanned market
+        :param timeframe: timeframe of the candles to fetch
+        :param num_candles: number of candles to fetch, including the unfinished one
+        :param max_concurrency: maximum number of markets fetched at the same time
+        :param monitor: blocking function without arguments, run periodically
+        between market evaluations (e.g. to check opened positions)
+        :param monitor_interval_seconds: minimum time between monitor calls
+        :param candle_source: object providing get_candles_last_one_not_finished_async
+        (e.g. a CandleStore). If None, candles are fetched from exchange_handler
+        """
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+
+        self._exchange_handler = exchange_handler
+        self._candle_source = candle_source if candle_source is not None else exchange_handler
+        self._evaluate_market = evaluate_market
+        self._timeframe = timeframe
+        self._num_candles = num_candles
+        self._max_concurrency = max_concurrency
+        self._monitor = monitor
+        self._monitor_interval_seconds = monitor_interval_seconds
+        self._last_monitor_time = None
+        # (market or 'monitor', NetworkError) of the last scan
+        self._network_errors = []
+
+        # The event loop is kept alive between scans because ccxt async
+        # exchanges bind their http session to the loop of their first request
+        self._loop = asyncio.new_event_loop()
+        # Single worker so that evaluations never run concurrently
+        self._evaluation_executor = ThreadPoolExecutor(max_workers=1)
+
+    def scan(self, markets):
+        """
+        Fetches and evaluates every market once. Markets whose data can not be
+        fetched or whose evaluation fails due to network errors are skipped, so
+        they do not stop the others. Network errors of the monitor do not stop
+        the scan either
+        :param markets: iterable of (symbol, vs_currency) tuples
+        :return: list of the markets evaluated
+        """
+        self._network_errors = []
+
+        return self._loop.run_until_complete(self._scan(list(markets)))
+
+    def network_errors(self):
+        """
+        :return: list of (market, error) of the network errors raised by the
+        evaluations of the last scan. The market is 'monitor' for the errors of
+        the monitor
+        """
+        return list(self._network_errors)
+
+    def close(self):
+        """
+        Releases the event loop, the worker thread and the exchange async resources
+        """
+        self._loop.run_until_complete(self._exchange_handler.close_async())
+        self._loop.close()
+        self._evaluation_executor.shutdown(wait=True)
+
+    async def _scan(self, markets):
+        semaphore = asyncio.Semaphore(self._max_concurrency)
+        tasks = [asyncio.ensure_future(self._fetch_market_data(semaphore, symbol,
+                                                               vs_currency))
+                 for symbol, vs_currency in markets]
+
+        evaluated = []
+        try:
+            # Markets are evaluated as soon as their data arrives
+            for next_market in asyncio.as_completed(tasks):
+                symbol, vs_currency, df, current_price = await next_market
+                if df is None:
+                    continue
+                try:
+                    await self._run_in_worker(self._evaluate_market, symbol=symbol,
+                                              vs_currency=vs_currency, df=df,
+                                              current_price=current_price)
+                except ccxt.NetworkError as e:
+                    # The market stays due, as if its data could not be fetched
+                    self._network_errors.append(((symbol, vs_currency), e))
+                else:
+                    evaluated.append((symbol, vs_currency))
+                await self._monitor_if_needed()
+        finally:
+            # Do not leave requests running if a market raised an exception
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+        return evaluated
+
+    async def _fetch_market_data(self, semaphore, symbol, vs_currency):
+        """
+        :return: symbol, vs_currency, candles and current price. Candles and price
+        are None if they could not be fetched due to network errors
+        """
+        async with semaphore:
+            try:
+                df, current_price = await asyncio.gather(
+                    self._candle_source.get_candles_last_one_not_finished_async(
+                        symbol=symbol, vs_currency=vs_currency,
+                        timeframe=self._timeframe, num_candles=self._num_candles),
+                    self._exchange_handler.get_current_price_async(
+                        symbol=symbol, vs_currency=vs_currency)
+                )
+            except ccxt.NetworkError:
+                return symbol, vs_currency, None, None
+
+        return symbol, vs_currency, df, current_price
+
+    async def _monitor_if_needed(self):
+        if self._monitor is None:
+            return
+
+        now = time.monotonic()
+        if self._last_monitor_time is None or \
+                now - self._last_monitor_time >= self._monitor_interval_seconds:
+            try:
+                await self._run_in_worker(self._monitor)
+            except ccxt.NetworkError as e:
+                # It is run again after the interval, as if it had finished
+                self._network_errors.append(('monitor', e))
+            self._last_monitor_time = time.monotonic()
+
+    def _run_in_worker(self, function, **kwargs):
+        return self._loop.run_in_executor(self._evaluation_executor,
+                                          lambda: function(**kwargs))
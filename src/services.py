@@ -1,37 +1,145 @@
 from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime, timedelta
+from functools import partial, wraps
 import os.path
+import threading
 import time
 
 import ccxt
+import ccxt.async_support as ccxt_async
+import ccxt.pro as ccxt_pro
 import schedule
 
+import candleclock as cc
+import candlestore as cs
 import commonutils as cu
 import config
 import exchangehandler as ex_han
+import exitevaluator as ex_ev
 import externalnotifier
 import filesystemutils as fs
+import indicatorcache as ic
 import marketfinder as mar_fin
+import marketstream as ms
 import model
+import portfoliovaluation as pv
+import pricesnapshot as ps
 import repository as rp
+import requestscheduler as rs
+import retrypolicy as rtp
+import scanengine as se
 import strategy as st
 
 
 mf = mar_fin.CoinGeckoMarketFinder()
 eh = None
+candle_store = None
+price_snapshots = None
+exit_evaluator = None
+# Streamed market data. Current prices and exit checks read from its price book
+market_hub = None
+# Opened trades kept in memory. Shared by every repository provided to services
+open_positions = rp.OpenPositionIndex()
+# Repository shared by every service during the tick of each thread (see
+# repository_tick). Sessions are not thread-safe, so threads do not share them
+_ticks = threading.local()
+# Equity of the account, updated with the fills of the bot
+portfolio = None
+# Current time of the trades. Replays set the time of their simulated clock
+now = datetime.now
 
 
 def reload_exchange_handler():
-    global eh
+    global eh, candle_store, price_snapshots, exit_evaluator, market_hub, portfolio
+    exchange_config = {
+        'apiKey': config.BINANCE_API_KEY,
+        'secret': config.BINANCE_SECRET_KEY,
+        # Requests are throttled by the request scheduler, which serves exits first
+        'enableRateLimit': False,
+    }
     eh = ex_han.BinanceCcxtExchangeHandler(
-        ccxt.binance(
-            {
-                'apiKey': config.BINANCE_API_KEY,
-                'secret': config.BINANCE_SECRET_KEY,
-                'enableLimitRate': True,
-            }
-        )
+        ccxt.binance(exchange_config),
+        async_exchange_api=ccxt_async.binance(exchange_config),
+        request_scheduler=rs.RequestScheduler(),
+        retry_policy=rtp.RetryPolicy()
     )
+    market_hub = ms.MarketDataHub()
+    eh.attach_price_book(market_hub.price_book)
+    candle_store = cs.CandleStore(exchange_handler=eh)
+    market_hub.subscribe(candle_store.on_kline, ms.KlineEvent)
+    price_snapshots = ps.PriceSnapshotService(exchange_handler=eh)
+    exit_evaluator = ex_ev.PositionExitEvaluator(exchange_handler=eh,
+                                                 price_book=market_hub.price_book)
+    portfolio = pv.PortfolioValuation(exchange_handler=eh)
+
+
+def start_market_stream(markets, kline_timeframes=()):
+    """
+    Streams the given markets and the ones with opened positions into market_hub
+    :param markets: list of (symbol, vs_currency) tuples
+    :param kline_timeframes: timeframes whose klines are streamed to candle_store
+    :return: started ms.ExchangeStreamFeed. It must be stopped when finished
+    """
+    with repository_tick() as repo:
+        opened_markets = [(op.symbol, op.vs_currency_symbol)
+                          for op in repo.get_opened_positions()]
+    feed = ms.ExchangeStreamFeed(ccxt_pro.binance(),
+                                 markets=list(markets) + opened_markets,
+                                 kline_timeframes=kline_timeframes)
+    feed.start(market_hub)
+
+    return feed
+
+
+def provide_repository():
+    """
+    :return: repository of the tick running in the current thread
+    """
+    repository = getattr(_ticks, 'repository', None)
+    if repository is None:
+        # Its session would never be closed
+        raise RuntimeError("Repositories are only provided inside repository_tick")
+
+    return repository
+
+
+@contextmanager
+def repository_tick():
+    """
+    Every service called inside this context in the same thread uses the same
+    repository of the real database, which serves opened positions from memory.
+    This way one session is used per tick, its writes are committed in a single
+    transaction and the session is closed at the end. Other threads have their
+    own ticks
+    """
+    repository = getattr(_ticks, 'repository', None)
+    if repository is not None:
+        # Nested ticks belong to the outer one
+        yield repository
+        return
+
+    with rp.provide_sqlalchemy_repository(real_db=True,
+                                          open_position_index=open_positions) as repo:
+        _ticks.repository = repo
+        try:
+            yield repo
+        finally:
+            _ticks.repository = None
+
+
+def in_repository_tick(function):
+    """
+    :param function: function using the repository of the tick
+    :return: function that calls function inside repository_tick, in the thread
+    where it is called
+    """
+    @wraps(function)
+    def ticked(*args, **kwargs):
+        with repository_tick():
+            return function(*args, **kwargs)
+
+    return ticked
 
 
 def shut_down_bot():
@@ -175,87 +283,93 @@ def close_opened_position(symbol, vs_currency):
     :param vs_currency: right-hand side of market info
     :return:
     """
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     opened_trade = repo.get_opened_positions(symbol=symbol,
                                              vs_currency=vs_currency)
 
     if opened_trade:
-        opened_trade = opened_trade[0]
+        exit_decision = exit_evaluator.evaluate_trade(opened_trade[0])
 
-        take_profit = opened_trade.modified_take_profit if opened_trade.modified_take_profit is not None else opened_trade.take_profit
-        stop_loss = opened_trade.modified_stop_loss if opened_trade.modified_stop_loss is not None else opened_trade.stop_loss
-
-        current_low = list(eh.get_candles_last_one_not_finished(symbol=symbol,
-                                                           vs_currency=vs_currency,
-                                                           timeframe='1m',
-                                                           num_candles=1)['low'])[0]
-
-        current_high = list(eh.get_candles_last_one_not_finished(symbol=symbol,
-                                                           vs_currency=vs_currency,
-                                                           timeframe='1m',
-                                                           num_candles=1)['high'])[0]
-
-        # This is used to sell if the price is foreseen to go below the minimum
-        market_info = eh.fetch_market(symbol=symbol, vs_currency=vs_currency)
-        min_vs_currency_to_enter_market = market_info['min_vs_currency']
-
-        if current_high >= take_profit:
-            exit_price = take_profit
-        elif min_vs_currency_to_enter_market <= current_low <= min_vs_currency_to_enter_market * 1.004:
-            exit_price = current_low
-        elif current_low <= stop_loss:
-            exit_price = stop_loss
-        else:
-            return
+        if exit_decision is not None:
+            close_position_on_exit_decision(repo, exit_decision)
 
-        exit_date = model.format_date_for_database(datetime.now())
 
-        if not opened_trade.is_real:
-            # Simulate strategy in real time
+def close_position_on_exit_decision(repo, exit_decision):
+    """
+    NOT TESTED METHOD
+    Closes the position of the trade in the exit decision
+    :param repo: repository where the exit is stored
+    :param exit_decision: ExitDecision for the trade
+    :return:
+    """
+    opened_trade = exit_decision.trade
+    symbol = opened_trade.symbol
+    vs_currency = opened_trade.vs_currency_symbol
+    exit_price = exit_decision.exit_price
 
-            fee_factor = eh.get_fee_factor(symbol=symbol,
-                                           vs_currency=vs_currency)['taker']
-            # Estimation of crypto quantity on exit. Susceptible of being changed
-            crypto_quantity_exit = opened_trade.crypto_quantity_entry * (1- fee_factor)
+    exit_date = model.format_date_for_database(now())
 
-            vs_currency_exit = exit_price * crypto_quantity_exit
-            exit_fee_vs_currency = vs_currency_exit * fee_factor
-            vs_currency_result_no_fees = vs_currency_exit - opened_trade.vs_currency_entry
-            result = vs_currency_result_no_fees - opened_trade.entry_fee_vs_currency - exit_fee_vs_currency
-            status = model.TradeStatus.WON if result > 0 else model.TradeStatus.LOST
+    if not opened_trade.is_real:
+        # Simulate strategy in real time
 
-        else:
-            # Perform the strategy with actual money
-            amount = opened_trade.crypto_quantity_entry
-            sell_order = eh.sell_market_order_diminishing_amount(symbol=symbol,
-                                                                 vs_currency=vs_currency,
-                                                                 amount=amount)
+        fee_factor = eh.get_fee_factor(symbol=symbol,
+                                       vs_currency=vs_currency)['taker']
+        # Estimation of crypto quantity on exit. Susceptible of being changed
+        crypto_quantity_exit = opened_trade.crypto_quantity_entry * (1- fee_factor)
+
+        vs_currency_exit = exit_price * crypto_quantity_exit
+        exit_fee_vs_currency = vs_currency_exit * fee_factor
+        vs_currency_result_no_fees = vs_currency_exit - opened_trade.vs_currency_entry
+        result = vs_currency_result_no_fees - opened_trade.entry_fee_vs_currency - exit_fee_vs_currency
+        status = model.TradeStatus.WON if result > 0 else model.TradeStatus.LOST
 
-            if sell_order is None:
+    else:
+        # Perform the strategy with actual money
+        amount = opened_trade.crypto_quantity_entry
+        sell_order = eh.sell_market_order_diminishing_amount(symbol=symbol,
+                                                             vs_currency=vs_currency,
+                                                             amount=amount)
+
+        if sell_order is None:
+            if eh.sellable_amount(symbol=symbol, vs_currency=vs_currency, amount=amount) > 0:
                 msg = f"Couldn't close {symbol}/{vs_currency} position"
                 cu.log(msg)
                 # externalnotifier.externally_notify(msg)
                 return None
 
+            # The whole position is below the precision of the market, so it is
+            # closed without selling instead of trying again on every tick. Its
+            # amount is recorded as dust in eh.dust_report
+            msg = f"Posición de {symbol}/{vs_currency} cerrada sin vender: su cantidad " \
+                  f"es menor que la precisión del mercado"
+            externalnotifier.externally_notify(msg)
+            cu.log(msg)
+            crypto_quantity_exit = 0.
+            exit_fee_vs_currency = 0.
+            vs_currency_exit = 0.
+        else:
+            portfolio.record_sell(symbol=symbol, vs_currency=vs_currency, order=sell_order)
+
             crypto_quantity_exit = sell_order['amount']
             exit_price = sell_order['price']
             exit_fee_vs_currency = sell_order['fee_in_asset']
             vs_currency_exit = sell_order['cost']
 
-            # In the real trade commissions are already considered in return exchange information
-            vs_currency_result_no_fees = vs_currency_exit - opened_trade.vs_currency_entry + opened_trade.entry_fee_vs_currency + exit_fee_vs_currency
-            result = vs_currency_result_no_fees - opened_trade.entry_fee_vs_currency - exit_fee_vs_currency
-            status = model.TradeStatus.WON if result > 0 else model.TradeStatus.LOST
-
-        model.complete_trade_with_market_sell_info(trade=opened_trade,
-                                                   vs_currency_result_no_fees=vs_currency_result_no_fees,
-                                                   crypto_quantity_exit=crypto_quantity_exit,
-                                                   exit_fee_vs_currency=exit_fee_vs_currency,
-                                                   exit_date=exit_date,
-                                                   status=status)
-        repo.commit()
-        cu.log(f"{model.format_date_for_database(datetime.now())} closed position for {symbol}")
+        # In the real trade commissions are already considered in return exchange information
+        vs_currency_result_no_fees = vs_currency_exit - opened_trade.vs_currency_entry + opened_trade.entry_fee_vs_currency + exit_fee_vs_currency
+        result = vs_currency_result_no_fees - opened_trade.entry_fee_vs_currency - exit_fee_vs_currency
+        status = model.TradeStatus.WON if result > 0 else model.TradeStatus.LOST
+
+    # Opened trades are read-only copies, so changes go through the repository
+    repo.update_trade_on_exit_position(id=opened_trade.id,
+                                       vs_currency_result_no_fees=vs_currency_result_no_fees,
+                                       status=status,
+                                       crypto_quantity_exit=crypto_quantity_exit,
+                                       exit_fee_vs_currency=exit_fee_vs_currency,
+                                       exit_date=exit_date)
+    exit_evaluator.forget(opened_trade)
+    cu.log(f"{model.format_date_for_database(now())} closed position for {symbol}")
 
 
 def enter_position(symbol, vs_currency, timeframe, stop_loss, entry_price,
@@ -271,7 +385,7 @@ def enter_position(symbol, vs_currency, timeframe, stop_loss, entry_price,
     :param vs_currency: right-hand side of market info
     :return:
     """
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     opened_trade = repo.get_opened_positions(symbol=symbol,
                                              vs_currency=vs_currency)
@@ -296,7 +410,7 @@ def enter_position(symbol, vs_currency, timeframe, stop_loss, entry_price,
                                                strategy_name=strategy_name,
                                                is_real=is_real,
                                                entry_date=model.format_date_for_database(
-                                                   datetime.now()))
+                                                   now()))
             cu.log(f"Entered simulated position for {symbol}{vs_currency}")
         else:
             # Check if used vs currency would be between min and max ranges
@@ -332,6 +446,7 @@ def enter_position(symbol, vs_currency, timeframe, stop_loss, entry_price,
                     # Log that order could not be placed and go on searching for trades
                     cu.log("Couldn't perform the buy order")
                     return
+                portfolio.record_buy(symbol=symbol, vs_currency=vs_currency, order=buy_order)
 
                 vs_currency_entry = buy_order['cost']
                 crypto_quantity_entry = buy_order['amount']
@@ -359,7 +474,7 @@ def enter_position(symbol, vs_currency, timeframe, stop_loss, entry_price,
                                                    strategy_name=strategy_name,
                                                    is_real=is_real,
                                                    entry_date=model.format_date_for_database(
-                                                       datetime.now()))
+                                                       now()))
                 cu.log(f"Entered real position for {symbol}{vs_currency}")
             else:
                 return
@@ -369,13 +484,13 @@ def enter_position(symbol, vs_currency, timeframe, stop_loss, entry_price,
 
 
 def close_all_opened_positions():
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     opened_positions = repo.get_opened_positions()
 
-    for op in opened_positions:
-        close_opened_position(symbol=op.symbol,
-                              vs_currency=op.vs_currency_symbol)
+    # Decisions for every position are taken before closing any of them
+    for exit_decision in exit_evaluator.evaluate(opened_positions):
+        close_position_on_exit_decision(repo, exit_decision)
 
 
 def set_stop_loss_to_break_even_in_opened_position(symbol, vs_currency):
@@ -385,7 +500,7 @@ def set_stop_loss_to_break_even_in_opened_position(symbol, vs_currency):
     :param vs_currency:
     :return:
     """
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     opened_trade = repo.get_opened_positions(symbol=symbol,
                                              vs_currency=vs_currency)
@@ -404,7 +519,7 @@ def set_take_profit_to_percentage_in_opened_position(symbol, vs_currency, percen
     :param percentage: percentage to which reduce the range of take profit. MUST BE between 0-1
     :return:
     """
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     opened_trade = repo.get_opened_positions(symbol=symbol,
                                              vs_currency=vs_currency)
@@ -428,19 +543,36 @@ def set_take_profit_to_percentage_in_opened_position(symbol, vs_currency, percen
                                 new_take_profit=new_take_profit)
 
 
-def check_every_opened_trade_for_break_even():
+def _opened_positions_price_snapshot(opened_positions):
+    """
+    :param opened_positions: list of opened trades
+    :return: PriceSnapshot with the prices of the markets of the opened trades
+    """
+    return price_snapshots.snapshot(
+        [(op.symbol, op.vs_currency_symbol) for op in opened_positions]
+    )
+
+
+def check_every_opened_trade_for_break_even(price_snapshot=None):
     """
     If the current price has surpassed the half of the take profit territory, then
     modify the stop loss to break even
+    :param price_snapshot: PriceSnapshot with the current prices. If None, a bulk
+    snapshot of every opened position market is used
     :return:
     """
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     opened_positions = repo.get_opened_positions()
+    if price_snapshot is None:
+        price_snapshot = _opened_positions_price_snapshot(opened_positions)
 
     for op in opened_positions:
-        current_price = eh.get_current_price(symbol=op.symbol,
+        current_price = price_snapshot.price(symbol=op.symbol,
                                              vs_currency=op.vs_currency_symbol)
+        if current_price is None:
+            continue
+
         entry_price = op.entry_price
         take_profit = op.take_profit
 
@@ -451,21 +583,29 @@ def check_every_opened_trade_for_break_even():
                                                            vs_currency=op.vs_currency_symbol)
 
 
-def check_every_opened_trade_for_reduction_in_take_profit(reduce_take_profit_to_percentage=.8):
+def check_every_opened_trade_for_reduction_in_take_profit(reduce_take_profit_to_percentage=.8,
+                                                          price_snapshot=None):
     """
     If the current price has gone below the half of the stop loss territory, then
     modify the take profit to a percentage
     :param reduce_take_profit_to_percentage: final percentage to reduce take profit. E.g. if this variable is .1 then
     the take profit will be reduced to a 10% of its initial value, i.e., it will be reduced a 90%
+    :param price_snapshot: PriceSnapshot with the current prices. If None, a bulk
+    snapshot of every opened position market is used
     :return:
     """
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     opened_positions = repo.get_opened_positions()
+    if price_snapshot is None:
+        price_snapshot = _opened_positions_price_snapshot(opened_positions)
 
     for op in opened_positions:
-        current_price = eh.get_current_price(symbol=op.symbol,
+        current_price = price_snapshot.price(symbol=op.symbol,
                                              vs_currency=op.vs_currency_symbol)
+        if current_price is None:
+            continue
+
         entry_price = op.entry_price
         stop_loss = op.stop_loss
 
@@ -478,23 +618,33 @@ def check_every_opened_trade_for_reduction_in_take_profit(reduce_take_profit_to_
 
 
 def compute_strategy_and_try_to_enter(symbol, vs_currency, strategy,
-                                      strategy_entry_timeframe, is_real):
+                                      strategy_entry_timeframe, is_real, df=None,
+                                      current_price=None):
+    """
+    Closes the opened position of the market if needed and, if there is no opened
+    position, performs the strategy and tries to enter
+    :param df: candles for the strategy (last one not finished). If None, they are fetched
+    :param current_price: current price of the market. If None, it is fetched
+    """
     cu.log(f"Scanning {symbol}{vs_currency}")
     close_opened_position(symbol=symbol, vs_currency=vs_currency)
-    repo = rp.provide_sqlalchemy_repository(real_db=True)
+    repo = provide_repository()
 
     if not repo.get_opened_positions(symbol=symbol, vs_currency=vs_currency):
         # # COMPUTE HERE DF FOR STRATEGIES
-        df = eh.get_candles_last_one_not_finished(symbol=symbol,
-                                                  vs_currency=vs_currency,
-                                                  timeframe=strategy_entry_timeframe,
-                                                  num_candles=200)
+        if df is None:
+            df = candle_store.get_candles_last_one_not_finished(symbol=symbol,
+                                                                vs_currency=vs_currency,
+                                                                timeframe=strategy_entry_timeframe,
+                                                                num_candles=200)
 
-        current_price = eh.get_current_price(symbol=symbol,
-                                             vs_currency=vs_currency)
+        if current_price is None:
+            current_price = eh.get_current_price(symbol=symbol,
+                                                 vs_currency=vs_currency)
 
         # INCLUDE HERE THE DFs FOR STRATEGY
         st_out = strategy.perform_strategy(entry_price=current_price,
+                                           market=(symbol, vs_currency),
                                            df=df)
 
 
@@ -547,11 +697,11 @@ def compute_strategy_and_try_to_enter(symbol, vs_currency, strategy,
 
 
 def notify_results_for_current_day():
-    repo = rp.provide_sqlalchemy_repository(True)
-    today = datetime.today()
-    results = repo.get_results_for_day_month_year(today.day,
-                                                  today.month,
-                                                  today.year)
+    with rp.provide_sqlalchemy_repository(True) as repo:
+        today = datetime.today()
+        results = repo.get_results_for_day_month_year(today.day,
+                                                      today.month,
+                                                      today.year).all()
     externalnotifier.externally_notify(f"=========={today.day}/{today.month}/{today.year}==========")
     for r in results:
         fiat_amount = None
@@ -563,12 +713,12 @@ def notify_results_for_current_day():
 
 
 def notify_results_for_previous_day():
-    repo = rp.provide_sqlalchemy_repository(True)
-    today = datetime.today()
-    yesterday = today - timedelta(days=1)
-    results = repo.get_results_for_day_month_year(yesterday.day,
-                                                  yesterday.month,
-                                                  yesterday.year)
+    with rp.provide_sqlalchemy_repository(True) as repo:
+        today = datetime.today()
+        yesterday = today - timedelta(days=1)
+        results = repo.get_results_for_day_month_year(yesterday.day,
+                                                      yesterday.month,
+                                                      yesterday.year).all()
     externalnotifier.externally_notify(f"=========={yesterday.day}/{yesterday.month}/{yesterday.year}==========")
     for r in results:
         fiat_amount = None
@@ -580,15 +730,15 @@ def notify_results_for_previous_day():
 
 
 def notify_results_for_previous_month():
-    repo = rp.provide_sqlalchemy_repository(True)
     today = datetime.today()
     # This condition exists because there is no schedule every month
     if today.day == 1:
         first_day_current_month = today.replace(day=1)
         last_day_previous_month = first_day_current_month - timedelta(days=1)
-        results = repo.get_results_for_day_month_year("%",
-                                                      last_day_previous_month.month,
-                                                      last_day_previous_month.year)
+        with rp.provide_sqlalchemy_repository(True) as repo:
+            results = repo.get_results_for_day_month_year("%",
+                                                          last_day_previous_month.month,
+                                                          last_day_previous_month.year).all()
         externalnotifier.externally_notify(f"=========={last_day_previous_month.month}/{last_day_previous_month.year}==========")
         for r in results:
             fiat_amount = None
@@ -600,12 +750,11 @@ def notify_results_for_previous_month():
 
 
 def notify_results_for_current_month():
-    repo = rp.provide_sqlalchemy_repository(True)
-
     today = datetime.today()
-    results = repo.get_results_for_day_month_year("%",
-                                                  today.month,
-                                                  today.year)
+    with rp.provide_sqlalchemy_repository(True) as repo:
+        results = repo.get_results_for_day_month_year("%",
+                                                      today.month,
+                                                      today.year).all()
 
     externalnotifier.externally_notify(f"========== Notificación semanal del estado actual del mes ==========")
     for r in results:
@@ -650,7 +799,7 @@ def _update_max_vs_currency_to_use():
     :return:
     """
     previous_max_vs_currency_to_use = config.MAX_VS_CURRENCY_TO_USE
-    total_in_vs_currency = eh.get_total_amount_in_symbol(symbol=config.VS_CURRENCY)
+    total_in_vs_currency = portfolio.equity()
     new_max_vs_currency_to_use = total_in_vs_currency / 7.2 # Can be 7 trades simultaneously. Decimals to take fees into account
 
     new_max_vs_currency_to_use = new_max_vs_currency_to_use if new_max_vs_currency_to_use > 13 else 13 # Minimun of 13 euros due to binance minimum of 10
@@ -682,42 +831,126 @@ def _notify_authentication_error():
 def monthly_update_max_vs_currency_to_use():
     today = datetime.today()
     if today.day == 1:
-        msg_money_start_month = f"{config.VS_CURRENCY} al inicio del mes: {eh.get_total_amount_in_symbol(symbol=config.VS_CURRENCY)} €"
+        # Deposits and withdrawals of the previous month are included
+        portfolio.refresh()
+        msg_money_start_month = f"{config.VS_CURRENCY} al inicio del mes: {portfolio.equity()} €"
         externalnotifier.externally_notify(msg_money_start_month)
         _update_max_vs_currency_to_use()
 
 
+def markets_without_opened_positions(markets):
+    """
+    :param markets: list of (symbol, vs_currency) tuples
+    :return: markets in which there is no opened position
+    """
+    repo = provide_repository()
+    opened_markets = {(op.symbol, op.vs_currency_symbol)
+                      for op in repo.get_opened_positions()}
+
+    return [market for market in markets if market not in opened_markets]
+
+
+def manage_opened_positions():
+    """
+    Moves the stop loss and take profit of every opened position if needed, and
+    closes the positions that reached them
+    """
+    repo = provide_repository()
+    # Exchange requests of exits are served before those of scans
+    with rs.request_priority(rs.Priority.EXIT):
+        # One bulk price request per monitoring tick, shared by every check
+        price_snapshot = price_snapshots.take_snapshot(
+            [(op.symbol, op.vs_currency_symbol) for op in repo.get_opened_positions()]
+        )
+        check_every_opened_trade_for_break_even(price_snapshot=price_snapshot)
+        check_every_opened_trade_for_reduction_in_take_profit(price_snapshot=price_snapshot)
+        close_all_opened_positions()
+
+
+def monitor_opened_positions():
+    """
+    Manages every opened position and runs the pending scheduled jobs
+    """
+    manage_opened_positions()
+    shut_down_bot()
+    schedule.run_pending()
+
+
 def run_bot(simulate):
     reload_exchange_handler()
     cu.initialize_log_file()
     externalnotifier.externally_notify("Bot iniciado")
-    cu.log("Trying to close opened positions")
-    check_every_opened_trade_for_break_even()
-    check_every_opened_trade_for_reduction_in_take_profit()
-    close_all_opened_positions()
+    with repository_tick() as repo:
+        # Opened positions are read once from the database and then kept in memory
+        repo.load_open_position_index()
+        cu.log("Trying to close opened positions")
+        check_every_opened_trade_for_break_even()
+        check_every_opened_trade_for_reduction_in_take_profit()
+        close_all_opened_positions()
     shut_down_bot()
 
     markets = initialize_markets()
+    # Fees, limits and precision of every market in bulk
+    eh.preload_metadata()
 
     # CHANGE STRATEGY HERE
     strat = st.VolumeEmaTradingStrategy()
+    strategy_entry_timeframe = "4h"
+
+    # Evaluations run in the worker thread of the engine, each one in its own tick
+    scan_engine = se.AsyncMarketScanEngine(
+        exchange_handler=eh,
+        evaluate_market=in_repository_tick(
+            partial(compute_strategy_and_try_to_enter,
+                    strategy=strat,
+                    strategy_entry_timeframe=strategy_entry_timeframe,
+                    is_real=not simulate)),
+        timeframe=strategy_entry_timeframe,
+        monitor=in_repository_tick(monitor_opened_positions),
+        candle_source=candle_store,
+    )
+    # Strategy signals only change when a candle closes
+    candle_scheduler = cc.CandleCloseScheduler(exchange_handler=eh,
+                                               timeframe=strategy_entry_timeframe)
+
+    market_feed = start_market_stream(markets,
+                                      kline_timeframes=[strategy_entry_timeframe])
 
     cu.log("Starting main loop")
-    while True:
-        cu.log("========== STARTING NEW ITERATION ========== ")
-        for symbol, vs_currency in markets:
-            compute_strategy_and_try_to_enter(symbol=symbol,
-                                              vs_currency=vs_currency,
-                                              strategy=strat,
-                                              strategy_entry_timeframe="4h",
-                                              is_real=not simulate)
-
-            check_every_opened_trade_for_break_even()
-            check_every_opened_trade_for_reduction_in_take_profit()
-            close_all_opened_positions()
-            shut_down_bot()
-            schedule.run_pending()
-            time.sleep(2)
+    try:
+        while True:
+            try:
+                # Candle evaluated by this scan. If another one closes while
+                # scanning, the markets are still due for it in the next iteration
+                last_closed_candle = candle_scheduler.last_closed_candle()
+                with repository_tick():
+                    # Markets with opened positions are kept due, so that they are
+                    # evaluated as soon as their position is closed
+                    markets_to_scan = candle_scheduler.markets_due(
+                        markets_without_opened_positions(markets))
+
+                if markets_to_scan:
+                    cu.log("========== STARTING NEW ITERATION ========== ")
+                    # Markets skipped due to network errors stay due
+                    candle_scheduler.mark_evaluated(scan_engine.scan(markets_to_scan),
+                                                    candle_open_time_ms=last_closed_candle)
+                    for market, error in scan_engine.network_errors():
+                        cu.log(f"Network error in {market} during scan: {error}")
+                    cu.log(f"Indicator cache: {ic.indicator_cache.stats()}")
+                    cu.log(f"Request scheduler: {eh.request_scheduler.stats()}")
+                    cu.log(f"Dust left by sells: {eh.dust_report.total_by_asset()}")
+
+                with repository_tick():
+                    monitor_opened_positions()
+            except ccxt.errors.NetworkError as e:
+                # Requests were already retried. The next iteration tries again
+                # instead of stopping the monitoring of opened positions
+                cu.log(f"Network error in main loop: {e}. Open circuits: {eh.open_circuits()}")
+
+            time.sleep(config.EXIT_MONITOR_INTERVAL_SECONDS)
+    finally:
+        market_feed.stop()
+        scan_engine.close()
 
 
 if __name__ == "__main__":
@@ -751,12 +984,19 @@ if __name__ == "__main__":
     except ccxt.errors.AuthenticationError:
         _notify_authentication_error()
 
+    restart_policy = rtp.RetryPolicy(max_seconds=config.BOT_RESTART_MAX_SECONDS)
+    restarts = 0
     while True:
+        started_at = time.monotonic()
         try:
             run_bot(simulate=False)
         except (ccxt.errors.RequestTimeout, ccxt.errors.NetworkError):
-            time_to_wait_in_seconds = 900
-            msg = f"ccxt.errors.RequestTimeout raised. Sleeping for {time_to_wait_in_seconds} seconds and trying again"
+            # Only failures at startup reach here. Waits grow while they repeat
+            if time.monotonic() - started_at > config.BOT_RESTART_MAX_SECONDS:
+                restarts = 0
+            time_to_wait_in_seconds = restart_policy.backoff_seconds(restarts)
+            restarts += 1
+            msg = f"ccxt.errors.NetworkError raised. Sleeping for {time_to_wait_in_seconds:.0f} seconds and trying again"
             externalnotifier.externally_notify(msg)
             cu.log(msg)
             time.sleep(time_to_wait_in_seconds)
@@ -1,7 +1,14 @@
 from abc import ABC, abstractmethod
 from dataclasses import dataclass
 
+import numpy as np
+import pandas as pd
+
+import batchindicator as bi
+import incrementalindicator as inc
 import indicator as ind
+import indicatorcache as ic
+import localextrema as le
 
 
 class PositionType:
@@ -24,13 +31,66 @@ def _no_entry_output():
                           position_type=PositionType.LONG)
 
 
+def _indicator(indicator_function, df, market, **params):
+    """
+    Computes an indicator of indicator.py. Results are memoized when the market
+    is known, so that rescans with the same candles do not compute them again
+    """
+    if market is None:
+        return indicator_function(df, **params)
+
+    return ic.indicator_cache.compute(indicator_function, df, market, **params)
+
+
+def _support_and_resistance(market_lows, df, market):
+    """
+    Support and resistance levels. If the market is given, its local minimums are
+    updated incrementally from the previous scan
+    :param market_lows: dict market -> le.MarketLocalExtrema of the strategy
+    """
+    if market is None:
+        return ind.support_and_resistance(df)
+
+    lows = market_lows.setdefault(market, le.MarketLocalExtrema('low', n=2))
+
+    return ind.support_and_resistance(df, lows=lows.update(df))
+
+
+def _previous(values):
+    """
+    :return: array with the value of the previous candle in each position, NaN
+    for the first one
+    """
+    previous = np.empty_like(values, dtype=float)
+    previous[0] = np.nan
+    previous[1:] = values[:-1]
+
+    return previous
+
+
+def _backtest_arrays(df):
+    """
+    :return: high, low, close and volume of df as float arrays
+    """
+    return tuple(df[column].to_numpy(dtype=float) for column in ('high', 'low', 'close', 'volume'))
+
+
+def _atr_low_band(high, low, close, atr_period=12, atr_factor=1.5):
+    """
+    Same values as ind.get_atr_stop_loss(...)['low_band'] on plain arrays
+    """
+    return bi.atr_bands(high[np.newaxis], low[np.newaxis], close[np.newaxis],
+                        atr_period=atr_period, atr_factor=atr_factor)['low_band'][0]
+
+
 class Strategy(ABC):
     @abstractmethod
     def perform_strategy(self, entry_price, **dfs):
         """
         Executes strategy logic
         :param entry_price: position entry_price
-        :param dfs: dataframes to analyse
+        :param dfs: dataframes to analyse. Optionally, market with the (symbol,
+        vs_currency) analysed, so that strategies can keep state per market
         :return: StrategyOutput object
         """
         raise NotImplementedError
@@ -42,6 +102,19 @@ class Strategy(ABC):
         """
         raise NotImplementedError
 
+    def backtest_signals(self, df, window):
+        """
+        Entry signals of perform_strategy for every candle of a history at once.
+        Each candle is evaluated as the unfinished candle of a scan made just before
+        it closes, with the previous window - 1 candles, and its close is the entry
+        price. Indicators with memory (ema, atr) are computed on the whole history,
+        so they can slightly differ from those of a window
+        :param df: candles with the format of an ExchangeHandler, oldest first
+        :param window: number of candles given to perform_strategy in each scan
+        :return: dict of arrays (candles,): can_enter, stop_loss and take_profit
+        """
+        raise NotImplementedError(f"{type(self).__name__} cannot be backtested")
+
 
 class TestStrategy(Strategy):
     """
@@ -88,16 +161,67 @@ class FakeStrategy(Strategy):
 
 
 class SupportAndResistanceHigherTimeframe(Strategy):
+    def __init__(self):
+        # market -> le.MarketLocalExtrema of the higher timeframe lows
+        self._market_lows = {}
+
     def strategy_name(self):
         return "support_and_resistance_higher_timeframe"
 
-    def perform_strategy(self, entry_price, **dfs):
+    def backtest_signals(self, df, window, margin=.002):
+        """
+        See description in parent class. The same candles are used as higher and
+        lower timeframe. Local minimums of the two candles on each side of a window
+        are not taken into account
+        """
+        low, close = df['low'].to_numpy(dtype=float), df['close'].to_numpy(dtype=float)
+        num_candles = len(df)
+
+        # Local minimums confirmed in each scan (two candles after them) within the window
+        lows = ind.get_local_minimums(pd.Series(low), 2)
+        minimums = pd.Series(np.nan, index=np.arange(num_candles))
+        minimums.iloc[lows.index] = lows.to_numpy()
+        minimums = minimums.shift(2).rolling(window - 2, min_periods=1)
+        lowest, highest = minimums.min().to_numpy(), minimums.max().to_numpy()
+
+        # Edges of np.histogram with its default 10 bins
+        equal = lowest == highest
+        lowest, highest = np.where(equal, lowest - .5, lowest), np.where(equal, highest + .5, highest)
+        division = lowest[:, np.newaxis] + \
+            (highest - lowest)[:, np.newaxis] * np.linspace(0, 1, 11)
+        lower_line = division * (1 - margin)
+        upper_line = division * (1 + margin)
+
+        mean_close = df['close'].rolling(window).mean().to_numpy()
+        rows = np.arange(num_candles)
+        # Last level below the mean close is the support, the next one the resistance
+        support = np.clip((lower_line <= mean_close[:, np.newaxis]).sum(axis=1) - 1, 0, 10)
+        has_resistance = support < 10
+        support_low = lower_line[rows, support]
+        support_high = upper_line[rows, support]
+
+        resistance_low = lower_line[rows, np.minimum(support + 1, 10)]
+        previous_difference = np.abs(support_low - lower_line[rows, np.maximum(support - 1, 0)])
+        take_profit = np.where(has_resistance, resistance_low,
+                               support_low + previous_difference)
+        stop_loss = np.where(has_resistance,
+                             support_low - np.abs(resistance_low - support_low) / 2,
+                             support_low - previous_difference / 2)
+
+        with np.errstate(invalid='ignore'):
+            can_enter = (mean_close > lower_line[:, 0]) & (support_low <= close) & \
+                (close <= support_high) & ~np.isnan(lowest)
+        can_enter[:window - 1] = False
+
+        return {'can_enter': can_enter, 'stop_loss': stop_loss, 'take_profit': take_profit}
+
+    def perform_strategy(self, entry_price, market=None, **dfs):
         ht_df = dfs['ht_df']
         lt_df = dfs['lt_df']
 
         mean_close = lt_df['close'].mean()
 
-        sup_and_res_ht = ind.support_and_resistance(ht_df)
+        sup_and_res_ht = _support_and_resistance(self._market_lows, ht_df, market)
         sr_ht_low = sup_and_res_ht['lower_line']
         sr_ht_high = sup_and_res_ht['upper_line']
 
@@ -143,24 +267,28 @@ class SupportAndResistanceHigherTimeframe(Strategy):
 
 
 class SupportAndResistanceHigherTimeframeBullishDivergence(Strategy):
+    def __init__(self):
+        # market -> le.MarketLocalExtrema of the higher timeframe lows
+        self._market_lows = {}
+
     def strategy_name(self):
         return "support_and_resistance_higher_timeframe_bullish_divergence"
 
-    def perform_strategy(self, entry_price, **dfs):
+    def perform_strategy(self, entry_price, market=None, **dfs):
         ht_df = dfs['ht_df']
         lt_df = dfs['lt_df']
 
         mean_close = lt_df['close'].mean()
 
-        sup_and_res_ht = ind.support_and_resistance(ht_df)
+        sup_and_res_ht = _support_and_resistance(self._market_lows, ht_df, market)
         sr_ht_low = sup_and_res_ht['lower_line']
         sr_ht_high = sup_and_res_ht['upper_line']
-        rsi_ht = ind.get_rsi(ht_df)
+        rsi_ht = _indicator(ind.get_rsi, ht_df, market)
         bull_div_ht = ind.get_bullish_divergence(type='h',
                                                  candle_body_low_series=ht_df['candle_body_low'],
                                                  candle_body_high_series=ht_df['candle_body_high'],
                                                  indicator_low_series=rsi_ht)
-        ht_ema = ind.get_ema(ht_df, period=200)
+        ht_ema = _indicator(ind.get_ema, ht_df, market, period=200)
         # Two last candles above higher timeframe ema?
         closes_above_ema = (ht_df['close'] > ht_ema).iloc[-5:].all()
 
@@ -215,8 +343,20 @@ class SupportAndResistanceHigherTimeframeBullishDivergence(Strategy):
 
 
 class VolumeTradingStrategy(Strategy):
+    def __init__(self, volume_quantile=.75, atr_period=12, atr_factor=1.5, rrr=1.5):
+        """
+        :param volume_quantile: quantile of the volume that the last finished candle
+        must exceed
+        :param atr_period: period of the atr of the stop loss
+        :param atr_factor: atr multiplier of the stop loss
+        :param rrr: reward risk ratio of the take profit
+        """
+        self._volume_quantile = volume_quantile
+        self._atr_period = atr_period
+        self._atr_factor = atr_factor
+        self._rrr = rrr
 
-    def perform_strategy(self, entry_price, **dfs):
+    def perform_strategy(self, entry_price, market=None, **dfs):
         """
         The dataframe included needs to include the last candle of the plot (the not finished one)
         :param entry_price:
@@ -231,15 +371,16 @@ class VolumeTradingStrategy(Strategy):
         try:
             # This is inside a try in case indicators cannot be computed due to a lack
             # Of candles
-            quantile = df['volume'].quantile(.75)
-            atr_stop_loss = ind.get_atr_stop_loss(df)['low_band'].iloc[last_finished_candle_index]
+            quantile = df['volume'].quantile(self._volume_quantile)
+            atr_stop_loss = _indicator(ind.get_atr_stop_loss, df, market,
+                                       atr_period=self._atr_period,
+                                       atr_factor=self._atr_factor)['low_band'].iloc[last_finished_candle_index]
             stop_loss = atr_stop_loss
 
         except Exception:
             return _no_entry_output()
 
-        rrr = 1.5
-        take_profit = entry_price + rrr * abs(entry_price - stop_loss)
+        take_profit = entry_price + self._rrr * abs(entry_price - stop_loss)
 
         if df.iloc[last_finished_candle_index]['volume'] > quantile and df.iloc[current_candle_index]['low'] > stop_loss:
             return StrategyOutput(can_enter=True, take_profit=take_profit,
@@ -249,15 +390,79 @@ class VolumeTradingStrategy(Strategy):
 
         return _no_entry_output()
 
+    def backtest_signals(self, df, window):
+        """
+        See description in parent class
+        """
+        high, low, close, volume = _backtest_arrays(df)
+
+        quantile = df['volume'].rolling(window).quantile(self._volume_quantile).to_numpy()
+        stop_loss = _previous(_atr_low_band(high, low, close, atr_period=self._atr_period,
+                                            atr_factor=self._atr_factor))
+        take_profit = close + self._rrr * np.abs(close - stop_loss)
+
+        with np.errstate(invalid='ignore'):
+            can_enter = (_previous(volume) > quantile) & (low > stop_loss)
+        can_enter[:window - 1] = False
+
+        return {'can_enter': can_enter, 'stop_loss': stop_loss, 'take_profit': take_profit}
+
     def strategy_name(self):
         return "volume_trading_strategy"
 
 
 class VolumeEmaTradingStrategy(Strategy):
-    def perform_strategy(self, entry_price, **dfs):
+    def __init__(self, ema_period=50, atr_period=12, atr_factor=1.5, volume_quantile=.80,
+                 rrr=1.5):
+        """
+        :param ema_period: period of the ema that the price must be above
+        :param atr_period: period of the atr of the stop loss
+        :param atr_factor: atr multiplier of the stop loss
+        :param volume_quantile: quantile of the volume of green candles that the
+        last finished candle must reach
+        :param rrr: reward risk ratio of the take profit
+        """
+        self._ema_period = ema_period
+        self._atr_period = atr_period
+        self._atr_factor = atr_factor
+        self._volume_quantile = volume_quantile
+        self._rrr = rrr
+        # market -> inc.MarketIndicatorState, updated with the closed candles of each scan
+        self._market_states = {}
+
+    def _indicators(self):
+        return {
+            'ema': inc.IncrementalEma(period=self._ema_period),
+            'atr_stop_loss': inc.IncrementalAtrStopLoss(atr_period=self._atr_period,
+                                                        atr_factor=self._atr_factor),
+        }
+
+    def _ema_and_stop_loss(self, df, market, last_finished_candle_index):
+        """
+        :return: ema and atr stop loss of the last finished candle. If market is
+        given, they are updated incrementally from the previous scan
+        """
+        if market is None:
+            ema = ind.get_ema(df=df, period=self._ema_period)
+            atr_stop_loss = ind.get_atr_stop_loss(df, atr_period=self._atr_period,
+                                                  atr_factor=self._atr_factor)
+            return ema.iloc[last_finished_candle_index], \
+                atr_stop_loss['low_band'].iloc[last_finished_candle_index]
+
+        state = self._market_states.setdefault(market,
+                                               inc.MarketIndicatorState(self._indicators))
+        indicators = state.update(df.iloc[:last_finished_candle_index + 1])
+        if not indicators['atr_stop_loss'].is_ready:
+            raise ValueError("Not enough candles to compute the atr stop loss")
+
+        return indicators['ema'].value, indicators['atr_stop_loss'].value['low_band']
+
+    def perform_strategy(self, entry_price, market=None, **dfs):
         """
         The dataframe included needs to include the last candle of the plot (the not finished one)
         :param entry_price:
+        :param market: (symbol, vs_currency). If given, indicators are kept
+        between scans of the market instead of being computed again
         :param dfs:
         :return:
         """
@@ -272,21 +477,20 @@ class VolumeEmaTradingStrategy(Strategy):
             # This is inside a try in case indicators cannot be computed due to a lack
             # Of candles
             green_volume_df = df['volume'][df['close'] > df['close'].shift(1)]
-            quantile = green_volume_df.quantile(.80)
-            ema = ind.get_ema(df=df, period=50)
-            atr_stop_loss = ind.get_atr_stop_loss(df)['low_band'].iloc[last_finished_candle_index]
+            quantile = green_volume_df.quantile(self._volume_quantile)
+            last_ema, atr_stop_loss = self._ema_and_stop_loss(df, market,
+                                                              last_finished_candle_index)
             stop_loss = atr_stop_loss
 
         except Exception:
             return _no_entry_output()
 
-        rrr = 1.5
-        take_profit = entry_price + rrr * abs(entry_price - stop_loss)
+        take_profit = entry_price + self._rrr * abs(entry_price - stop_loss)
 
         # Last finished candle is green
         green_volume_candle = (len(df) - 1) in list(green_volume_df.index)
         volume_higher_than_quantile = df['volume'].iloc[last_finished_candle_index] >= quantile
-        price_above_ema = df['close'].iloc[last_finished_candle_index] > ema.iloc[last_finished_candle_index]
+        price_above_ema = df['close'].iloc[last_finished_candle_index] > last_ema
 
         if green_volume_candle and volume_higher_than_quantile and price_above_ema and df.iloc[current_candle_index]['low'] > stop_loss:
             return StrategyOutput(can_enter=True, take_profit=take_profit,
@@ -296,6 +500,61 @@ class VolumeEmaTradingStrategy(Strategy):
 
         return _no_entry_output()
 
+    def perform_strategy_batch(self, entry_prices, dfs):
+        """
+        Same output as perform_strategy (without market), for many markets in a
+        single vectorized pass
+        :param entry_prices: dict (symbol, vs_currency) -> entry price
+        :param dfs: dict (symbol, vs_currency) -> dataframe including the last
+        candle (the not finished one). Markets whose candles are not aligned with
+        the rest are not entered
+        :return: dict (symbol, vs_currency) -> StrategyOutput
+        """
+        batch = bi.stack_candles(dfs)
+        conditions = bi.volume_ema_entry_conditions(
+            batch,
+            entry_prices=np.array([entry_prices[market] for market in batch.markets],
+                                  dtype=float),
+            ema_period=self._ema_period, atr_period=self._atr_period,
+            atr_factor=self._atr_factor, volume_quantile=self._volume_quantile,
+            rrr=self._rrr)
+
+        outputs = {market: _no_entry_output() for market in batch.skipped}
+        for i, market in enumerate(batch.markets):
+            if conditions['can_enter'][i]:
+                outputs[market] = StrategyOutput(can_enter=True,
+                                                 take_profit=float(conditions['take_profit'][i]),
+                                                 stop_loss=float(conditions['stop_loss'][i]),
+                                                 entry_price=entry_prices[market],
+                                                 position_type=PositionType.LONG)
+            else:
+                outputs[market] = _no_entry_output()
+
+        return outputs
+
+    def backtest_signals(self, df, window):
+        """
+        See description in parent class
+        """
+        high, low, close, volume = _backtest_arrays(df)
+
+        is_green = np.zeros(len(df), dtype=bool)
+        is_green[1:] = close[1:] > close[:-1]
+        # The first candle of each window has no previous close, so it is never green
+        quantile = pd.Series(np.where(is_green, volume, np.nan)) \
+            .rolling(window - 1, min_periods=1).quantile(self._volume_quantile).to_numpy()
+        last_ema = _previous(bi.ema(close[np.newaxis], self._ema_period)[0])
+        stop_loss = _previous(_atr_low_band(high, low, close, atr_period=self._atr_period,
+                                            atr_factor=self._atr_factor))
+        take_profit = close + self._rrr * np.abs(close - stop_loss)
+
+        with np.errstate(invalid='ignore'):
+            can_enter = is_green & (_previous(volume) >= quantile) & \
+                (_previous(close) > last_ema) & (low > stop_loss)
+        can_enter[:window - 1] = False
+
+        return {'can_enter': can_enter, 'stop_loss': stop_loss, 'take_profit': take_profit}
+
     def strategy_name(self):
         return "volume_ema_trading_strategy"
 
@@ -1,8 +1,12 @@
 import ccxt
+import numpy as np
+import pandas as pd
 from pycoingecko import CoinGeckoAPI
 import pytest
 from sqlalchemy.orm import Session
 
+import candleclock as cc
+from candleframe import CandleFrame
 import config
 import exchangehandler as eh
 import marketfinder as mf
@@ -97,3 +101,85 @@ def binance_eh():
 @pytest.fixture
 def sqlalchemyrepository_testing(testing_session):
     return repository.provide_sqlalchemy_repository(real_db=False)
+
+
+def synthetic_candles(num_candles, seed=0, timeframe='4h', end='2024-01-01', output='df'):
+    """
+    Seeded random-walk candles. The same arguments always give the same candles
+    :param num_candles: number of candles
+    :param seed: seed of the random walk
+    :param timeframe: timeframe between the candles: 5m, 1h, 4h, ...
+    :param end: open time of the last candle
+    :param output: 'list' of [timestamp, open, high, low, close, volume] as
+    returned by ccxt, 'df' with the format of an ExchangeHandler or 'frame' for a
+    CandleFrame
+    """
+    rng = np.random.default_rng(seed)
+    close = 100 + rng.normal(size=num_candles).cumsum()
+    open_ = np.concatenate([[100], close[:-1]])
+    timestamps = pd.date_range(end=end, periods=num_candles,
+                               freq=pd.Timedelta(cc.timeframe_to_milliseconds(timeframe),
+                                                 'ms')).as_unit('ms').asi8
+    candles = np.column_stack([
+        timestamps, open_,
+        np.maximum(open_, close) + rng.random(num_candles),
+        np.minimum(open_, close) - rng.random(num_candles),
+        close, rng.random(num_candles) * 1000,
+    ])
+
+    if output == 'list':
+        return [[int(candle[0]), *candle[1:]] for candle in candles.tolist()]
+    if output == 'frame':
+        return CandleFrame.from_ohlcv(candles)
+    if output == 'df':
+        return eh.candles_list_to_df(candles.tolist())
+
+    raise ValueError(f"Unknown output {output}")
+
+
+class SyntheticCandlesExchangeHandler(eh.ExchangeHandler):
+    """
+    Offline exchange handler serving seeded random-walk candles up to now_ms.
+    Requests are recorded so that tests can check how many candles are downloaded
+    """
+    def __init__(self, now_ms, timeframe_ms=60 * 60 * 1000, seed=0):
+        super().__init__(exchange_api=None)
+        self.now_ms = now_ms
+        self.timeframe_ms = timeframe_ms
+        self.requests = []
+        self._seed = seed
+
+    def _candle(self, open_time):
+        rng = np.random.default_rng(self._seed + open_time // self.timeframe_ms)
+        open_, close = 100 + rng.random(2) * 10
+        return [open_time, open_, max(open_, close) + 1, min(open_, close) - 1,
+                close, rng.random() * 1000]
+
+    def get_candles_last_one_not_finished(self, symbol, vs_currency, timeframe,
+                                         num_candles, since=None):
+        self.requests.append({'num_candles': num_candles, 'since': since})
+        last_open_time = self.now_ms // self.timeframe_ms * self.timeframe_ms
+
+        if since is None:
+            since = last_open_time - (num_candles - 1) * self.timeframe_ms
+
+        open_times = range(since, last_open_time + 1, self.timeframe_ms)
+        candles = [self._candle(open_time) for open_time in open_times][:num_candles]
+
+        return eh.candles_list_to_df(candles)
+
+    def get_candles_for_strategy(self, symbol, vs_currency, timeframe, num_candles, since=None):
+        return self.get_candles_last_one_not_finished(symbol, vs_currency, timeframe,
+                                                      num_candles, since).iloc[:-1]
+
+    def get_current_price(self, symbol, vs_currency):
+        return self._candle(self.now_ms // self.timeframe_ms * self.timeframe_ms)[4]
+
+    def buy_market_order(self, symbol, vs_currency, amount): raise NotImplementedError
+    def _sell_market_order(self, symbol, vs_currency, amount): raise NotImplementedError
+    def sell_market_order_diminishing_amount(self, symbol, vs_currency, amount): raise NotImplementedError
+    def fetch_market(self, symbol, vs_currency): raise NotImplementedError
+    def get_fee_factor(self, symbol, vs_currency, type='spot'): raise NotImplementedError
+    def _market_from_symbol_and_vs_currency(self, symbol, vs_currency): return f"{symbol}/{vs_currency}"
+    def get_free_balance(self, symbol): raise NotImplementedError
+    def withdraw_fiat_to_bank_account(self, fiat_symbol, fiat_quantity, swift): raise NotImplementedError
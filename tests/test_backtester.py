@@ -0,0 +1,156 @@
+import numpy as np
+import pytest
+
+from commonfixtures import synthetic_candles
+import backtester as bt
+import config
+import model
+import services
+import strategy as st
+
+
+class FixedFeeExchangeHandler:
+    def __init__(self, fee_factor):
+        self._fee_factor = fee_factor
+
+    def get_fee_factor(self, symbol, vs_currency, type='spot'):
+        return {'maker': self._fee_factor, 'taker': self._fee_factor}
+
+
+def loop_first_exit(high, low, entry_index, take_profit, stop_loss):
+    for i in range(entry_index + 1, len(high)):
+        if high[i] >= take_profit:
+            return i, True
+        if low[i] <= stop_loss:
+            return i, False
+    return -1, False
+
+
+def test_real_rrr_take_profit_is_the_one_of_position_can_be_profitable(monkeypatch):
+    # position_can_be_profitable logs its computations
+    monkeypatch.setattr(services.cu, 'log', lambda msg: None)
+    rng = np.random.default_rng(0)
+    entry_price = 100 + rng.random(200) * 10
+    stop_loss = entry_price * (1 - rng.random(200) * .05)
+    take_profit = entry_price + rng.random(200) * 3 * (entry_price - stop_loss)
+
+    new_take_profit, can_be_profitable = bt.real_rrr_take_profit(entry_price, stop_loss,
+                                                                 take_profit, .001)
+
+    for i in range(200):
+        st_out = st.StrategyOutput(can_enter=True, take_profit=take_profit[i],
+                                   stop_loss=stop_loss[i], entry_price=entry_price[i],
+                                   position_type=st.PositionType.LONG)
+        expected = services.position_can_be_profitable(
+            FixedFeeExchangeHandler(.001), st_out, 'BTC', 'USDT', amount=1.,
+            update_st_out_to_get_real_rrr=True)
+        assert can_be_profitable[i] == expected
+        assert new_take_profit[i] == pytest.approx(st_out.take_profit)
+
+
+def test_vs_currency_on_entry_is_the_one_of_manage_risk_on_entry():
+    entry_price = np.array([10., 10., 10.])
+    stop_loss = np.array([9.9, 7., 9.])
+
+    vs_currency = bt.vs_currency_on_entry(entry_price, stop_loss, 200, 150)
+
+    for i in range(3):
+        st_out = st.StrategyOutput(can_enter=True, take_profit=11, stop_loss=stop_loss[i],
+                                   entry_price=entry_price[i], position_type=st.PositionType.LONG)
+        assert vs_currency[i] == pytest.approx(services.manage_risk_on_entry(200, st_out, 150))
+
+
+@pytest.mark.parametrize('scan_candles', [4, bt.EXIT_SCAN_CANDLES])
+def test_first_exits_are_the_first_candles_reaching_take_profit_or_stop_loss(monkeypatch,
+                                                                            scan_candles):
+    monkeypatch.setattr(bt, 'EXIT_SCAN_CANDLES', scan_candles)
+    df = synthetic_candles(1000, seed=1)
+    high, low, close = (df[column].to_numpy() for column in ('high', 'low', 'close'))
+    entry_indexes = np.arange(0, 1000, 7)
+    take_profit = close[entry_indexes] * 1.03
+    stop_loss = close[entry_indexes] * .97
+    # Never reached
+    take_profit[-3:] = np.inf
+    stop_loss[-3:] = -np.inf
+
+    exit_indexes, is_take_profit = bt.first_exits(high, low, entry_indexes, take_profit,
+                                                  stop_loss)
+
+    for i, entry_index in enumerate(entry_indexes):
+        assert (exit_indexes[i], is_take_profit[i]) == \
+            loop_first_exit(high, low, entry_index, take_profit[i], stop_loss[i])
+    assert (exit_indexes[-3:] == -1).all()
+
+
+@pytest.mark.parametrize('strategy', [
+    st.VolumeEmaTradingStrategy(), st.VolumeTradingStrategy(),
+    st.SupportAndResistanceHigherTimeframe(),
+    st.VolumeEmaTradingStrategy(ema_period=30, atr_period=8, atr_factor=2.,
+                                volume_quantile=.7, rrr=2.),
+    st.VolumeTradingStrategy(volume_quantile=.6, atr_period=20, atr_factor=1., rrr=3.),
+])
+def test_backtest_signals_match_perform_strategy(strategy):
+    df = synthetic_candles(1500, seed=3)
+    window = 200
+    signals = strategy.backtest_signals(df, window)
+    agreements = 0
+    scans = range(window - 1, len(df), 3)
+
+    for i in scans:
+        window_df = df.iloc[i - window + 1:i + 1].reset_index(drop=True)
+        entry_price = float(df['close'].iloc[i])
+        if isinstance(strategy, st.SupportAndResistanceHigherTimeframe):
+            expected = strategy.perform_strategy(entry_price, ht_df=window_df, lt_df=window_df)
+        else:
+            expected = strategy.perform_strategy(entry_price, df=window_df)
+
+        agreements += expected.can_enter == signals['can_enter'][i]
+        if expected.can_enter and signals['can_enter'][i]:
+            assert signals['stop_loss'][i] == pytest.approx(expected.stop_loss, rel=1e-3)
+            assert signals['take_profit'][i] == pytest.approx(expected.take_profit, rel=1e-3)
+
+    # Indicators of the whole history and local minimums at the window edges
+    # can differ from those of each window
+    assert agreements >= .99 * len(scans)
+    assert signals['can_enter'].any()
+
+
+def test_backtester_enters_one_position_at_a_time_with_bot_amounts():
+    dfs = {(f"M{seed}", 'USDT'): synthetic_candles(3000, seed=seed) for seed in range(3)}
+    backtester = bt.VectorizedBacktester(st.VolumeEmaTradingStrategy(), timeframe='4h',
+                                         fee_factor=.001, vs_currency_available=100,
+                                         max_vs_currency_to_use=100)
+
+    trades = backtester.run(dfs)
+
+    assert len(trades) > 0
+    assert list(trades.columns) == bt.TRADE_COLUMNS
+    for _, market_trades in trades.groupby(['symbol', 'vs_currency_symbol']):
+        closed = market_trades[market_trades['exit_index'] >= 0]
+        # Next entry not before the previous exit
+        assert (market_trades['entry_index'].iloc[1:].to_numpy() >=
+                closed['exit_index'].iloc[:len(market_trades) - 1].to_numpy()).all()
+
+    closed = trades[trades['status'] != model.TradeStatus.OPENED]
+    assert ((closed['result'] > 0) == (closed['status'] == model.TradeStatus.WON)).all()
+    assert (trades['vs_currency_entry'] <= 100).all()
+
+
+def test_backtester_trades_can_be_converted_to_trade_objects():
+    backtester = bt.VectorizedBacktester(st.VolumeEmaTradingStrategy(), timeframe='4h',
+                                         fee_factor=.001)
+    trades = backtester.run({('BTC', 'USDT'): synthetic_candles(3000, seed=0)})
+
+    trade_objects = bt.to_trades(trades)
+
+    assert len(trade_objects) == len(trades)
+    assert all(isinstance(trade, model.Trade) for trade in trade_objects)
+    assert trade_objects[0].strategy_name == "volume_ema_trading_strategy"
+    assert trade_objects[0].vs_currency_entry <= config.MAX_VS_CURRENCY_TO_USE
+
+
+def test_backtester_raises_exception_for_strategies_without_backtest_signals():
+    backtester = bt.VectorizedBacktester(st.FakeStrategy(), timeframe='4h', fee_factor=.001)
+
+    with pytest.raises(NotImplementedError):
+        backtester.run({('BTC', 'USDT'): synthetic_candles(300, seed=0)})
@@ -0,0 +1,74 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from commonfixtures import synthetic_candles
+import batchindicator as bi
+import indicator as ind
+import strategy as st
+
+
+@pytest.fixture
+def dfs():
+    return {(f"M{seed}", 'USDT'): synthetic_candles(200, seed) for seed in range(40)}
+
+
+def test_indicators_match_per_market_results(dfs):
+    batch = bi.stack_candles(dfs)
+
+    ema = bi.ema(batch.close, period=50)
+    bands = bi.atr_bands(batch.high, batch.low, batch.close, atr_period=12)
+    quantiles = bi.green_volume_quantile(batch.close, batch.volume, .8)
+
+    for i, market in enumerate(batch.markets):
+        df = dfs[market]
+        np.testing.assert_allclose(ema[i], ind.get_ema(df, period=50), rtol=1e-12)
+        np.testing.assert_allclose(bands['low_band'][i],
+                                   ind.get_atr_stop_loss(df, atr_period=12)['low_band'],
+                                   rtol=1e-12)
+        green_volume = df['volume'][df['close'] > df['close'].shift(1)]
+        assert quantiles[i] == pytest.approx(green_volume.quantile(.8))
+
+
+def test_strategy_batch_matches_per_market_strategy(dfs):
+    strategy = st.VolumeEmaTradingStrategy()
+    entry_prices = {market: df['close'].iloc[-1] for market, df in dfs.items()}
+    # Not aligned with the other markets
+    dfs[('LATE', 'USDT')] = synthetic_candles(200, 99, end='2023-12-31')
+    entry_prices[('LATE', 'USDT')] = 100
+
+    outputs = strategy.perform_strategy_batch(entry_prices, dfs)
+
+    assert outputs[('LATE', 'USDT')].can_enter is False
+    assert any(output.can_enter for output in outputs.values())
+    for market, df in dfs.items():
+        if market == ('LATE', 'USDT'):
+            continue
+        expected = strategy.perform_strategy(entry_price=entry_prices[market], df=df)
+        assert outputs[market].can_enter == expected.can_enter
+        assert outputs[market].stop_loss == pytest.approx(expected.stop_loss)
+        assert outputs[market].take_profit == pytest.approx(expected.take_profit)
+
+
+def test_stack_candles_skips_markets_without_enough_candles(dfs):
+    dfs[('SHORT', 'USDT')] = synthetic_candles(10, 1)
+
+    batch = bi.stack_candles(dfs, num_candles=150)
+
+    assert batch.close.shape == (40, 150)
+    assert batch.skipped == [('SHORT', 'USDT')]
+
+
+def test_green_volume_quantile_with_few_green_candles():
+    close = np.array([[5., 4, 3, 2, 1],  # No green candles
+                      [1, 2, 1, 1, 1],  # One green candle
+                      [1, 2, 3, 2, 4]])
+    volume = np.array([[1., 2, 3, 4, 5]] * 3)
+
+    quantiles = bi.green_volume_quantile(close, volume, .8)
+
+    assert np.isnan(quantiles[0])
+    for i in [1, 2]:
+        close_series, volume_series = pd.Series(close[i]), pd.Series(volume[i])
+        expected = volume_series[close_series > close_series.shift(1)].quantile(.8)
+        assert quantiles[i] == pytest.approx(expected)
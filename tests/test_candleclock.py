@@ -0,0 +1,67 @@
+import pytest
+
+import candleclock as cc
+
+
+class FixedServerTimeExchangeHandler:
+    def __init__(self, server_time):
+        self.server_time = server_time
+        self.server_time_requests = 0
+
+    def get_server_time(self):
+        self.server_time_requests += 1
+        return self.server_time
+
+
+def test_timeframe_is_converted_to_milliseconds():
+    assert cc.timeframe_to_milliseconds('1m') == 60 * 1000
+    assert cc.timeframe_to_milliseconds('4h') == 4 * 60 * 60 * 1000
+    assert cc.timeframe_to_milliseconds('1d') == 24 * 60 * 60 * 1000
+
+    with pytest.raises(ValueError):
+        cc.timeframe_to_milliseconds('1M')
+
+
+def test_candle_boundaries_are_aligned_to_timeframe():
+    hour = 60 * 60 * 1000
+    timestamp = 10 * hour + 123
+
+    assert cc.candle_open_time('4h', timestamp) == 8 * hour
+    assert cc.last_closed_candle_open_time('4h', timestamp) == 4 * hour
+    assert cc.next_candle_close_time('4h', timestamp) == 12 * hour
+
+
+def test_weekly_candles_open_on_monday():
+    # 2023-01-04 (Wednesday) 00:00:00 UTC -> week opened 2023-01-02 (Monday)
+    wednesday = 1672790400000
+    monday = 1672617600000
+
+    assert cc.candle_open_time('1w', wednesday) == monday
+
+
+def test_scheduler_evaluates_markets_once_per_closed_candle():
+    scheduler = cc.CandleCloseScheduler(
+        exchange_handler=FixedServerTimeExchangeHandler(0),
+        timeframe='4h', close_grace_seconds=0)
+    markets = [('BTC', 'USDT'), ('ETH', 'USDT')]
+
+    assert scheduler.markets_due(markets) == markets
+
+    scheduler.mark_evaluated([('BTC', 'USDT')])
+    assert scheduler.markets_due(markets) == [('ETH', 'USDT')]
+
+    scheduler.mark_evaluated(markets, scheduler.last_closed_candle() - 1)
+    assert scheduler.markets_due(markets) == markets
+
+
+def test_scheduler_uses_exchange_server_time():
+    four_hours = 4 * 60 * 60 * 1000
+    # Server clock far away from local clock
+    handler = FixedServerTimeExchangeHandler(3 * four_hours + 1000)
+    scheduler = cc.CandleCloseScheduler(exchange_handler=handler,
+                                        timeframe='4h', close_grace_seconds=0)
+
+    assert scheduler.last_closed_candle() == 2 * four_hours
+    assert 0 < scheduler.seconds_until_next_close() <= four_hours / 1000
+    # Server time is not requested on every call
+    assert handler.server_time_requests == 1
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from candleframe import CandleFrame
+from commonfixtures import synthetic_candles
+
+
+def dataframe_candles(candles_list):
+    """
+    DataFrame built column by column, as exchangehandler.candles_list_to_df did
+    """
+    candles_df = pd.DataFrame(candles_list, columns=['datetime', 'open', 'high', 'low',
+                                                     'close', 'volume'])
+    candles_df['datetime'] = pd.to_datetime(candles_df['datetime'], unit='ms')
+    candles_df['is_green'] = candles_df['open'] < candles_df['close']
+    candles_df['is_red'] = candles_df['open'] > candles_df['close']
+    candles_df['candle_body_low'] = np.where(candles_df['is_green'], candles_df['open'],
+                                             candles_df['close'])
+    candles_df['candle_body_high'] = np.where(candles_df['is_green'], candles_df['close'],
+                                              candles_df['open'])
+
+    return candles_df
+
+
+def test_candle_frame_provides_the_same_dataframe_as_before():
+    candles_list = synthetic_candles(300, timeframe='1h', output='list')
+
+    pd.testing.assert_frame_equal(CandleFrame.from_ohlcv(candles_list).to_df(),
+                                  dataframe_candles(candles_list))
+
+
+def test_candle_frame_of_no_candles_provides_empty_dataframe():
+    df = CandleFrame.from_ohlcv([]).to_df()
+
+    assert len(df) == 0
+    assert list(df.columns) == list(dataframe_candles([]).columns)
+
+
+def test_candle_frame_slices_without_copying():
+    frame = CandleFrame.from_ohlcv(synthetic_candles(100, timeframe='1h', output='list'))
+    closed = frame.closed()
+
+    assert len(closed) == 99
+    assert np.shares_memory(closed.close, frame.close)
+    assert np.shares_memory(closed.timestamp, frame.timestamp)
+    assert closed.datetime[-1] == frame.datetime[-2]
+
+
+def test_candle_frame_computes_derived_columns_on_first_access():
+    frame = CandleFrame.from_ohlcv(synthetic_candles(100, timeframe='1h', output='list'))
+    nbytes = frame.nbytes
+
+    body_low = frame.candle_body_low
+
+    assert frame.nbytes > nbytes
+    assert frame.candle_body_low is body_low
+    assert np.shares_memory(frame[10:20].candle_body_low, body_low)
+
+
+def test_candle_frame_dataframe_shares_memory_and_is_read_only():
+    frame = CandleFrame.from_ohlcv(synthetic_candles(100, timeframe='1h', output='list'))
+    df = frame.to_df(copy=False)
+
+    assert np.shares_memory(df['close'].to_numpy(), frame.close)
+    with pytest.raises(ValueError):
+        df.loc[0, 'close'] = 0.
+
+
+def test_candle_frame_dataframe_is_writable_by_default():
+    frame = CandleFrame.from_ohlcv(synthetic_candles(100, timeframe='1h', output='list'))
+    df = frame.to_df()
+
+    df.loc[0, 'close'] = 99.
+
+    assert df.loc[0, 'close'] == 99.
+    assert frame.close[0] != 99.
+
+
+def test_candle_frame_round_trips_dataframe():
+    candles_list = synthetic_candles(100, timeframe='1h', output='list')
+    frame = CandleFrame.from_df(dataframe_candles(candles_list))
+
+    np.testing.assert_array_equal(frame.ohlcv(), np.array(candles_list))
+
+
+def test_float32_candle_frame_uses_less_than_half_the_memory_of_dataframe():
+    candles_list = synthetic_candles(1000, timeframe='1h', output='list')
+    df_bytes = dataframe_candles(candles_list).memory_usage(index=True, deep=True).sum()
+    frame = CandleFrame.from_ohlcv(candles_list, dtype=np.float32)
+
+    assert frame.nbytes * 2 < df_bytes
+    np.testing.assert_allclose(frame.close, np.array(candles_list)[:, 4], rtol=1e-6)
+
+
+def test_candle_frame_concatenates_frames():
+    candles_list = synthetic_candles(100, timeframe='1h', output='list')
+    frame = CandleFrame.from_ohlcv(candles_list)
+
+    concatenated = CandleFrame.concat([frame[:40], frame[40:]])
+
+    np.testing.assert_array_equal(concatenated.ohlcv(), frame.ohlcv())
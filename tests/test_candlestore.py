@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+from sqlalchemy import create_engine
+
+from commonfixtures import SyntheticCandlesExchangeHandler
+import candlestore as cs
+
+
+hour = 60 * 60 * 1000
+start = 1_700_000_000_000 // hour * hour
+
+
+@pytest.fixture
+def candle_db_engine():
+    db_engine = create_engine("sqlite+pysqlite:///:memory:", future=True)
+    cs.metadata.create_all(db_engine)
+    return db_engine
+
+
+def test_candle_store_downloads_only_new_candles(candle_db_engine):
+    handler = SyntheticCandlesExchangeHandler(now_ms=start + hour // 2)
+    store = cs.CandleStore(exchange_handler=handler, db_engine=candle_db_engine,
+                           clock=lambda: handler.now_ms)
+
+    first = store.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 200)
+    assert handler.requests[-1] == {'num_candles': 200, 'since': None}
+
+    handler.now_ms += 3 * hour
+    second = store.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 200)
+
+    # Last stored candle (unfinished when stored) and the new ones
+    assert handler.requests[-1]['since'] == int(first['datetime'].iloc[-1].timestamp() * 1000)
+    assert handler.requests[-1]['num_candles'] < 10
+    assert len(second) == 200
+    assert (second['datetime'].diff().iloc[1:] == second['datetime'].diff().iloc[1]).all()
+
+
+def test_candle_store_serves_same_candles_as_exchange(candle_db_engine):
+    handler = SyntheticCandlesExchangeHandler(now_ms=start + hour // 2)
+    store = cs.CandleStore(exchange_handler=handler, db_engine=candle_db_engine,
+                           clock=lambda: handler.now_ms)
+    store.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 50)
+
+    handler.now_ms += 5 * hour
+    from_store = store.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 50)
+    from_exchange = handler.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 50)
+
+    assert from_store.equals(from_exchange)
+
+
+def test_candle_store_persists_candles_between_instances(candle_db_engine):
+    handler = SyntheticCandlesExchangeHandler(now_ms=start + hour // 2)
+    cs.CandleStore(exchange_handler=handler,
+                   db_engine=candle_db_engine,
+                           clock=lambda: handler.now_ms).get_candles_last_one_not_finished('BTC', 'USDT', '1h', 100)
+
+    new_store = cs.CandleStore(exchange_handler=handler, db_engine=candle_db_engine,
+                           clock=lambda: handler.now_ms)
+    new_store.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 100)
+
+    assert handler.requests[-1]['since'] is not None
+    assert len(new_store.get_stored_candles('BTC', 'USDT', '1h')) == 100
+
+
+def test_candle_store_serves_closed_history_from_disk(candle_db_engine):
+    handler = SyntheticCandlesExchangeHandler(now_ms=start + hour // 2)
+    store = cs.CandleStore(exchange_handler=handler, db_engine=candle_db_engine,
+                           clock=lambda: handler.now_ms)
+    store.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 100)
+    total_requests = len(handler.requests)
+
+    candles = store.get_candles_since('BTC', 'USDT', '1h', num_candles=20,
+                                      since=start - 50 * hour)
+
+    assert len(candles) == 20
+    assert len(handler.requests) == total_requests
+
+
+def test_candle_store_keeps_float32_in_memory_and_persists_full_precision(candle_db_engine):
+    handler = SyntheticCandlesExchangeHandler(now_ms=start + hour // 2)
+    store = cs.CandleStore(exchange_handler=handler, db_engine=candle_db_engine,
+                           clock=lambda: handler.now_ms, dtype=np.float32)
+
+    candles = store.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 50)
+    from_exchange = handler.get_candles_last_one_not_finished('BTC', 'USDT', '1h', 50)
+
+    assert candles['close'].dtype == np.float32
+    assert store.get_stored_candles('BTC', 'USDT', '1h').equals(from_exchange)
@@ -142,3 +142,155 @@ def test_binance_ccxt_exchange_handler_gets_current_price(binance_eh_no_keys):
     price = binance_eh_no_keys.get_current_price("BTC", "EUR")
 
     assert type(price) is float
+
+
+class MetadataCountingExchange(ccxt.Exchange):
+    """
+    Offline ccxt exchange that counts metadata requests
+    """
+    def __init__(self):
+        super().__init__()
+        self.load_markets_calls = 0
+        self.fetch_trading_fee_calls = 0
+        self.fetch_trading_fees_calls = 0
+
+    def load_markets(self, reload=False, params={}):
+        self.load_markets_calls += 1
+        market = {
+            'id': 'BTCEUR', 'symbol': 'BTC/EUR', 'base': 'BTC', 'quote': 'EUR',
+            'spot': True, 'precision': {'amount': 0.001, 'price': 0.01},
+            'limits': {'cost': {'min': 5, 'max': None}, 'price': {'max': 1000000},
+                       'amount': {'min': 0.001, 'max': 9000}},
+            'info': {'orderTypes': ['MARKET'], 'ocoAllowed': True},
+        }
+        self.precisionMode = ccxt.TICK_SIZE
+        self.set_markets([market])
+        return self.markets
+
+    def fetch_trading_fee(self, symbol, params={}):
+        self.fetch_trading_fee_calls += 1
+        return {'symbol': symbol, 'maker': .001, 'taker': .001}
+
+    def fetch_trading_fees(self, params={}):
+        self.fetch_trading_fees_calls += 1
+        return {'BTC/EUR': {'symbol': 'BTC/EUR', 'maker': .001, 'taker': .001}}
+
+
+def test_ccxt_exchange_handler_scans_market_without_metadata_requests_after_preload():
+    exchange = MetadataCountingExchange()
+    handler = eh.CcxtExchangeHandler(exchange_api=exchange)
+    handler.preload_metadata()
+
+    for _ in range(5):
+        handler.get_fee_factor('BTC', 'EUR')
+        handler.fetch_market('BTC', 'EUR')
+        handler._amount_to_precision('BTC', 'EUR', 1.23456789)
+
+    assert exchange.load_markets_calls == 1
+    assert exchange.fetch_trading_fees_calls == 1
+    assert exchange.fetch_trading_fee_calls == 0
+    assert handler._amount_to_precision('BTC', 'EUR', 1.23456789) == 1.234
+
+
+def test_ccxt_exchange_handler_refreshes_expired_or_invalidated_metadata():
+    exchange = MetadataCountingExchange()
+    handler = eh.CcxtExchangeHandler(exchange_api=exchange, fee_ttl_seconds=0)
+
+    handler.get_fee_factor('BTC', 'EUR')
+    handler.get_fee_factor('BTC', 'EUR')
+    assert exchange.fetch_trading_fee_calls == 2
+
+    handler.fetch_market('BTC', 'EUR')
+    handler.invalidate_metadata()
+    handler.fetch_market('BTC', 'EUR')
+    assert exchange.load_markets_calls == 2
+
+
+class BalanceExchange(MetadataCountingExchange):
+    """
+    Offline exchange holding BTC, EUR and an asset without market against EUR
+    """
+    def __init__(self):
+        super().__init__()
+        self.requested_tickers = []
+
+    def fetch_balance(self, params={}):
+        return {'total': {'BTC': .5, 'EUR': 100., 'ETH': 0., 'DUST': 3.}}
+
+    def fetch_tickers(self, symbols=None, params={}):
+        self.requested_tickers.append(symbols)
+        return {'BTC/EUR': {'symbol': 'BTC/EUR', 'last': 30000.}}
+
+
+def test_ccxt_exchange_handler_only_prices_held_assets():
+    exchange = BalanceExchange()
+    handler = eh.CcxtExchangeHandler(exchange_api=exchange)
+
+    assert handler.get_total_balances() == {'BTC': .5, 'EUR': 100., 'DUST': 3.}
+    assert handler.get_total_amount_in_symbol('EUR') == 100. + .5 * 30000.
+    assert exchange.requested_tickers == [['BTC/EUR']]
+    # The amount is in config.VS_CURRENCY by default
+    assert handler.get_total_amount_in_symbol() == \
+        handler.get_total_amount_in_symbol(config.VS_CURRENCY)
+
+
+class SellingExchange(MetadataCountingExchange):
+    """
+    Offline exchange that rejects sells of more than the free balance
+    """
+    def __init__(self, free_btc):
+        super().__init__()
+        self.free_btc = free_btc
+        self.sold_amounts = []
+
+    def fetch_free_balance(self, params={}):
+        return {'BTC': self.free_btc}
+
+    def create_order(self, symbol, type, side, amount, price=None, params={}):
+        self.sold_amounts.append(amount)
+        if amount > self.free_btc:
+            raise ccxt.InsufficientFunds("Account has insufficient balance")
+        self.free_btc -= amount
+        return {'id': '1', 'timestamp': 0, 'price': 30000., 'amount': amount,
+                'cost': amount * 30000., 'fee': {'cost': amount * 30000. * .001}}
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None, params={}):
+        return [[0, 30000., 30000., 30000., 30000., 1.]]
+
+
+def test_ccxt_exchange_handler_sells_the_sellable_amount_in_one_order():
+    # The position bought .125 BTC, but part of it was paid as fee
+    exchange = SellingExchange(free_btc=.1248765)
+    handler = eh.CcxtExchangeHandler(exchange_api=exchange)
+
+    order = handler.sell_market_order_diminishing_amount('BTC', 'EUR', amount=.125)
+
+    assert exchange.sold_amounts == [.124]
+    assert order['amount'] == .124
+    dust, = handler.dust_report.records()
+    assert dust.requested_amount == .125
+    assert dust.dust_amount == pytest.approx(.0008765)
+    assert dust.dust_value == pytest.approx(.0008765 * 30000.)
+    assert handler.dust_report.total_by_asset()[('BTC', 'EUR')][0] == pytest.approx(.0008765)
+
+
+def test_ccxt_exchange_handler_does_not_sell_below_amount_precision():
+    exchange = SellingExchange(free_btc=.0004)
+    handler = eh.CcxtExchangeHandler(exchange_api=exchange)
+
+    assert handler.sell_market_order_diminishing_amount('BTC', 'EUR', amount=.001) is None
+    assert exchange.sold_amounts == []
+    assert handler.sellable_amount('BTC', 'EUR', amount=.001) == 0
+    # The whole position is dust
+    dust, = handler.dust_report.records()
+    assert dust.sold_amount == 0
+    assert dust.dust_amount == .0004
+    assert dust.dust_value == pytest.approx(.0004 * 30000.)
+
+
+def test_candles_of_exchange_handler_are_writable():
+    df = eh.candles_list_to_df([[0, 1., 2., .5, 1.5, 10.], [60000, 1.5, 2., 1., 1., 5.]])
+
+    df.loc[0, 'close'] = 99.
+
+    assert df.loc[0, 'close'] == 99.
@@ -0,0 +1,95 @@
+import ccxt
+import pytest
+
+from commonfixtures import SyntheticCandlesExchangeHandler, create_trade
+import exitevaluator as ex_ev
+
+
+minute = 60 * 1000
+start = 1_700_000_000_000 // minute * minute
+
+
+class MarketExchangeHandler(SyntheticCandlesExchangeHandler):
+    def __init__(self, now_ms):
+        super().__init__(now_ms=now_ms, timeframe_ms=minute)
+
+    def fetch_market(self, symbol, vs_currency):
+        return {'min_vs_currency': 0}
+
+
+def opened_trade(trade_id, stop_loss=1, take_profit=1000):
+    trade = create_trade(symbol='BTC', vs_currency_symbol='USDT',
+                         stop_loss=stop_loss, take_profit=take_profit)
+    trade.id = trade_id
+    return trade
+
+
+def test_exit_priority_rules():
+    trade = opened_trade(1, stop_loss=90, take_profit=110)
+
+    assert ex_ev.decide_exit(trade, high=111, low=89, min_vs_currency_to_enter_market=0).reason == ex_ev.ExitReason.TAKE_PROFIT
+    assert ex_ev.decide_exit(trade, high=100, low=89, min_vs_currency_to_enter_market=0).reason == ex_ev.ExitReason.STOP_LOSS
+    assert ex_ev.decide_exit(trade, high=100, low=95, min_vs_currency_to_enter_market=0) is None
+
+    decision = ex_ev.decide_exit(trade, high=100, low=95.1, min_vs_currency_to_enter_market=95)
+    assert decision.reason == ex_ev.ExitReason.MIN_NOTIONAL
+    assert decision.exit_price == 95.1
+
+
+def test_modified_levels_are_used():
+    trade = opened_trade(1, stop_loss=90, take_profit=110)
+    trade.modified_take_profit = 105
+
+    decision = ex_ev.decide_exit(trade, high=106, low=100, min_vs_currency_to_enter_market=0)
+    assert decision.exit_price == 105
+
+
+def test_evaluator_makes_one_candle_request_per_position():
+    handler = MarketExchangeHandler(now_ms=start)
+    evaluator = ex_ev.PositionExitEvaluator(exchange_handler=handler,
+                                            clock=lambda: handler.now_ms)
+
+    evaluator.evaluate([opened_trade(1), opened_trade(2), opened_trade(3)])
+
+    assert len(handler.requests) == 3
+
+
+def test_evaluator_covers_every_candle_since_last_check():
+    handler = MarketExchangeHandler(now_ms=start)
+    evaluator = ex_ev.PositionExitEvaluator(exchange_handler=handler,
+                                            clock=lambda: handler.now_ms)
+    trade = opened_trade(1)
+    evaluator.evaluate_trade(trade)
+
+    handler.now_ms += 10 * minute
+    interval_candles = handler.get_candles_last_one_not_finished('BTC', 'USDT', '1m', 11,
+                                                                 since=start)
+    # Place take profit at the highest wick of the interval
+    trade.take_profit = interval_candles['high'].max()
+    decision = evaluator.evaluate_trade(trade)
+
+    assert handler.requests[-2]['since'] == start
+    assert decision is not None
+    assert decision.reason == ex_ev.ExitReason.TAKE_PROFIT
+    assert decision.low == interval_candles['low'].min()
+
+
+class UnreachableMarketExchangeHandler(MarketExchangeHandler):
+    def get_candle_frame_last_one_not_finished(self, symbol, vs_currency, timeframe,
+                                               num_candles, since=None, dtype=None):
+        if symbol == 'ETH':
+            raise ccxt.RequestTimeout("ETH timed out")
+        return super().get_candle_frame_last_one_not_finished(symbol, vs_currency, timeframe,
+                                                              num_candles, since=since)
+
+
+def test_evaluator_skips_positions_with_network_errors():
+    handler = UnreachableMarketExchangeHandler(now_ms=start)
+    evaluator = ex_ev.PositionExitEvaluator(exchange_handler=handler,
+                                            clock=lambda: handler.now_ms)
+    unreachable = opened_trade(2)
+    unreachable.symbol = 'ETH'
+
+    decisions = evaluator.evaluate([opened_trade(1, take_profit=1), unreachable])
+
+    assert [decision.trade.id for decision in decisions] == [1]
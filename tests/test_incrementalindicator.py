@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from commonfixtures import synthetic_candles
+import incrementalindicator as inc
+import indicator as ind
+import strategy as st
+
+
+def assert_same_values(values, expected):
+    np.testing.assert_allclose(np.array(values, dtype=float),
+                               np.array(expected, dtype=float),
+                               rtol=1e-9, atol=1e-9)
+
+
+@pytest.fixture
+def candles():
+    return synthetic_candles(300, seed=0)
+
+
+def test_ema_matches_batch(candles):
+    ema = inc.IncrementalEma(period=50)
+
+    values = ema.seed(candles)
+
+    assert_same_values(values, ind.get_ema(candles, period=50))
+    assert np.isnan(values[48]) and not np.isnan(values[49])
+
+
+def test_atr_matches_batch(candles):
+    atr = inc.IncrementalAtr(period=14)
+    values = atr.seed(candles.iloc[:100])
+    values += [atr.update(row.high, row.low, row.close)
+               for row in candles.iloc[100:].itertuples()]
+
+    assert_same_values(values, ind.get_atr(candles, period=14))
+    assert atr.warm_up_candles == 14
+
+
+def test_rsi_matches_batch(candles):
+    # Repeated closes give periods without losses
+    candles.loc[20:40, 'close'] = candles['close'].iloc[20]
+
+    assert_same_values(inc.IncrementalRsi().seed(candles), ind.get_rsi(candles))
+
+
+def test_stochastic_rsi_matches_batch(candles):
+    stochastic_rsi = inc.IncrementalStochasticRsi()
+    values = stochastic_rsi.seed(candles)
+    expected = ind.get_stochastic_rsi(candles)
+
+    for name in ['stoch', 'k', 'd']:
+        assert_same_values([value[name] for value in values], expected[name])
+
+    assert not stochastic_rsi.is_ready or not np.isnan(values[-1]['d'])
+    first_d = int(np.argmax(~np.isnan(expected['d'].to_numpy())))
+    assert first_d + 1 == stochastic_rsi.warm_up_candles
+
+
+def test_atr_stop_loss_matches_batch(candles):
+    values = inc.IncrementalAtrStopLoss().seed(candles)
+    expected = ind.get_atr_stop_loss(candles)
+
+    for name in ['high_band', 'low_band']:
+        assert_same_values([value[name] for value in values], expected[name])
+
+
+def test_market_state_only_adds_new_candles(candles):
+    state = inc.MarketIndicatorState(lambda: {'ema': inc.IncrementalEma(period=50)})
+
+    state.update(candles.iloc[:200])
+    ema = state.indicators['ema']
+    state.update(candles.iloc[10:250])
+
+    assert state.indicators['ema'] is ema
+    assert ema.num_candles == 250
+    assert ema.value == pytest.approx(ind.get_ema(candles.iloc[:250], period=50).iloc[-1])
+
+    # Not contiguous, so indicators are seeded again
+    state.update(candles.iloc[260:])
+    assert state.indicators['ema'] is not ema
+    assert state.indicators['ema'].num_candles == 40
+
+
+def test_strategy_keeps_indicators_between_scans(candles):
+    candles['volume'] = np.random.default_rng(1).random(len(candles)) * 1000
+    batch_strategy = st.VolumeEmaTradingStrategy()
+    incremental_strategy = st.VolumeEmaTradingStrategy()
+
+    for last_candle in [200, 201, 230]:
+        df = candles.iloc[:last_candle]
+        entry_price = df['close'].iloc[-1]
+
+        expected = batch_strategy.perform_strategy(entry_price=entry_price, df=df)
+        output = incremental_strategy.perform_strategy(entry_price=entry_price,
+                                                       market=('BTC', 'USDT'), df=df)
+
+        assert output.stop_loss == pytest.approx(expected.stop_loss)
+        assert output.can_enter == expected.can_enter
+
+    assert incremental_strategy._market_states[('BTC', 'USDT')].indicators['ema'].num_candles == 229
@@ -0,0 +1,155 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from commonfixtures import synthetic_candles
+import indicator as ind
+
+
+def loop_bullish_divergence(type, candle_body_low_series, candle_body_high_series,
+                            indicator_low_series, n=2):
+    """
+    Nested loops implementation of get_bullish_divergence, used as reference
+    """
+    df = pd.DataFrame()
+    df['price_lows_lows'] = ind.get_local_minimums(candle_body_low_series, n)
+    df['price_lows_highs'] = ind.get_local_minimums(candle_body_high_series, n)
+    df['price_lows'] = np.where(df['price_lows_lows'].notna() & df['price_lows_highs'].notna(),
+                                df['price_lows_lows'], np.nan)
+    df['indicator_lows'] = ind.get_local_minimums(indicator_low_series, n)
+    df['low_p_and_low_i'] = ~df['price_lows'].isna() & ~df['indicator_lows'].isna()
+    df['low_p_and_previous_low_i'] = ~df['price_lows'].isna() & ~df['indicator_lows'].shift(1).isna()
+    df['low_p_and_next_low_i'] = ~df['price_lows'].isna() & ~df['indicator_lows'].shift(-1).isna()
+
+    lows_df = pd.DataFrame()
+    lows_df['indicator_lows'] = df['indicator_lows']
+    lows_df['both_lows_df'] = np.where(df['low_p_and_low_i'], lows_df['indicator_lows'], np.nan)
+    lows_df['previous_lows_df'] = np.where(df['low_p_and_previous_low_i'], lows_df['indicator_lows'].shift(1), np.nan)
+    lows_df['next_lows_df'] = np.where(df['low_p_and_next_low_i'], lows_df['indicator_lows'].shift(-1), np.nan)
+    lows_df['lowest'] = lows_df.min(axis=1, skipna=True, numeric_only=True)
+
+    inv_lows_df = pd.DataFrame()
+    inv_lows_df['price_lows'] = df['price_lows']
+    inv_lows_df['indicator_low'] = lows_df['lowest']
+    inv_lows_df = inv_lows_df[~inv_lows_df['indicator_low'].isna()]
+    inv_lows_df = inv_lows_df[::-1]
+
+    divergences = []
+    for row in inv_lows_df.itertuples():
+        for row_loop_2 in inv_lows_df.itertuples():
+            if row_loop_2[0] < row[0]:
+                if type == 'r':
+                    if row_loop_2[1] > row[1] and row_loop_2[2] < row[2]:
+                        divergences.append((row[0], True))
+                        break
+                else:
+                    if row_loop_2[1] < row[1] and row_loop_2[2] > row[2]:
+                        divergences.append((row[0], True))
+                        break
+
+    return pd.DataFrame(divergences, columns=['index', 'r_bull']).set_index('index')
+
+
+def divergence_candles(num_candles, seed):
+    df = synthetic_candles(num_candles, seed)
+    rng = np.random.default_rng([seed, 1])
+    # Gaps between candles, so that consecutive bodies don't share their lows
+    open_ = df['open'] + rng.normal(scale=.1, size=num_candles)
+    df['candle_body_low'] = np.minimum(open_, df['close'])
+    df['candle_body_high'] = np.maximum(open_, df['close'])
+    df['rsi'] = 50 + rng.normal(size=num_candles).cumsum()
+    return df
+
+
+@pytest.mark.parametrize('type', ['r', 'h'])
+@pytest.mark.parametrize('seed', range(5))
+def test_bullish_divergence_matches_loop_implementation(type, seed):
+    df = divergence_candles(3000, seed)
+    if seed % 2:
+        # Strategies use candles without the last one
+        df = df.iloc[:-1]
+    if seed == 3:
+        df.index = pd.date_range('2023-01-01', periods=len(df), freq='4h')
+
+    expected = loop_bullish_divergence(type, df['candle_body_low'], df['candle_body_high'], df['rsi'])
+    divergences = ind.get_bullish_divergence(type, df['candle_body_low'], df['candle_body_high'], df['rsi'])
+
+    assert len(expected) > 0
+    pd.testing.assert_frame_equal(divergences, expected)
+
+
+def test_bullish_divergence_in_small_blocks(monkeypatch):
+    df = divergence_candles(300, 7)
+    expected = ind.get_bullish_divergence('r', df['candle_body_low'], df['candle_body_high'], df['rsi'])
+
+    monkeypatch.setattr(ind, 'DIVERGENCE_BLOCK_ELEMENTS', 1)
+    divergences = ind.get_bullish_divergence('r', df['candle_body_low'], df['candle_body_high'], df['rsi'])
+
+    pd.testing.assert_frame_equal(divergences, expected)
+
+
+def test_bullish_divergence_without_lows():
+    series = pd.Series(np.arange(10, dtype=float))
+
+    divergences = ind.get_bullish_divergence('r', series, series, series)
+
+    assert len(divergences) == 0
+    assert list(divergences.columns) == ['r_bull']
+
+
+def loop_super_trend(df, atr_period, multiplier):
+    """
+    Series based implementation of super_trend, used as reference
+    """
+    high, low, close = df['high'], df['low'], df['close']
+    true_range = pd.concat([high - low, high - close.shift(), close.shift() - low], axis=1)
+    true_range = true_range.abs().max(axis=1)
+    atr = true_range.ewm(alpha=1/atr_period, min_periods=atr_period).mean()
+    hl2 = (high + low) / 2
+    final_upperband = hl2 + (multiplier * atr)
+    final_lowerband = hl2 - (multiplier * atr)
+
+    supertrend = [True] * len(df)
+    for curr in range(1, len(df.index)):
+        prev = curr - 1
+        if close[curr] > final_upperband[prev]:
+            supertrend[curr] = True
+        elif close[curr] < final_lowerband[prev]:
+            supertrend[curr] = False
+        else:
+            supertrend[curr] = supertrend[prev]
+            if supertrend[curr] == True and final_lowerband[curr] < final_lowerband[prev]:
+                final_lowerband[curr] = final_lowerband[prev]
+            if supertrend[curr] == False and final_upperband[curr] > final_upperband[prev]:
+                final_upperband[curr] = final_upperband[prev]
+
+        if supertrend[curr] == True:
+            final_upperband[curr] = np.nan
+        else:
+            final_lowerband[curr] = np.nan
+
+    return pd.DataFrame({'supertrend': supertrend, 'lowerband': final_lowerband,
+                         'upperband': final_upperband}, index=df.index)
+
+
+@pytest.mark.parametrize('atr_period, multiplier', [(10, 3), (7, 1.5), (14, .5)])
+def test_super_trend_matches_series_implementation(atr_period, multiplier):
+    df = synthetic_candles(2000, atr_period)
+
+    expected = loop_super_trend(df, atr_period, multiplier)
+    trend = ind.super_trend(df, atr_period, multiplier)
+
+    assert trend['supertrend'].nunique() == 2
+    pd.testing.assert_frame_equal(trend, expected)
+
+
+def test_super_trend_arrays_do_not_modify_bands():
+    df = synthetic_candles(100, 0)
+    upperband = (df['high'] + 1).to_numpy()
+    lowerband = (df['low'] - 1).to_numpy()
+    original_upperband, original_lowerband = upperband.copy(), lowerband.copy()
+
+    ind.super_trend_arrays(df['close'].to_numpy(), upperband, lowerband)
+
+    np.testing.assert_array_equal(upperband, original_upperband)
+    np.testing.assert_array_equal(lowerband, original_lowerband)
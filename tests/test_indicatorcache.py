@@ -0,0 +1,71 @@
+import pandas as pd
+
+from commonfixtures import synthetic_candles
+import indicator as ind
+import indicatorcache as ic
+
+
+class CountingIndicator:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self, df, period):
+        self.calls += 1
+        return ind.get_ema(df, period=period)
+
+
+def test_results_are_reused_for_the_same_candles():
+    cache = ic.IndicatorCache()
+    indicator = CountingIndicator()
+    df = synthetic_candles(200)
+
+    ema = cache.compute(indicator, df, ('BTC', 'USDT'), period=50)
+    assert cache.compute(indicator, df.copy(), ('BTC', 'USDT'), period=50) is ema
+    assert indicator.calls == 1
+
+    # Other market, parameters, new candle or changes in the unfinished candle
+    cache.compute(indicator, df, ('ETH', 'USDT'), period=50)
+    cache.compute(indicator, df, ('BTC', 'USDT'), period=20)
+    cache.compute(indicator, synthetic_candles(201), ('BTC', 'USDT'), period=50)
+    changed = df.copy()
+    changed.loc[199, 'close'] += 1
+    cache.compute(indicator, changed, ('BTC', 'USDT'), period=50)
+    assert indicator.calls == 5
+
+    stats = cache.stats()
+    assert (stats.hits, stats.misses, stats.entries) == (1, 5, 5)
+    assert stats.hit_ratio == 1 / 6
+
+
+def test_least_recently_used_results_are_evicted():
+    df = synthetic_candles(100)
+    result_size = ic.result_size_bytes(ind.get_ema(df, period=10))
+    cache = ic.IndicatorCache(max_bytes=2 * result_size)
+    indicator = CountingIndicator()
+
+    for symbol in ['A', 'B']:
+        cache.compute(indicator, df, (symbol, 'USDT'), period=10)
+    # A is used again, so B is the least recently used
+    cache.compute(indicator, df, ('A', 'USDT'), period=10)
+    cache.compute(indicator, df, ('C', 'USDT'), period=10)
+
+    stats = cache.stats()
+    assert stats.evictions == 1
+    assert stats.size_bytes <= 2 * result_size
+
+    cache.compute(indicator, df, ('A', 'USDT'), period=10)
+    assert indicator.calls == 3
+    cache.compute(indicator, df, ('B', 'USDT'), period=10)
+    assert indicator.calls == 4
+
+
+def test_memoized_function_keeps_signature():
+    cache = ic.IndicatorCache()
+    df = synthetic_candles(100)
+    memoized_atr_stop_loss = cache.memoize(ind.get_atr_stop_loss, ('BTC', 'USDT'), '4h')
+
+    bands = memoized_atr_stop_loss(df, atr_period=12)
+
+    pd.testing.assert_series_equal(bands['low_band'],
+                                   ind.get_atr_stop_loss(df, atr_period=12)['low_band'])
+    assert memoized_atr_stop_loss(df, atr_period=12) is bands
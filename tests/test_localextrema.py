@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from commonfixtures import synthetic_candles
+import indicator as ind
+import localextrema as le
+
+
+def candles(num_candles, seed, integer_values=False):
+    df = synthetic_candles(num_candles, seed)
+    if integer_values:
+        df['low'] = np.random.default_rng(seed).integers(0, 5, num_candles).astype(float)
+    return df
+
+
+def detected_extrema(detector):
+    pivots = list(detector.pivots) + detector.provisional_pivots()
+    return [label for label, _ in pivots]
+
+
+@pytest.mark.parametrize('comparator, batch_function', [
+    (np.less, ind.get_local_minimums),
+    (np.greater, ind.get_local_maximums),
+])
+@pytest.mark.parametrize('n', [1, 2, 5])
+@pytest.mark.parametrize('integer_values', [False, True])
+def test_streaming_extrema_match_argrelextrema(comparator, batch_function, n, integer_values):
+    df = candles(300, seed=n, integer_values=integer_values)
+
+    for length in [1, 2, n + 1, 150, 300]:
+        detector = le.StreamingLocalExtrema(n, comparator)
+        detector.seed(df.index[:length], df['low'].iloc[:length])
+
+        expected = batch_function(df['low'].iloc[:length], n)
+        assert detected_extrema(detector) == list(expected.index)
+
+
+def test_pivots_are_confirmed_after_n_values():
+    detector = le.StreamingLocalExtrema(2)
+
+    assert [detector.update(i, value) for i, value in enumerate([5, 4, 1, 3])] == [None] * 4
+    assert detector.provisional_pivots() == [(2, 1)]
+    assert detector.update(4, 6) == (2, 1)
+    assert list(detector.pivots) == [(2, 1)]
+
+
+def test_pivot_history_is_bounded():
+    detector = le.StreamingLocalExtrema(1, max_pivots=3)
+    detector.seed(range(20), [0, 1] * 10)
+
+    assert list(detector.pivots) == [(14, 0), (16, 0), (18, 0)]
+
+
+def test_market_extrema_follow_sliding_windows():
+    df = candles(400, seed=0)
+    market_lows = le.MarketLocalExtrema('low', n=2)
+
+    for start in [0, 10, 50, 200]:
+        window = df.iloc[start:start + 200]
+        lows = market_lows.update(window)
+        expected = ind.get_local_minimums(window['low'], 2)
+
+        # Only the first candles of the window can differ, since their pivots
+        # were confirmed with the candles before the window
+        pd.testing.assert_series_equal(lows[lows.index >= start + 2],
+                                       expected[expected.index >= start + 2])
+
+    levels = ind.support_and_resistance(window, lows=lows)
+    np.testing.assert_allclose(levels['base_line'],
+                               ind.support_and_resistance(window)['base_line'])
+
+
+def test_market_extrema_follow_revisions_of_the_last_candle():
+    df = candles(60, seed=3)
+    market_lows = le.MarketLocalExtrema('low', n=2)
+    market_lows.update(df.iloc[:50])
+
+    revised = df.iloc[:50].copy()
+    revised.loc[49, 'low'] = 50.
+    lows = market_lows.update(revised)
+    # The revised candle is closed and the next ones arrive
+    following = pd.concat([revised, df.iloc[50:]])
+    following_lows = market_lows.update(following)
+
+    pd.testing.assert_series_equal(lows, ind.get_local_minimums(revised['low'], 2))
+    np.testing.assert_allclose(ind.support_and_resistance(revised, lows=lows)['lower_line'],
+                               ind.support_and_resistance(revised)['lower_line'])
+    pd.testing.assert_series_equal(following_lows,
+                                   ind.get_local_minimums(following['low'], 2))
@@ -0,0 +1,133 @@
+import dataclasses
+
+import pytest
+
+from commonfixtures import SyntheticCandlesExchangeHandler, create_trade
+import candlestore as cs
+import exitevaluator as ex_ev
+import marketstream as ms
+
+
+minute = 60 * 1000
+start = 1_700_000_000_000 // minute * minute
+
+
+class FakeClock:
+    def __init__(self, now_ms):
+        self.now_ms = now_ms
+
+    def __call__(self):
+        return self.now_ms
+
+
+def trade_event(timestamp, price, symbol='BTC'):
+    return ms.TradeEvent(symbol=symbol, vs_currency='USDT', timestamp=timestamp,
+                         price=price, amount=1)
+
+
+@pytest.fixture
+def replay_file(tmp_path):
+    file_path = tmp_path / 'events.jsonl'
+    recorder = ms.MarketEventRecorder(file_path)
+    recorder(trade_event(start, 100))
+    recorder(ms.KlineEvent(symbol='ETH', vs_currency='USDT', timeframe='4h',
+                           timestamp=start, open=1, high=3, low=.5, close=2,
+                           volume=10, is_closed=True))
+    recorder(trade_event(start + 1000, 101))
+
+    return file_path
+
+
+def test_replay_feed_publishes_recorded_events_in_order(replay_file):
+    hub = ms.MarketDataHub()
+    received = []
+    hub.subscribe(received.append)
+    klines = hub.subscribe([].append, ms.KlineEvent)
+
+    ms.ReplayFeed(replay_file).replay(hub)
+
+    assert [type(event) for event in received] == [ms.TradeEvent, ms.KlineEvent,
+                                                   ms.TradeEvent]
+    assert received[1].close == 2 and received[1].is_closed
+    assert hub.price_book.price('BTC', 'USDT') == 101
+    assert hub.price_book.price('ETH', 'USDT') == 2
+    hub.unsubscribe(klines)
+    assert len(hub._subscribers) == 2
+
+
+def test_price_book_serves_only_recent_prices():
+    clock = FakeClock(start)
+    book = ms.LatestPriceBook(max_age_seconds=5, clock=clock)
+    book.on_event(trade_event(start, 100))
+
+    assert book.prices([('BTC', 'USDT'), ('ETH', 'USDT')]) == {('BTC', 'USDT'): 100}
+
+    clock.now_ms += 6000
+    assert book.price('BTC', 'USDT') is None
+
+
+def test_price_range_requires_stream_coverage():
+    clock = FakeClock(start + 3 * minute)
+    book = ms.LatestPriceBook(clock=clock)
+    for timestamp, price in [(start + 10, 100), (start + minute, 120),
+                             (start + 2 * minute, 90), (start + 3 * minute, 95)]:
+        book.on_event(trade_event(timestamp, price))
+
+    assert book.price_range('BTC', 'USDT', since=start) is None
+    assert book.price_range('BTC', 'USDT', since=start + minute) == (120, 90, start + 3 * minute)
+    assert book.price_range('BTC', 'USDT', since=start + 2 * minute)[:2] == (95, 90)
+
+    book.on_event(ms.StreamInterruptedEvent(symbol='BTC', vs_currency='USDT',
+                                            timestamp=clock.now_ms))
+    assert book.price_range('BTC', 'USDT', since=start + 2 * minute) is None
+    assert book.price('BTC', 'USDT') is None
+
+
+def test_exit_evaluator_reads_streamed_range_without_requests():
+    clock = FakeClock(start)
+    handler = SyntheticCandlesExchangeHandler(now_ms=start, timeframe_ms=minute)
+    handler.fetch_market = lambda symbol, vs_currency: {'min_vs_currency': 0}
+    hub = ms.MarketDataHub(ms.LatestPriceBook(clock=clock))
+    evaluator = ex_ev.PositionExitEvaluator(handler, clock=clock,
+                                            price_book=hub.price_book)
+    trade = create_trade(symbol='BTC', vs_currency_symbol='USDT', stop_loss=1,
+                         take_profit=1000)
+    trade.id = 1
+
+    hub.publish(trade_event(start - minute, 100))
+    assert evaluator.evaluate_trade(trade) is None
+    assert len(handler.requests) == 1
+
+    clock.now_ms = start + 2 * minute
+    hub.publish(trade_event(start + minute, 1001))
+    hub.publish(trade_event(start + 2 * minute, 500))
+
+    decision = evaluator.evaluate_trade(trade)
+    assert decision.reason == ex_ev.ExitReason.TAKE_PROFIT
+    assert decision.high == 1001
+    assert len(handler.requests) == 1
+
+
+def test_candle_store_keeps_streamed_klines():
+    handler = SyntheticCandlesExchangeHandler(now_ms=start + 10 * minute,
+                                              timeframe_ms=minute)
+    store = cs.CandleStore(handler, db_engine=cs.test_engine,
+                           clock=lambda: handler.now_ms)
+    store.get_candles_last_one_not_finished('STREAM', 'USDT', '1m', 5)
+
+    kline = ms.KlineEvent(symbol='STREAM', vs_currency='USDT', timeframe='1m',
+                          timestamp=start + 11 * minute, open=1, high=2, low=.5,
+                          close=1.5, volume=3, is_closed=False)
+    store.on_kline(kline)
+    handler.now_ms = start + 11 * minute
+
+    # Unfinished klines are only kept in memory
+    assert len(store.get_stored_candles('STREAM', 'USDT', '1m',
+                                        since=start + 11 * minute)) == 0
+    assert store._missing_candles_request('STREAM', 'USDT', '1m', 5) == \
+        (start + 11 * minute, 2)
+
+    store.on_kline(dataclasses.replace(kline, close=1.6, is_closed=True))
+    stored = store.get_stored_candles('STREAM', 'USDT', '1m',
+                                      since=start + 11 * minute)
+    assert list(stored['close']) == [1.6]
@@ -0,0 +1,155 @@
+import ccxt
+import numpy as np
+import pandas as pd
+import pytest
+
+from commonfixtures import synthetic_candles
+import paperexchange as pe
+
+HOUR_MS = 60 * 60 * 1000
+
+
+@pytest.fixture
+def hourly_df():
+    return synthetic_candles(3000, timeframe='1h')
+
+
+def paper_exchange_handler(candles, now_ms, balances=None, market_rules=None):
+    price_feed = pe.RecordedPriceFeed(candles, timeframe='1h', clock=pe.SimulatedClock(now_ms))
+    return pe.PaperExchangeHandler(price_feed, balances=balances or {},
+                                   market_rules=market_rules)
+
+
+def test_recorded_candles_are_aggregated_up_to_the_clock(hourly_df):
+    # Last instant of the third hour of a 4h candle
+    open_times = hourly_df['datetime'].to_numpy(dtype='datetime64[ms]').astype(np.int64)
+    four_hours_open = open_times[open_times % (4 * HOUR_MS) == 0][-10]
+    now_ms = int(four_hours_open + 3 * HOUR_MS - 1)
+    handler = paper_exchange_handler({('BTC', 'USDT'): hourly_df}, now_ms)
+
+    df = handler.get_candles_last_one_not_finished('BTC', 'USDT', timeframe='4h',
+                                                   num_candles=50)
+
+    known = hourly_df[open_times <= now_ms].set_index('datetime')
+    expected = known.resample('4h').agg({'open': 'first', 'high': 'max', 'low': 'min',
+                                         'close': 'last', 'volume': 'sum'}).iloc[-50:]
+    assert len(df) == 50
+    assert df['datetime'].iloc[-1].timestamp() * 1000 == four_hours_open
+    for column in ['open', 'high', 'low', 'close', 'volume']:
+        np.testing.assert_allclose(df[column].to_numpy(), expected[column].to_numpy())
+    # The unfinished candle only knows three hours
+    assert df['close'].iloc[-1] == known['close'].iloc[-1]
+    assert handler.get_current_price('BTC', 'USDT') == known['close'].iloc[-1]
+
+
+def test_recorded_candles_since_are_the_first_ones_after_it(hourly_df):
+    now_ms = int(hourly_df['datetime'].iloc[100].timestamp() * 1000)
+    handler = paper_exchange_handler({('BTC', 'USDT'): hourly_df}, now_ms)
+    since = now_ms - 10 * HOUR_MS
+
+    first = handler.get_candles_last_one_not_finished('BTC', 'USDT', '1h', num_candles=3,
+                                                      since=since)
+    until_now = handler.get_candles_last_one_not_finished('BTC', 'USDT', '1h',
+                                                          num_candles=100, since=since)
+
+    pd.testing.assert_frame_equal(first, hourly_df.iloc[90:93].reset_index(drop=True))
+    pd.testing.assert_frame_equal(until_now, hourly_df.iloc[90:101].reset_index(drop=True))
+
+
+def test_paper_orders_pay_fees_and_move_balances(hourly_df):
+    now_ms = int(hourly_df['datetime'].iloc[100].timestamp() * 1000)
+    handler = paper_exchange_handler({('BTC', 'USDT'): hourly_df}, now_ms,
+                                     balances={'USDT': 100.})
+    price = hourly_df['close'].iloc[100]
+
+    buy_order = handler.buy_market_order('BTC', 'USDT', amount=.123456789)
+    # The full amount bought can not be sold, since the fee was paid in BTC
+    sell_order = handler.sell_market_order_diminishing_amount('BTC', 'USDT',
+                                                              amount=buy_order['amount'])
+
+    assert buy_order['amount'] == .12345
+    assert buy_order['cost'] == pytest.approx(.12345 * price)
+    assert buy_order['fee_in_asset'] == pytest.approx(.12345 * pe.PAPER_FEE_FACTOR)
+    assert buy_order['timestamp'] == now_ms
+    assert sell_order['amount'] < buy_order['amount'] - buy_order['fee_in_asset']
+    assert sell_order['fee_in_asset'] == pytest.approx(sell_order['cost'] * pe.PAPER_FEE_FACTOR)
+    assert handler.balances['USDT'] == pytest.approx(
+        100 - buy_order['cost'] + sell_order['cost'] - sell_order['fee_in_asset'])
+    assert 0 <= handler.balances['BTC'] < 10 ** -pe.PAPER_AMOUNT_DECIMALS
+    dust, = handler.dust_report.records()
+    assert dust.dust_amount == pytest.approx(handler.balances['BTC'])
+
+
+def test_paper_orders_outside_market_limits_are_not_filled(hourly_df):
+    now_ms = int(hourly_df['datetime'].iloc[100].timestamp() * 1000)
+    price = hourly_df['close'].iloc[100]
+    rules = pe.MarketRules(min_vs_currency=10., max_vs_currency=50., amount_decimals=3)
+    handler = paper_exchange_handler({('BTC', 'USDT'): hourly_df}, now_ms,
+                                     balances={'USDT': 100.},
+                                     market_rules={('BTC', 'USDT'): rules})
+
+    assert handler.buy_market_order('BTC', 'USDT', amount=5 / price) is None
+    assert handler.buy_market_order('BTC', 'USDT', amount=60 / price) is None
+    assert handler.buy_market_order('BTC', 'USDT', amount=.0004) is None
+    assert handler.balances == {'USDT': 100.}
+    assert handler.buy_market_order('BTC', 'USDT', amount=20 / price)['amount'] == \
+        pytest.approx(int(20 / price * 1000) / 1000)
+    assert handler.fetch_market('BTC', 'USDT') == rules.market_info()
+    assert handler.fetch_market('BTC', 'USDT')['min_qty'] == .001
+    # Markets without rules use the default ones
+    assert handler.fetch_market('ETH', 'USDT')['min_vs_currency'] == pe.PAPER_MIN_VS_CURRENCY
+
+
+def test_synthetic_prices_do_not_depend_on_when_they_are_requested():
+    start_ms = 1_700_000_000_000 // HOUR_MS * HOUR_MS
+    markets = [('BTC', 'USDT'), ('ETH', 'USDT')]
+    late_clock = pe.SimulatedClock(start_ms + 3000 * HOUR_MS)
+    late = pe.SyntheticPriceFeed(markets, timeframe='1h', clock=late_clock, seed=3,
+                                 start_ms=start_ms)
+    stepped_clock = pe.SimulatedClock(start_ms)
+    stepped = pe.SyntheticPriceFeed(markets, timeframe='1h', clock=stepped_clock, seed=3,
+                                    start_ms=start_ms)
+
+    prices = []
+    for hour in range(0, 3001, 500):
+        stepped_clock.now_ms = start_ms + hour * HOUR_MS
+        prices.append(stepped.current_price(('ETH', 'USDT')))
+
+    recorded = late.recorded(('ETH', 'USDT'))
+    np.testing.assert_array_equal(prices, recorded.close[:3001:500])
+    assert np.all(np.diff(recorded.timestamp) == HOUR_MS)
+    assert np.all(recorded.high >= np.maximum(recorded.open, recorded.close))
+    assert np.all(recorded.low <= np.minimum(recorded.open, recorded.close))
+    assert late.current_price(('BTC', 'USDT')) != late.current_price(('ETH', 'USDT'))
+
+
+def test_paper_exchange_trades_against_synthetic_prices():
+    start_ms = 1_700_000_000_000 // HOUR_MS * HOUR_MS
+    clock = pe.SimulatedClock(start_ms + 100 * HOUR_MS)
+    price_feed = pe.SyntheticPriceFeed([('BTC', 'USDT')], timeframe='1h', clock=clock,
+                                       start_ms=start_ms)
+    handler = pe.PaperExchangeHandler(price_feed, balances={'USDT': 1000.})
+
+    handler.buy_market_order('BTC', 'USDT', amount=1.)
+    clock.now_ms += 10 * HOUR_MS
+    df = handler.get_candles_for_strategy('BTC', 'USDT', timeframe='4h', num_candles=10)
+
+    assert len(df) == 9
+    assert handler.get_total_amount_in_symbol('USDT') == pytest.approx(
+        handler.balances['USDT'] + handler.balances['BTC'] *
+        handler.get_current_price('BTC', 'USDT'))
+
+
+def test_paper_withdrawals_debit_the_fiat_balance(hourly_df):
+    now_ms = int(hourly_df['datetime'].iloc[100].timestamp() * 1000)
+    handler = paper_exchange_handler({('BTC', 'USDT'): hourly_df}, now_ms,
+                                     balances={'EUR': 100.})
+
+    withdrawal = handler.withdraw_fiat_to_bank_account('EUR', 40., swift='BANKESMM')
+
+    assert withdrawal['amount'] == 40.
+    assert withdrawal['timestamp'] == now_ms
+    assert handler.balances == {'EUR': 60.}
+    with pytest.raises(ccxt.InsufficientFunds):
+        handler.withdraw_fiat_to_bank_account('EUR', 70., swift='BANKESMM')
+    assert handler.balances == {'EUR': 60.}
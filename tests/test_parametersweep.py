@@ -0,0 +1,105 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from commonfixtures import synthetic_candles
+import backtester as bt
+import parametersweep as psw
+import strategy as st
+
+
+@pytest.fixture
+def dfs():
+    return {(f"M{seed}", 'USDT'): synthetic_candles(2000, seed=seed) for seed in range(3)}
+
+
+def sweep_result(expectancy, max_drawdown, num_trades=10):
+    return psw.SweepResult(parameters={}, num_trades=num_trades, win_rate=.5,
+                           expectancy=expectancy, total_result=expectancy * num_trades,
+                           max_drawdown=max_drawdown)
+
+
+def test_grid_parameters_are_every_combination():
+    parameter_sets = psw.grid_parameters({'rrr': [1.5, 2.], 'atr_period': [10, 12, 14]})
+
+    assert len(parameter_sets) == 6
+    assert {'rrr': 2., 'atr_period': 14} in parameter_sets
+
+
+def test_random_parameters_are_reproducible_and_within_space():
+    space = {'atr_period': (5, 20), 'rrr': (1., 3.), 'volume_quantile': [.7, .8]}
+
+    parameter_sets = psw.random_parameters(space, num_samples=50, seed=1)
+
+    assert parameter_sets == psw.random_parameters(space, num_samples=50, seed=1)
+    assert all(type(parameters['atr_period']) is int and 5 <= parameters['atr_period'] <= 20
+               and 1. <= parameters['rrr'] <= 3. and parameters['volume_quantile'] in (.7, .8)
+               for parameters in parameter_sets)
+
+
+def test_max_drawdown_is_the_largest_fall_from_a_previous_maximum():
+    assert psw.max_drawdown([1., -2., 3., -1., -3., 2.]) == 4.
+    assert psw.max_drawdown([-1., 2.]) == 1.
+    assert psw.max_drawdown([]) == 0.
+
+
+def test_results_are_ranked_by_expectancy_and_drawdown():
+    best = sweep_result(expectancy=2., max_drawdown=1.)
+    high_expectancy_high_drawdown = sweep_result(expectancy=3., max_drawdown=30.)
+    low_expectancy_low_drawdown = sweep_result(expectancy=1., max_drawdown=.5)
+    worst = sweep_result(expectancy=.5, max_drawdown=20.)
+    no_trades = sweep_result(expectancy=float('nan'), max_drawdown=0., num_trades=0)
+
+    ranked = psw.rank_results([no_trades, worst, low_expectancy_low_drawdown,
+                               high_expectancy_high_drawdown, best])
+
+    # Tied by positions, so the highest expectancy goes first
+    assert ranked[:2] == [best, low_expectancy_low_drawdown]
+    assert ranked[2:] == [high_expectancy_high_drawdown, worst, no_trades]
+    assert [result.rank for result in ranked] == [1, 2, 3, 4, 5]
+
+
+def test_shared_candles_are_the_given_ones(dfs):
+    with psw.SharedCandles(dfs) as shared_candles:
+        psw._attach_shared_candles(shared_candles.name, shared_candles.layout)
+        memory, shared_dfs = psw._worker_candles
+        try:
+            for market, df in dfs.items():
+                pd.testing.assert_frame_equal(shared_dfs[market], df)
+        finally:
+            psw._worker_candles = None
+            del shared_dfs
+            memory.close()
+
+
+def test_parallel_sweep_gives_the_results_of_a_single_process(dfs):
+    parameter_sets = psw.grid_parameters({'rrr': [1.5, 2.5], 'atr_factor': [1., 2.]})
+
+    serial = psw.ParameterSweep(st.VolumeEmaTradingStrategy, dfs, timeframe='4h',
+                                fee_factor=.001, workers=1).run(parameter_sets)
+    parallel = psw.ParameterSweep(st.VolumeEmaTradingStrategy, dfs, timeframe='4h',
+                                  fee_factor=.001, workers=2).run(parameter_sets)
+
+    def summary(results):
+        return [(result.parameters, result.num_trades, result.total_result,
+                 result.max_drawdown, result.rank) for result in results]
+
+    assert summary(parallel) == summary(serial)
+    assert len({result.num_trades for result in serial}) > 1
+    assert sorted(result.rank for result in serial) == [1, 2, 3, 4]
+
+
+def test_sweep_results_summarize_backtested_trades(dfs):
+    parameters = {'volume_quantile': .7, 'rrr': 2.}
+
+    result, = psw.ParameterSweep(st.VolumeTradingStrategy, dfs, timeframe='4h',
+                                 fee_factor=.001, workers=1).run([parameters])
+
+    trades = bt.VectorizedBacktester(st.VolumeTradingStrategy(**parameters),
+                                     timeframe='4h', fee_factor=.001).run(dfs)
+    closed = trades[trades['exit_index'] >= 0]
+    assert result.parameters == parameters
+    assert result.num_trades == len(closed)
+    assert result.expectancy == pytest.approx(closed['result'].mean())
+    assert result.win_rate == pytest.approx((closed['result'] > 0).mean())
+    assert 0 <= result.max_drawdown <= np.abs(closed['result']).sum()
@@ -0,0 +1,97 @@
+import pytest
+
+from commonfixtures import synthetic_candles
+import paperexchange as pe
+import portfoliovaluation as pv
+
+
+class CountingPaperExchangeHandler(pe.PaperExchangeHandler):
+    """
+    Paper exchange recording the balance and price requests
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.balance_requests = 0
+        self.price_requests = []
+
+    def get_total_balances(self):
+        self.balance_requests += 1
+        return super().get_total_balances()
+
+    def get_current_prices(self, markets):
+        self.price_requests.append(sorted(markets))
+        return super().get_current_prices(markets)
+
+
+@pytest.fixture
+def handler():
+    candles = {(f"M{seed}", 'USDT'): synthetic_candles(200, seed, timeframe='1h')
+               for seed in range(5)}
+    now_ms = int(candles[('M0', 'USDT')]['datetime'].iloc[150].timestamp() * 1000)
+    price_feed = pe.RecordedPriceFeed(candles, timeframe='1h', clock=pe.SimulatedClock(now_ms))
+    return CountingPaperExchangeHandler(price_feed, balances={'USDT': 1000., 'M1': 2.,
+                                                              'UNLISTED': 5.})
+
+
+def test_only_held_assets_with_market_are_priced(handler):
+    portfolio = pv.PortfolioValuation(handler, vs_currency='USDT')
+
+    valuation = portfolio.valuation()
+
+    assert handler.price_requests == [[('M1', 'USDT')]]
+    assert valuation.unpriced == ['UNLISTED']
+    assert valuation.equity == pytest.approx(
+        1000. + 2 * handler.get_current_price('M1', 'USDT'))
+    assert valuation.equity == pytest.approx(handler.get_total_amount_in_symbol('USDT'))
+
+
+def test_fills_update_equity_without_fetching_balances(handler):
+    now = [0.]
+    portfolio = pv.PortfolioValuation(handler, vs_currency='USDT', clock=lambda: now[0])
+    portfolio.equity()
+
+    for symbol in ['M2', 'M3']:
+        order = handler.buy_market_order(symbol, 'USDT', amount=1.)
+        portfolio.record_buy(symbol, 'USDT', order)
+    order = handler.sell_market_order_diminishing_amount('M2', 'USDT', amount=.5)
+    portfolio.record_sell('M2', 'USDT', order)
+    equity = portfolio.equity()
+
+    assert handler.balance_requests == 1
+    # Prices of the fills are reused
+    assert handler.price_requests == [[('M1', 'USDT')]]
+    assert portfolio.balances() == pytest.approx(handler.get_total_balances())
+    assert equity == pytest.approx(handler.get_total_amount_in_symbol('USDT'))
+
+
+def test_balances_and_prices_are_fetched_again_when_expired(handler):
+    now = [0.]
+    portfolio = pv.PortfolioValuation(handler, vs_currency='USDT', balance_ttl_seconds=100,
+                                      price_max_age_seconds=10, clock=lambda: now[0])
+    portfolio.equity()
+    portfolio.equity()
+
+    now[0] = 11.
+    portfolio.equity()
+    now[0] = 100.
+    portfolio.equity()
+
+    assert handler.balance_requests == 2
+    assert len(handler.price_requests) == 3
+
+
+def test_fills_are_not_counted_twice_after_refresh(handler):
+    now = [0.]
+    portfolio = pv.PortfolioValuation(handler, vs_currency='USDT', balance_ttl_seconds=100,
+                                      clock=lambda: now[0])
+    portfolio.equity()
+
+    portfolio.refresh()
+    order = handler.buy_market_order('M2', 'USDT', amount=1.)
+    portfolio.record_buy('M2', 'USDT', order)
+    now[0] = 100.
+    order = handler.buy_market_order('M3', 'USDT', amount=1.)
+    portfolio.record_buy('M3', 'USDT', order)
+
+    assert portfolio.balances() == pytest.approx(handler.get_total_balances())
+    assert handler.balance_requests == 3
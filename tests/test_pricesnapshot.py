@@ -0,0 +1,60 @@
+import pytest
+
+from commonfixtures import SyntheticCandlesExchangeHandler
+import pricesnapshot as ps
+
+
+class BulkPricesExchangeHandler(SyntheticCandlesExchangeHandler):
+    def __init__(self):
+        super().__init__(now_ms=1_700_000_000_000)
+        self.bulk_requests = 0
+
+    def get_current_prices(self, markets):
+        self.bulk_requests += 1
+        return {market: 10.0 for market in markets if market[0] != 'DELISTED'}
+
+
+markets = [('BTC', 'USDT'), ('ETH', 'USDT'), ('DELISTED', 'USDT')]
+
+
+def test_default_bulk_prices_use_current_price():
+    handler = SyntheticCandlesExchangeHandler(now_ms=1_700_000_000_000)
+    prices = handler.get_current_prices(markets[:2])
+
+    assert prices == {market: handler.get_current_price(*market) for market in markets[:2]}
+
+
+def test_snapshot_contains_requested_prices_and_age():
+    handler = BulkPricesExchangeHandler()
+    snapshot = ps.PriceSnapshotService(exchange_handler=handler).take_snapshot(markets)
+
+    assert snapshot.price('BTC', 'USDT') == 10.0
+    assert snapshot.price('DELISTED', 'USDT') is None
+    assert snapshot.covers(markets)
+    assert snapshot.age_seconds(now=snapshot.taken_at + 3) == pytest.approx(3)
+
+
+def test_fresh_snapshot_is_reused():
+    handler = BulkPricesExchangeHandler()
+    service = ps.PriceSnapshotService(exchange_handler=handler, max_age_seconds=60)
+
+    first = service.snapshot(markets)
+    second = service.snapshot(markets[:1])
+
+    assert first is second
+    assert handler.bulk_requests == 1
+
+
+def test_stale_or_incomplete_snapshot_is_refreshed():
+    handler = BulkPricesExchangeHandler()
+    service = ps.PriceSnapshotService(exchange_handler=handler, max_age_seconds=0)
+    service.snapshot(markets[:1])
+    service.snapshot(markets[:1])
+
+    assert handler.bulk_requests == 2
+
+    service = ps.PriceSnapshotService(exchange_handler=handler, max_age_seconds=60)
+    service.snapshot(markets[:1])
+    service.snapshot(markets)
+
+    assert handler.bulk_requests == 4
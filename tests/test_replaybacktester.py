@@ -0,0 +1,72 @@
+from datetime import datetime
+
+import pytest
+
+from commonfixtures import synthetic_candles
+import commonutils as cu
+import model
+import replaybacktester as rb
+import services
+import strategy as st
+
+
+def replay_backtester(num_candles):
+    candles = {(f"M{seed}", 'USDT'): synthetic_candles(num_candles, seed, timeframe='1h')
+               for seed in range(2)}
+    return rb.ReplayBacktester(st.VolumeEmaTradingStrategy(), candles, timeframe='1h',
+                               strategy_timeframe='4h', vs_currency_available=1000.)
+
+
+@pytest.fixture(scope='module')
+def replayed():
+    replay = replay_backtester(3000)
+    return replay, replay.run()
+
+
+def test_replay_trades_through_services(replayed):
+    replay, trades = replayed
+
+    assert len(trades) > 0
+    assert all(trade.is_real and trade.strategy_name == 'volume_ema_trading_strategy'
+               for trade in trades)
+    closed = [trade for trade in trades if trade.status != model.TradeStatus.OPENED]
+    opened = [trade for trade in trades if trade.status == model.TradeStatus.OPENED]
+    assert closed
+    assert len(opened) <= 2
+    for trade in closed:
+        result = trade.vs_currency_result_no_fees - trade.entry_fee_vs_currency - \
+            trade.exit_fee_vs_currency
+        assert (result > 0) == (trade.status == model.TradeStatus.WON)
+    # Real trades store sell cost - entry cost + both fees as vs_currency_result_no_fees,
+    # and the exit fee is paid from the sell cost
+    assert replay.exchange_handler.balances['USDT'] == pytest.approx(
+        1000. - sum(trade.vs_currency_entry for trade in opened) +
+        sum(trade.vs_currency_result_no_fees - trade.entry_fee_vs_currency -
+            2 * trade.exit_fee_vs_currency for trade in closed))
+
+
+def test_replay_dates_are_simulated_and_positions_do_not_overlap(replayed):
+    _, trades = replayed
+
+    for market in [('M0', 'USDT'), ('M1', 'USDT')]:
+        market_trades = [trade for trade in trades
+                         if (trade.symbol, trade.vs_currency_symbol) == market]
+        entries = [datetime.strptime(trade.entry_date, "%d/%m/%Y %H:%M:%S")
+                   for trade in market_trades]
+        exits = [datetime.strptime(trade.exit_date, "%d/%m/%Y %H:%M:%S")
+                 for trade in market_trades if trade.exit_date is not None]
+        assert entries[0] < datetime(2024, 1, 1)
+        # Scans happen when the first hour of a 4h candle is known
+        assert all(entry.hour % 4 == 0 and entry.minute == 59 for entry in entries)
+        assert all(exit_ <= next_entry for exit_, next_entry in zip(exits, entries[1:]))
+
+
+def test_replay_restores_services():
+    replay = replay_backtester(1000)
+    replaced = {name: getattr(services, name) for name in rb.REPLAYED_SERVICES_GLOBALS}
+    logger = cu.logger
+
+    replay.run()
+
+    assert {name: getattr(services, name) for name in rb.REPLAYED_SERVICES_GLOBALS} == replaced
+    assert cu.logger is logger
@@ -1,6 +1,8 @@
 import pytest
+from sqlalchemy.exc import SQLAlchemyError
 
 import model
+import repository
 
 from commonfixtures import testing_session, create_trade, sqlalchemyrepository_testing
 
@@ -109,3 +111,119 @@ def test_sqlalchemy_gets_opened_positions(sqlalchemyrepository_testing):
 
     assert len(opened_positions) == 1
     assert opened_positions[0].status == model.TradeStatus.OPENED
+
+
+@pytest.fixture
+def indexed_repository_testing():
+    index = repository.OpenPositionIndex()
+    return repository.provide_sqlalchemy_repository(real_db=False,
+                                                    open_position_index=index)
+
+
+def test_open_position_index_is_loaded_once(indexed_repository_testing):
+    t = create_trade(symbol='INDEXLOAD', vs_currency_symbol='EUR')
+    indexed_repository_testing.add_trade(t)
+    indexed_repository_testing.commit()
+
+    other_repo = repository.provide_sqlalchemy_repository(
+        real_db=False, open_position_index=indexed_repository_testing._open_position_index)
+    opened = other_repo.get_opened_positions(symbol='INDEXLOAD', vs_currency='EUR')
+
+    assert len(opened) == 1
+    assert opened[0] == t
+    assert opened[0] is not t
+
+
+def test_open_position_index_is_written_through(indexed_repository_testing):
+    repo = indexed_repository_testing
+    # Loads the index before adding the trade
+    repo.get_opened_positions()
+
+    t = create_trade(symbol='INDEXWRITE', vs_currency_symbol='EUR')
+    repo.add_trade(t)
+    assert repo.get_opened_positions(symbol='INDEXWRITE', vs_currency='EUR') == []
+
+    repo.commit()
+    assert repo.get_opened_positions(symbol='INDEXWRITE', vs_currency='EUR')[0].id == t.id
+
+    repo.modify_stop_loss(id=t.id, new_stop_loss=.5)
+    repo.modify_take_profit(id=t.id, new_take_profit=2.5)
+    indexed = repo.get_opened_positions(symbol='INDEXWRITE', vs_currency='EUR')[0]
+    assert indexed.modified_stop_loss == .5
+    assert indexed.modified_take_profit == 2.5
+
+    repo.update_trade_on_exit_position(id=t.id, vs_currency_result_no_fees=1,
+                                       status=model.TradeStatus.WON,
+                                       crypto_quantity_exit=1,
+                                       exit_fee_vs_currency=.1,
+                                       exit_date='2022-06-18 19:21:10')
+    assert repo.get_opened_positions(symbol='INDEXWRITE', vs_currency='EUR') == []
+    assert t.id not in [op.id for op in repo.get_opened_positions()]
+
+
+def test_unit_of_work_commits_when_finished():
+    t = create_trade(symbol='UOWCOMMIT', vs_currency_symbol='EUR')
+
+    with repository.provide_sqlalchemy_repository(real_db=False) as repo:
+        repo.add_trade(t)
+        repo.commit()
+        # Only flushed, so the transaction is still open
+        assert repo._session.in_transaction()
+
+    assert not repo._session.in_transaction()
+    other_repo = repository.provide_sqlalchemy_repository(real_db=False)
+    assert len(other_repo.get_opened_positions(symbol='UOWCOMMIT', vs_currency='EUR')) == 1
+
+
+def test_unit_of_work_rolls_back_on_database_error():
+    t = create_trade(symbol='UOWROLLBACK', vs_currency_symbol='EUR')
+
+    with pytest.raises(SQLAlchemyError):
+        with repository.provide_sqlalchemy_repository(real_db=False) as repo:
+            repo.add_trade(t)
+            repo.commit()
+            raise SQLAlchemyError()
+
+    other_repo = repository.provide_sqlalchemy_repository(real_db=False)
+    assert other_repo.get_opened_positions(symbol='UOWROLLBACK', vs_currency='EUR') == []
+
+
+def test_unit_of_work_commits_real_trades_at_once():
+    real = create_trade(symbol='UOWREAL', vs_currency_symbol='EUR', is_real=True)
+    simulated = create_trade(symbol='UOWSIMULATED', vs_currency_symbol='EUR')
+
+    with pytest.raises(SQLAlchemyError):
+        with repository.provide_sqlalchemy_repository(real_db=False) as repo:
+            repo.add_trade(real)
+            repo.commit()
+            # The order was filled, so the trade is stored before the end
+            assert not repo._session.in_transaction()
+            repo.add_trade(simulated)
+            repo.commit()
+            raise SQLAlchemyError()
+
+    other_repo = repository.provide_sqlalchemy_repository(real_db=False)
+    assert len(other_repo.get_opened_positions(symbol='UOWREAL', vs_currency='EUR')) == 1
+    assert other_repo.get_opened_positions(symbol='UOWSIMULATED', vs_currency='EUR') == []
+
+
+def test_in_memory_repository_serves_copies_of_opened_positions():
+    repo = repository.InMemoryRepository()
+    t1 = create_trade(symbol='BTC', vs_currency_symbol='EUR')
+    t2 = create_trade(symbol='ETH', vs_currency_symbol='EUR')
+    repo.add_trade(t1)
+    repo.add_trade(t2)
+
+    repo.modify_stop_loss(id=t1.id, new_stop_loss=.5)
+    opened = repo.get_opened_positions(symbol='BTC', vs_currency='EUR')
+    assert opened[0] is not t1
+    assert opened[0].modified_stop_loss == t1.modified_stop_loss == .5
+
+    repo.update_trade_on_exit_position(id=t1.id, vs_currency_result_no_fees=1,
+                                       status=model.TradeStatus.WON,
+                                       crypto_quantity_exit=1,
+                                       exit_fee_vs_currency=.1,
+                                       exit_date='2022-06-18 19:21:10')
+    assert [op.id for op in repo.get_opened_positions()] == [t2.id]
+    assert repo.get_trades() == [t1, t2]
+    assert repo.get_trade(t1.id).status == model.TradeStatus.WON
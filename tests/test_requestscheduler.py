@@ -0,0 +1,112 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+import exchangehandler as eh
+import requestscheduler as rs
+from test_exchangehandler import MetadataCountingExchange
+
+
+def scheduler(burst_weight, refill_per_second, reserved_weight=0):
+    return rs.RequestScheduler(weight_per_minute=burst_weight + refill_per_second * 60,
+                               burst_weight=burst_weight, reserved_weight=reserved_weight)
+
+
+class RecordingExchange:
+    """
+    Exchange api reporting the weight used in the current minute, as Binance does
+    """
+    def __init__(self, used_weight):
+        self.last_response_headers = {'X-MBX-USED-WEIGHT-1M': str(used_weight)}
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None):
+        return [[0, 1., 1., 1., 1., 1.]]
+
+    async def create_order(self, symbol, type, side, amount):
+        return {'id': '1', 'amount': amount}
+
+    def amount_to_precision(self, symbol, amount):
+        return amount
+
+
+def test_requests_wait_when_the_bucket_is_empty():
+    request_scheduler = scheduler(burst_weight=10, refill_per_second=100)
+
+    assert request_scheduler.acquire(10) < .01
+    waited = request_scheduler.acquire(5)
+
+    assert waited == pytest.approx(.05, abs=.03)
+    assert request_scheduler.tokens < 1
+
+
+def test_exits_overtake_queued_scans():
+    request_scheduler = scheduler(burst_weight=5, refill_per_second=50)
+    request_scheduler.acquire(5)
+    granted = []
+
+    def request(name, priority):
+        request_scheduler.acquire(5, priority)
+        granted.append(name)
+
+    threads = [threading.Thread(target=request, args=(f"scan{i}", rs.Priority.SCAN))
+               for i in range(3)]
+    for thread in threads:
+        thread.start()
+    time.sleep(.02)
+    assert request_scheduler.stats()[rs.Priority.SCAN].queued == 3
+    threads.append(threading.Thread(target=request, args=('exit', rs.Priority.EXIT)))
+    threads[-1].start()
+    for thread in threads:
+        thread.join()
+
+    assert granted[0] == 'exit'
+    assert sorted(granted[1:]) == ['scan0', 'scan1', 'scan2']
+    stats = request_scheduler.stats()
+    assert stats[rs.Priority.SCAN].requests == 4
+    assert stats[rs.Priority.SCAN].max_queued == 3
+    assert stats[rs.Priority.EXIT].max_wait_seconds < stats[rs.Priority.SCAN].max_wait_seconds
+
+
+def test_scans_leave_the_reserved_weight_to_exits():
+    request_scheduler = scheduler(burst_weight=10, refill_per_second=20, reserved_weight=5)
+
+    assert request_scheduler.acquire(5, rs.Priority.SCAN) < .01
+    assert request_scheduler.acquire(5, rs.Priority.EXIT) < .01
+    # Scans wait until the reserved weight is refilled too
+    assert request_scheduler.acquire(5, rs.Priority.SCAN) == pytest.approx(.5, abs=.1)
+
+
+def test_scheduled_api_uses_priority_of_context_and_used_weight():
+    # 7000 weight per minute
+    request_scheduler = scheduler(burst_weight=1000, refill_per_second=100)
+    api = rs.ScheduledExchangeApi(RecordingExchange(used_weight=6990), request_scheduler)
+
+    assert api.amount_to_precision('BTC/EUR', 1.5) == 1.5
+    api.fetch_ohlcv('BTC/EUR')
+    with rs.request_priority(rs.Priority.EXIT):
+        api.fetch_ohlcv('BTC/EUR')
+        asyncio.run(api.create_order('BTC/EUR', 'market', 'sell', 1.))
+    asyncio.run(api.create_order('BTC/EUR', 'market', 'buy', 1.))
+
+    stats = request_scheduler.stats()
+    assert stats[rs.Priority.SCAN].requests == 1
+    assert stats[rs.Priority.EXIT].requests == 2
+    assert stats[rs.Priority.ORDER].requests == 1
+    # Binance reported that only 10 weight is left in the current minute
+    assert request_scheduler.tokens < 20
+
+
+def test_ccxt_exchange_handler_requests_are_scheduled():
+    request_scheduler = scheduler(burst_weight=1000, refill_per_second=1)
+    handler = eh.CcxtExchangeHandler(exchange_api=MetadataCountingExchange(),
+                                     request_scheduler=request_scheduler)
+
+    handler.fetch_market('BTC', 'EUR')
+    handler.get_fee_factor('BTC', 'EUR')
+
+    assert handler.request_scheduler is request_scheduler
+    assert request_scheduler.stats()[rs.Priority.SCAN].weight == \
+        rs.BINANCE_REQUEST_WEIGHTS['load_markets'][0] + \
+        rs.BINANCE_REQUEST_WEIGHTS['fetch_trading_fee'][0]
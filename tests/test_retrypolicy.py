@@ -0,0 +1,130 @@
+import asyncio
+import random
+
+import ccxt
+import pytest
+
+import retrypolicy as rtp
+
+
+class FlakyExchange:
+    """
+    Exchange api whose requests of the markets in failures raise network errors
+    the given number of times before working
+    """
+    def __init__(self, failures):
+        self.failures = dict(failures)
+        self.requests = []
+
+    def _request(self, symbol):
+        self.requests.append(symbol)
+        if self.failures.get(symbol, 0) > 0:
+            self.failures[symbol] -= 1
+            raise ccxt.RequestTimeout(f"{symbol} timed out")
+        return symbol
+
+    def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None):
+        return self._request(symbol)
+
+    def fetch_trading_fee(self, symbol):
+        raise ccxt.BadSymbol(f"{symbol} does not exist")
+
+    def create_order(self, symbol, type, side, amount):
+        return self._request(symbol)
+
+
+class AsyncFlakyExchange(FlakyExchange):
+    async def fetch_ohlcv(self, symbol, timeframe='1m', since=None, limit=None):
+        return self._request(symbol)
+
+
+def resilient_api(exchange, clock=lambda: 0.):
+    waits = []
+    policy = rtp.RetryPolicy(attempts=3, base_seconds=.5, max_seconds=8,
+                             failures_to_open=5, reset_seconds=30)
+    return rtp.ResilientExchangeApi(exchange, policy, sleep=waits.append, clock=clock), waits
+
+
+def test_backoff_is_jittered_and_capped():
+    policy = rtp.RetryPolicy(base_seconds=.5, max_seconds=8)
+    rng = random.Random(0)
+
+    waits = [[policy.backoff_seconds(retry, rng=rng) for _ in range(200)] for retry in range(8)]
+
+    assert all(0 <= wait <= min(8, .5 * 2 ** retry)
+               for retry, retry_waits in enumerate(waits) for wait in retry_waits)
+    assert max(waits[2]) > 1.5
+    assert len(set(waits[0])) == 200
+
+
+def test_network_errors_are_retried_until_success():
+    exchange = FlakyExchange({'BTC/EUR': 2})
+    api, waits = resilient_api(exchange)
+
+    assert api.fetch_ohlcv(symbol='BTC/EUR') == 'BTC/EUR'
+    assert exchange.requests == ['BTC/EUR'] * 3
+    assert len(waits) == 2
+
+
+def test_orders_and_other_errors_are_not_retried():
+    exchange = FlakyExchange({'BTC/EUR': 1})
+    api, waits = resilient_api(exchange)
+
+    with pytest.raises(ccxt.RequestTimeout):
+        api.create_order('BTC/EUR', 'market', 'sell', 1.)
+    with pytest.raises(ccxt.BadSymbol):
+        api.fetch_trading_fee('XXX/EUR')
+
+    assert exchange.requests == ['BTC/EUR']
+    assert waits == []
+    assert api.open_circuits() == []
+
+
+def test_circuit_of_failing_market_opens_without_affecting_others():
+    now = [0.]
+    exchange = FlakyExchange({'BTC/EUR': 100})
+    api, _ = resilient_api(exchange, clock=lambda: now[0])
+
+    # 3 attempts per call, so the fifth consecutive failure happens in the second call
+    for _ in range(2):
+        with pytest.raises(ccxt.RequestTimeout):
+            api.fetch_ohlcv(symbol='BTC/EUR')
+    with pytest.raises(rtp.CircuitOpenError):
+        api.fetch_ohlcv(symbol='BTC/EUR')
+
+    assert len(exchange.requests) == 5
+    assert api.fetch_ohlcv(symbol='ETH/EUR') == 'ETH/EUR'
+    assert api.open_circuits() == [('fetch_ohlcv', 'BTC/EUR')]
+
+    # A single trial request is sent once reset_seconds have passed
+    now[0] = 31.
+    exchange.failures['BTC/EUR'] = 0
+    assert api.fetch_ohlcv(symbol='BTC/EUR') == 'BTC/EUR'
+    assert api.open_circuits() == []
+
+
+def test_circuit_opens_again_if_the_trial_request_fails():
+    now = [0.]
+    circuit = rtp.CircuitBreaker(failures_to_open=2, reset_seconds=10, clock=lambda: now[0])
+    circuit.record_failure()
+    circuit.record_failure()
+
+    now[0] = 11.
+    circuit.before_request()
+    # Only one trial request at a time
+    with pytest.raises(rtp.CircuitOpenError):
+        circuit.before_request()
+    circuit.record_failure()
+
+    with pytest.raises(rtp.CircuitOpenError):
+        circuit.before_request()
+    assert circuit.is_open
+
+
+def test_async_requests_are_retried():
+    exchange = AsyncFlakyExchange({'BTC/EUR': 1})
+    policy = rtp.RetryPolicy(base_seconds=.001)
+    api = rtp.ResilientExchangeApi(exchange, policy)
+
+    assert asyncio.run(api.fetch_ohlcv(symbol='BTC/EUR')) == 'BTC/EUR'
+    assert exchange.requests == ['BTC/EUR'] * 2
@@ -0,0 +1,161 @@
+import asyncio
+import threading
+import time
+
+import ccxt
+import pandas as pd
+import pytest
+
+import exchangehandler as eh
+import scanengine as se
+
+
+class SlowCandlesExchangeHandler(eh.ExchangeHandler):
+    """
+    Offline exchange handler whose async candle requests take some time, so that
+    the number of simultaneous requests can be measured
+    """
+    def __init__(self):
+        super().__init__(exchange_api=None)
+        self.requests_in_flight = 0
+        self.max_requests_in_flight = 0
+
+    async def get_candles_last_one_not_finished_async(self, symbol, vs_currency,
+                                                      timeframe, num_candles,
+                                                      since=None):
+        self.requests_in_flight += 1
+        self.max_requests_in_flight = max(self.max_requests_in_flight,
+                                          self.requests_in_flight)
+        await asyncio.sleep(.01)
+        self.requests_in_flight -= 1
+        return pd.DataFrame({'close': [1.0] * num_candles})
+
+    async def get_current_price_async(self, symbol, vs_currency):
+        return 1.0
+
+    def buy_market_order(self, symbol, vs_currency, amount): pass
+    def _sell_market_order(self, symbol, vs_currency, amount): pass
+    def sell_market_order_diminishing_amount(self, symbol, vs_currency, amount): pass
+    def fetch_market(self, symbol, vs_currency): pass
+    def get_candles_for_strategy(self, symbol, vs_currency, timeframe, num_candles, since=None): pass
+    def get_candles_last_one_not_finished(self, symbol, vs_currency, timeframe, num_candles, since=None): pass
+    def get_fee_factor(self, symbol, vs_currency, type='spot'): pass
+    def _market_from_symbol_and_vs_currency(self, symbol, vs_currency): pass
+    def get_free_balance(self, symbol): pass
+    def get_current_price(self, symbol, vs_currency): pass
+    def withdraw_fiat_to_bank_account(self, fiat_symbol, fiat_quantity, swift): pass
+
+
+markets = [(f"COIN{i}", "USDT") for i in range(20)]
+
+
+def test_scan_engine_evaluates_every_market_once():
+    evaluated = []
+
+    def evaluate_market(symbol, vs_currency, df, current_price):
+        evaluated.append((symbol, vs_currency, len(df), current_price))
+
+    engine = se.AsyncMarketScanEngine(exchange_handler=SlowCandlesExchangeHandler(),
+                                      evaluate_market=evaluate_market,
+                                      timeframe='4h', num_candles=5)
+    engine.scan(markets)
+    engine.close()
+
+    assert sorted(evaluated) == sorted((s, v, 5, 1.0) for s, v in markets)
+
+
+def test_scan_engine_respects_concurrency_limit():
+    handler = SlowCandlesExchangeHandler()
+    engine = se.AsyncMarketScanEngine(exchange_handler=handler,
+                                      evaluate_market=lambda **kwargs: None,
+                                      timeframe='4h', max_concurrency=3)
+    engine.scan(markets)
+    engine.close()
+
+    assert 1 < handler.max_requests_in_flight <= 3
+
+
+def test_scan_engine_never_evaluates_markets_concurrently():
+    lock = threading.Lock()
+    overlaps = []
+
+    def evaluate_market(**kwargs):
+        if not lock.acquire(blocking=False):
+            overlaps.append(kwargs['symbol'])
+            return
+        time.sleep(.001)
+        lock.release()
+
+    engine = se.AsyncMarketScanEngine(exchange_handler=SlowCandlesExchangeHandler(),
+                                      evaluate_market=evaluate_market,
+                                      timeframe='4h', monitor=lambda: None,
+                                      monitor_interval_seconds=0)
+    engine.scan(markets)
+    engine.close()
+
+    assert overlaps == []
+
+
+def test_scan_engine_propagates_evaluation_exceptions():
+    def evaluate_market(**kwargs):
+        raise RuntimeError("evaluation failed")
+
+    engine = se.AsyncMarketScanEngine(exchange_handler=SlowCandlesExchangeHandler(),
+                                      evaluate_market=evaluate_market,
+                                      timeframe='4h')
+    with pytest.raises(RuntimeError):
+        engine.scan(markets)
+    engine.close()
+
+
+class UnreachableMarketsExchangeHandler(SlowCandlesExchangeHandler):
+    """
+    Offline exchange handler whose candle requests of some markets keep timing out
+    """
+    def __init__(self, unreachable_markets):
+        super().__init__()
+        self.unreachable_markets = unreachable_markets
+
+    async def get_candles_last_one_not_finished_async(self, symbol, vs_currency,
+                                                      timeframe, num_candles,
+                                                      since=None):
+        if (symbol, vs_currency) in self.unreachable_markets:
+            raise ccxt.RequestTimeout(f"{symbol}/{vs_currency} timed out")
+        return await super().get_candles_last_one_not_finished_async(
+            symbol, vs_currency, timeframe, num_candles, since=since)
+
+
+def test_scan_engine_skips_markets_with_network_errors():
+    evaluated = []
+    engine = se.AsyncMarketScanEngine(
+        exchange_handler=UnreachableMarketsExchangeHandler(markets[:3]),
+        evaluate_market=lambda **kwargs: evaluated.append((kwargs['symbol'],
+                                                           kwargs['vs_currency'])),
+        timeframe='4h')
+
+    scanned = engine.scan(markets)
+    engine.close()
+
+    assert sorted(scanned) == sorted(evaluated) == sorted(markets[3:])
+
+
+def test_scan_engine_skips_markets_whose_evaluation_has_network_errors():
+    def evaluate_market(symbol, vs_currency, **kwargs):
+        if (symbol, vs_currency) == markets[0]:
+            raise ccxt.RequestTimeout(f"{symbol}/{vs_currency} timed out")
+
+    def monitor():
+        raise ccxt.NetworkError("monitor failed")
+
+    engine = se.AsyncMarketScanEngine(exchange_handler=SlowCandlesExchangeHandler(),
+                                      evaluate_market=evaluate_market,
+                                      timeframe='4h', monitor=monitor,
+                                      monitor_interval_seconds=3600)
+
+    scanned = engine.scan(markets)
+    engine.close()
+
+    assert sorted(scanned) == sorted(markets[1:])
+    failed = [market for market, _ in engine.network_errors()]
+    assert len(failed) == 2
+    assert markets[0] in failed and 'monitor' in failed
@@ -1,3 +1,5 @@
+import threading
+
 import pytest
 
 import config
@@ -20,3 +22,27 @@ def test_service_manages_risk_on_long_position():
 
     assert enter_vs_currency < vs_currency_on_entry
 
+
+
+def test_every_thread_has_its_own_repository_tick(monkeypatch):
+    provide_testing_repository = rp.provide_sqlalchemy_repository
+    monkeypatch.setattr(rp, 'provide_sqlalchemy_repository',
+                        lambda real_db, open_position_index=None:
+                        provide_testing_repository(False, open_position_index))
+    repositories = []
+    provide = services.in_repository_tick(
+        lambda: repositories.append(services.provide_repository()))
+
+    with services.repository_tick() as repo:
+        with services.repository_tick() as nested_repo:
+            assert nested_repo is repo
+        worker = threading.Thread(target=provide)
+        worker.start()
+        worker.join()
+        provide()
+
+    assert repositories[0] is not repo
+    assert repositories[1] is repo
+    # Outside a tick, the session would never be closed
+    with pytest.raises(RuntimeError):
+        services.provide_repository()